@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks and reports for the face recognition pipeline
+
+Usage:
+    python benchmark_performance.py storage [--encodings data/encodings.pkl] [--synthetic N]
+    python benchmark_performance.py mediapipe [--image face.jpg] [--frames 50]
+    python benchmark_performance.py lbp [--faces 16] [--repeat 20]
+    python benchmark_performance.py pool [--image face.jpg] [--frames 100] [--workers N]
+"""
+
+import argparse
+import contextlib
+import io
+import time
+import numpy as np
+
+from face_recognition_modules.gallery import CompactFaceGallery, storage_report
+
+
+def load_gallery_encodings(encodings_file: str, synthetic: int = 0):
+    """Encodings by user from FaceEncoder, or a synthetic gallery of N users"""
+    if synthetic > 0:
+        rng = np.random.default_rng(0)
+        # Roughly the spread of dlib encodings: components of about +-0.1 around a shared mean
+        centers = rng.normal(0.0, 0.1, size=(synthetic, 128))
+        return {
+            user_id: list(center + rng.normal(0.0, 0.03, size=(3, 128)))
+            for user_id, center in enumerate(centers)
+        }
+
+    from face_recognition_modules.face_encoder import FaceEncoder
+    encoder = FaceEncoder(encodings_file)
+    return {user_id: [encoding] for user_id, encoding in encoder.known_encodings.items()}
+
+
+def run_storage_report(args):
+    """Accuracy versus memory for float32 / float16 / int8 gallery storage"""
+    encodings_by_label = load_gallery_encodings(args.encodings, args.synthetic)
+    report = storage_report(encodings_by_label, metric=args.metric, tolerance=args.tolerance)
+
+    if not report:
+        print("Not enough encodings for a storage report (need at least 2)")
+        return
+
+    print("Gallery storage report")
+    print("=" * 86)
+    print(f"{'storage':<14}{'bytes':>12}{'B/exemplar':>12}{'top1 agree':>12}"
+          f"{'decision':>11}{'max err':>12}{'mean err':>12}")
+    for row in report:
+        print(f"{row['storage']:<14}{row['bytes']:>12}{row['bytes_per_exemplar']:>12.1f}"
+              f"{row['top1_agreement']:>12.4f}{row['decision_agreement']:>11.4f}"
+              f"{row['max_distance_error']:>12.5f}{row['mean_distance_error']:>12.5f}")
+
+    # Galleries are normally created empty and filled user by user through add()
+    # (FaceEncoder, SafeFaceRecognizer.add_user), not by one build()
+    print()
+    print("Incremental fill: build({}) then add() per user, every exemplar searched")
+    ok = True
+    for storage in ('float16', 'int8'):
+        gallery = CompactFaceGallery(metric=args.metric, storage=storage)
+        gallery.build({})
+        for label, encodings in encodings_by_label.items():
+            gallery.add(label, encodings)
+
+        probes, labels = [], []
+        for label, encodings in encodings_by_label.items():
+            probes.extend(encodings)
+            labels.extend([label] * len(encodings))
+        matches = gallery.match(np.asarray(probes), args.tolerance)
+        hits = sum(user_id == label for (user_id, _), label in zip(matches, labels))
+        worst = max(distance for _, distance in matches)
+        print(f"{storage:<14}own label {hits}/{len(labels)}   worst own distance {worst:.5f}")
+        ok = ok and hits == len(labels)
+
+    if not ok:
+        raise SystemExit(1)
+
+
+def load_frame(image_path: str = None, size=(480, 640)) -> np.ndarray:
+    """RGB test frame from an image file, or a blank frame of the given size"""
+    if image_path:
+        import cv2
+        image = cv2.imread(image_path)
+        if image is None:
+            raise ValueError(f"Could not load image: {image_path}")
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return np.zeros((size[0], size[1], 3), dtype=np.uint8)
+
+
+def time_per_frame(step, frames: int, warmup: int = 3) -> np.ndarray:
+    """Wall-clock milliseconds of each call to step(), after a few warm-up calls"""
+    for _ in range(warmup):
+        step()
+    timings = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        step()
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return np.asarray(timings)
+
+
+def print_latency_table(title: str, rows):
+    print(title)
+    print("=" * 62)
+    print(f"{'variant':<26}{'mean ms':>12}{'p95 ms':>12}{'fps':>12}")
+    for name, timings in rows:
+        mean = timings.mean()
+        print(f"{name:<26}{mean:>12.2f}{np.percentile(timings, 95):>12.2f}{1000.0 / mean:>12.1f}")
+
+
+def run_mediapipe_benchmark(args):
+    """Per-frame latency: MediaPipe graphs built per call versus borrowed from the pool"""
+    from face_recognition_modules.mediapipe_recognizer import MediaPipeFaceRecognition, mediapipe_pool
+
+    frame = load_frame(args.image)
+
+    def per_call():
+        # What safe_face_locations / safe_face_encodings did before: two new instances per frame
+        locations = MediaPipeFaceRecognition().face_locations(frame)
+        MediaPipeFaceRecognition().face_encodings(frame, locations)
+
+    def pooled():
+        recognizer = mediapipe_pool.get()
+        locations = recognizer.face_locations(frame)
+        recognizer.face_encodings(frame, locations)
+
+    def video_mode():
+        # Live path: the per-stream instance, detector boxes + one mesh run in video mode
+        mediapipe_pool.get(stream=0).face_locations_and_encodings(frame)
+
+    # The recognizer logs on construction; keep it out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = [
+            ("new instances per call", time_per_frame(per_call, args.frames)),
+            ("pooled instance", time_per_frame(pooled, args.frames)),
+            ("pooled, video mode stream", time_per_frame(video_mode, args.frames)),
+        ]
+        mediapipe_pool.close_all()
+
+    print_latency_table(f"MediaPipe per-frame latency ({frame.shape[1]}x{frame.shape[0]}, {args.frames} frames)", rows)
+
+
+def reference_simple_lbp(image: np.ndarray, radius: int = 1) -> np.ndarray:
+    """The original per-pixel loop of MediaPipeFaceRecognition._simple_lbp, kept for parity checks"""
+    height, width = image.shape
+    lbp = np.zeros((height, width), dtype=np.uint8)
+
+    for i in range(radius, height - radius):
+        for j in range(radius, width - radius):
+            center = image[i, j]
+            code = 0
+
+            neighbors = [
+                image[i-1, j-1], image[i-1, j], image[i-1, j+1],
+                image[i, j+1], image[i+1, j+1], image[i+1, j],
+                image[i+1, j-1], image[i, j-1]
+            ]
+
+            for k, neighbor in enumerate(neighbors):
+                if neighbor >= center:
+                    code |= (1 << k)
+
+            lbp[i, j] = code
+
+    hist, _ = np.histogram(lbp.ravel(), bins=32, range=[0, 256])
+    return hist.astype(np.float64)
+
+
+def run_lbp_benchmark(args):
+    """Parity of the vectorized LBP against the loop version, then its speed-up"""
+    from face_recognition_modules.mediapipe_recognizer import mediapipe_pool
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        recognizer = mediapipe_pool.get()
+
+    rng = np.random.default_rng(0)
+    faces = rng.integers(0, 256, size=(args.faces, 64, 64), dtype=np.uint8)
+    # Flat and low-contrast crops exercise the >= ties
+    faces[0] = 128
+    faces[1] = rng.integers(100, 103, size=(64, 64), dtype=np.uint8)
+
+    reference = np.stack([reference_simple_lbp(face) for face in faces])
+    single = np.stack([recognizer._simple_lbp(face) for face in faces])
+    batch = recognizer._simple_lbp_batch(faces)
+    parity = np.array_equal(reference, single) and np.array_equal(reference, batch)
+    print(f"LBP parity with the loop version on {args.faces} crops: {'OK' if parity else 'MISMATCH'}")
+
+    rows = [
+        ("loop, per face", time_per_frame(lambda: [reference_simple_lbp(face) for face in faces], args.repeat, 1)),
+        ("vectorized, per face", time_per_frame(lambda: [recognizer._simple_lbp(face) for face in faces], args.repeat)),
+        ("vectorized, batch", time_per_frame(lambda: recognizer._simple_lbp_batch(faces), args.repeat)),
+    ]
+    print_latency_table(f"LBP on {args.faces} 64x64 crops per call", rows)
+    mediapipe_pool.close_all()
+
+    if not parity:
+        raise SystemExit(1)
+
+
+def run_pool_benchmark(args):
+    """Throughput of detection + encoding: one in-process instance versus the process pool"""
+    from face_recognition_modules.mediapipe_recognizer import MediaPipeFaceRecognition
+    from face_recognition_modules.process_pool import ProcessRecognitionPool
+
+    import cv2
+
+    frame = load_frame(args.image)
+    # The pool is fed BGR frames, as a camera delivers them; the reference
+    # runs on the RGB frame the thread path hands to the model
+    camera_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        recognizer = MediaPipeFaceRecognition(static_image_mode=True)
+        expected = recognizer.face_locations_and_encodings(frame)
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            recognizer.face_locations_and_encodings(frame)
+        single_fps = args.frames / (time.perf_counter() - start)
+        recognizer.close()
+
+    with ProcessRecognitionPool(num_workers=args.workers, backend='mediapipe') as pool:
+        # Warm up: every worker builds its graphs before timing starts
+        for _ in range(pool.num_workers):
+            pool.submit(camera_frame)
+            while pool.in_flight >= pool.num_workers:
+                pool.poll(timeout=1.0)
+        pool.drain(timeout=60.0)
+
+        results = []
+        start = time.perf_counter()
+        for frame_id in range(args.frames):
+            # Submit only when a worker is idle, so throughput is measured without drops
+            while pool.in_flight >= pool.num_workers:
+                results.extend(pool.poll(timeout=1.0))
+            pool.submit(camera_frame, frame_id)
+        results.extend(pool.drain(timeout=60.0))
+        pool_fps = args.frames / (time.perf_counter() - start)
+
+    in_order = [result[0] for result in results] == list(range(args.frames))
+    parity = all(
+        result[1] == expected[0] and len(result[2]) == len(expected[1]) and
+        all(np.allclose(a, b, atol=1e-5) for a, b in zip(result[2], expected[1]))
+        for result in results
+    )
+
+    print(f"Detection + encoding throughput ({frame.shape[1]}x{frame.shape[0]}, {args.frames} frames)")
+    print("=" * 62)
+    print(f"{'in-process, 1 instance':<32}{single_fps:>12.1f} fps")
+    print(f"{f'process pool, {pool.num_workers} workers':<32}{pool_fps:>12.1f} fps")
+    print(f"results in frame order: {'OK' if in_order else 'MISMATCH'}")
+    print(f"parity with in-process: {'OK' if parity else 'MISMATCH'}")
+
+    if not (in_order and parity):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Face attendance performance benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    storage_parser = subparsers.add_parser('storage', help="gallery storage accuracy vs memory")
+    storage_parser.add_argument('--encodings', default="data/encodings.pkl")
+    storage_parser.add_argument('--synthetic', type=int, default=0, help="use N synthetic users")
+    storage_parser.add_argument('--metric', choices=['euclidean', 'cosine'], default='euclidean')
+    storage_parser.add_argument('--tolerance', type=float, default=0.6)
+    storage_parser.set_defaults(func=run_storage_report)
+
+    mediapipe_parser = subparsers.add_parser('mediapipe', help="MediaPipe per-frame latency, pooled vs per call")
+    mediapipe_parser.add_argument('--image', default=None, help="test frame (default: blank 640x480)")
+    mediapipe_parser.add_argument('--frames', type=int, default=50)
+    mediapipe_parser.set_defaults(func=run_mediapipe_benchmark)
+
+    lbp_parser = subparsers.add_parser('lbp', help="vectorized LBP parity check and micro-benchmark")
+    lbp_parser.add_argument('--faces', type=int, default=16)
+    lbp_parser.add_argument('--repeat', type=int, default=20)
+    lbp_parser.set_defaults(func=run_lbp_benchmark)
+
+    pool_parser = subparsers.add_parser('pool', help="process pool throughput and ordering check")
+    pool_parser.add_argument('--image', default=None, help="test frame (default: blank 640x480)")
+    pool_parser.add_argument('--frames', type=int, default=100)
+    pool_parser.add_argument('--workers', type=int, default=None,
+                             help="default: PERFORMANCE_CONFIG['face_recognition_workers']")
+    pool_parser.set_defaults(func=run_pool_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -39,6 +39,7 @@ CAMERA_CONFIG = {
     'frame_height': 480,
     'fps': 30,
     'buffer_size': 1,
+    'max_cameras': 3,  # camera chạy song song (mỗi lối vào một camera)
     'auto_exposure': True,
     'brightness': 50,
     'contrast': 50,
@@ -103,6 +104,35 @@ PERFORMANCE_CONFIG = {
     'cache_size_mb': 100,
     'process_every_nth_frame': 3,  
     'resize_factor': 0.25,  
+    'gallery_index': 'exact',  # 'exact', 'ivf', 'pca' hoặc 'sharded' (chia gallery cho nhiều process)
+    'ann_nlist': 0,
+    'ann_nprobe': 8,
+    'ann_min_gallery_size': 2000,
+    'pca_components': 32,
+    'pca_shortlist': 64,
+    'pca_min_gallery_size': 500,
+    'gallery_storage': 'float32',
+    'tracking_enabled': True,
+    'keyframe_interval': 5,
+    'track_min_confidence': 0.5,
+    'track_refresh_frames': 30,
+    'motion_gate_enabled': True,
+    'motion_threshold': 3.0,
+    'motion_downsample_width': 64,
+    'motion_max_static_frames': 150,
+    'roi_detection_enabled': True,  # chỉ detector face_recognition (dlib); MediaPipe luôn quét toàn khung
+    'roi_full_scan_interval': 10,
+    'roi_margin': 0.5,
+    'video_max_num_faces': 10,  # FaceMesh video mode: số khuôn mặt tối đa có landmarks mỗi frame
+    'adaptive_control_enabled': True,
+    'target_fps': 20,
+    'latency_budget_ms': 100,
+    'max_frame_stride': 6,
+    'min_resize_factor': 0.25,
+    'max_resize_factor': 1.0,
+    'detector_min_face_px': 24,
+    'recognition_backend': 'thread',
+    'offline_frame_stride': 5,  # process_video.py: xử lý 1 trong N frame của video
 }
 
 ATTENDANCE_RULES = {
@@ -204,6 +234,39 @@ def validate_config():
     if not 0.1 <= tolerance <= 1.0:
         errors.append("Face recognition tolerance phải trong khoảng 0.1 - 1.0")
 
+    if PERFORMANCE_CONFIG.get('gallery_index', 'exact') not in ('exact', 'ivf', 'pca', 'sharded'):
+        errors.append("gallery_index phải là 'exact', 'ivf', 'pca' hoặc 'sharded'")
+
+    if PERFORMANCE_CONFIG.get('gallery_storage', 'float32') not in ('float32', 'float16', 'int8'):
+        errors.append("gallery_storage phải là 'float32', 'float16' hoặc 'int8'")
+
+    if PERFORMANCE_CONFIG.get('face_recognition_workers', 2) < 1:
+        errors.append("face_recognition_workers phải >= 1")
+
+    if PERFORMANCE_CONFIG.get('keyframe_interval', 5) < 1:
+        errors.append("keyframe_interval phải >= 1")
+
+    if PERFORMANCE_CONFIG.get('video_max_num_faces', 10) < 1:
+        errors.append("video_max_num_faces phải >= 1")
+
+    if PERFORMANCE_CONFIG.get('motion_threshold', 3.0) < 0:
+        errors.append("motion_threshold phải >= 0")
+
+    if not 0 < PERFORMANCE_CONFIG.get('min_resize_factor', 0.25) <= PERFORMANCE_CONFIG.get('max_resize_factor', 1.0) <= 1.0:
+        errors.append("Cần 0 < min_resize_factor <= max_resize_factor <= 1")
+
+    if PERFORMANCE_CONFIG.get('recognition_backend', 'thread') not in ('thread', 'process'):
+        errors.append("recognition_backend phải là 'thread' hoặc 'process'")
+
+    if PERFORMANCE_CONFIG.get('offline_frame_stride', 5) < 1:
+        errors.append("offline_frame_stride phải >= 1")
+
+    if CAMERA_CONFIG.get('max_cameras', 3) < 1:
+        errors.append("max_cameras phải >= 1")
+
+    if PERFORMANCE_CONFIG.get('max_frame_stride', 6) < 1:
+        errors.append("max_frame_stride phải >= 1")
+
     for key, path in PATHS_CONFIG.items():
         if key.endswith('_directory'):
             abs_path = get_absolute_path(path)
@@ -1,32 +1,50 @@
 import pyodbc
 import logging
+import threading
+import time
 from typing import Optional, List, Dict, Any
 
 class DatabaseManager:
+    # Seconds a class's enrollment version read from the database is trusted
+    ENROLLMENT_VERSION_TTL = 5.0
+    
     def __init__(self):
         self.server = r'DUCCKY\SQLEXPRESS'
         self.database = 'face_attendance'
         self.connection_string = f'DRIVER={{SQL Server}};SERVER={self.server};DATABASE={self.database};Trusted_Connection=yes;'
         self.connection = None
+        # The UI thread, the class loader and the recognition workers share one
+        # pyodbc connection (threadsafety 1: connections must not be shared
+        # concurrently), so every use of it goes through this lock
+        self._lock = threading.RLock()
+        self._enrollment_versions = {}  # class_id -> (version, read at)
+        self._local_enrollment_versions = {}
+        self._has_enrollment_version = None  # classes.enrollment_version exists; None = not checked yet
         
     def connect(self) -> bool:
         """Kết nối đến database"""
-        try:
-            self.connection = pyodbc.connect(self.connection_string)
-            logging.info("Kết nối database thành công")
-            return True
-        except Exception as e:
-            logging.error(f"Lỗi kết nối database: {e}")
-            return False
+        with self._lock:
+            try:
+                self.connection = pyodbc.connect(self.connection_string)
+                logging.info("Kết nối database thành công")
+                return True
+            except Exception as e:
+                logging.error(f"Lỗi kết nối database: {e}")
+                return False
     
     def disconnect(self):
         """Ngắt kết nối database"""
-        if self.connection:
-            self.connection.close()
-            logging.info("Đã ngắt kết nối database")
+        with self._lock:
+            if self.connection:
+                self.connection.close()
+                logging.info("Đã ngắt kết nối database")
     
     def execute_query(self, query: str, params: tuple = None) -> Optional[List[Dict]]:
         """Thực hiện query SELECT và trả về kết quả"""
+        with self._lock:
+            return self._execute_query(query, params)
+    
+    def _execute_query(self, query: str, params: tuple = None) -> Optional[List[Dict]]:
         try:
             if not self.connection:
                 if not self.connect():
@@ -55,6 +73,10 @@ class DatabaseManager:
     
     def execute_non_query(self, query: str, params: tuple = None) -> bool:
         """Thực hiện query INSERT, UPDATE, DELETE"""
+        with self._lock:
+            return self._execute_non_query(query, params)
+    
+    def _execute_non_query(self, query: str, params: tuple = None) -> bool:
         try:
             if not self.connection:
                 if not self.connect():
@@ -78,15 +100,16 @@ class DatabaseManager:
     
     def get_last_insert_id(self) -> Optional[int]:
         """Lấy ID của record vừa được insert"""
-        try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT @@IDENTITY")
-            result = cursor.fetchone()
-            cursor.close()
-            return result[0] if result else None
-        except Exception as e:
-            logging.error(f"Lỗi lấy last insert ID: {e}")
-            return None
+        with self._lock:
+            try:
+                cursor = self.connection.cursor()
+                cursor.execute("SELECT @@IDENTITY")
+                result = cursor.fetchone()
+                cursor.close()
+                return result[0] if result else None
+            except Exception as e:
+                logging.error(f"Lỗi lấy last insert ID: {e}")
+                return None
     
     def add_user(self, name: str, student_id: str, role: str, image_path: str = None) -> bool:
         """Thêm người dùng mới"""
@@ -169,12 +192,71 @@ class DatabaseManager:
         return result[0] if result else None
     
     def enroll_student(self, class_id: int, student_id: int) -> bool:
-        """Đăng ký sinh viên vào lớp"""
+        """Đăng ký sinh viên vào lớp (kích hoạt lại nếu đã từng hủy đăng ký)"""
+        # unenroll_student only deactivates the row, and (class_id, student_id) is unique
+        query = """
+        IF EXISTS (SELECT 1 FROM enrollments WHERE class_id = ? AND student_id = ?)
+            UPDATE enrollments SET is_active = 1, enrolled_at = GETDATE() 
+            WHERE class_id = ? AND student_id = ?
+        ELSE
+            INSERT INTO enrollments (class_id, student_id) 
+            VALUES (?, ?)
+        """
+        success = self.execute_non_query(query, (class_id, student_id) * 3)
+        if success:
+            self._bump_enrollment_version(class_id)
+        return success
+    
+    def unenroll_student(self, class_id: int, student_id: int) -> bool:
+        """Hủy đăng ký sinh viên khỏi lớp"""
         query = """
-        INSERT INTO enrollments (class_id, student_id) 
-        VALUES (?, ?)
+        UPDATE enrollments SET is_active = 0 
+        WHERE class_id = ? AND student_id = ?
+        """
+        success = self.execute_non_query(query, (class_id, student_id))
+        if success:
+            self._bump_enrollment_version(class_id)
+        return success
+    
+    def get_enrollment_version(self, class_id: int):
         """
-        return self.execute_non_query(query, (class_id, student_id))
+        Phiên bản danh sách đăng ký của lớp, thay đổi mỗi khi đăng ký thay đổi
+        Dùng để làm mới cache gallery theo lớp (chỉ so sánh bằng)
+        classes.enrollment_version được trigger trên enrollments tăng, kể cả
+        khi dữ liệu bị sửa bởi tiến trình khác; nó được đọc lại tối đa mỗi
+        ENROLLMENT_VERSION_TTL giây, thay đổi qua đối tượng này có hiệu lực ngay
+        """
+        with self._lock:
+            if not self._check_enrollment_version_column():
+                # Older schema without the column: only local changes are seen
+                return None, self._local_enrollment_versions.get(class_id, 0)
+            
+            now = time.monotonic()
+            cached = self._enrollment_versions.get(class_id)
+            if cached is None or now - cached[1] >= self.ENROLLMENT_VERSION_TTL:
+                result = self._execute_query("SELECT enrollment_version FROM classes WHERE id = ?", (class_id,))
+                db_version = result[0]['enrollment_version'] if result else None
+                cached = (db_version, now)
+                self._enrollment_versions[class_id] = cached
+            
+            return cached[0], self._local_enrollment_versions.get(class_id, 0)
+    
+    def _check_enrollment_version_column(self) -> bool:
+        """Whether classes.enrollment_version exists; looked up once"""
+        if self._has_enrollment_version is None:
+            result = self._execute_query("SELECT COL_LENGTH('classes', 'enrollment_version') AS length")
+            if result is None:
+                # Query failed (no connection?): ask again next time
+                return False
+            self._has_enrollment_version = result[0]['length'] is not None
+            if not self._has_enrollment_version:
+                logging.info("classes.enrollment_version không tồn tại, chỉ theo dõi thay đổi đăng ký cục bộ")
+        return self._has_enrollment_version
+    
+    def _bump_enrollment_version(self, class_id: int):
+        with self._lock:
+            self._local_enrollment_versions[class_id] = self._local_enrollment_versions.get(class_id, 0) + 1
+            self._enrollment_versions.pop(class_id, None)
     
     def get_students_in_class(self, class_id: int) -> List[Dict]:
         """Lấy danh sách sinh viên trong lớp"""
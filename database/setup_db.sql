@@ -22,6 +22,7 @@ CREATE TABLE classes (
     instructor_id INT,
     created_at DATETIME DEFAULT GETDATE(),
     is_active BIT DEFAULT 1,
+    enrollment_version INT NOT NULL DEFAULT 0,
     FOREIGN KEY (instructor_id) REFERENCES users(id)
 );
 
@@ -36,6 +37,13 @@ CREATE TABLE enrollments (
     UNIQUE(class_id, student_id)
 );
 
+-- Any enrollment change, from the app or not, invalidates the cached class galleries
+CREATE TRIGGER trg_enrollments_version ON enrollments
+AFTER INSERT, UPDATE, DELETE
+AS
+UPDATE classes SET enrollment_version = enrollment_version + 1
+WHERE id IN (SELECT class_id FROM inserted UNION SELECT class_id FROM deleted);
+
 CREATE TABLE attendance_records (
     id INT IDENTITY(1,1) PRIMARY KEY,
     user_id INT NOT NULL,
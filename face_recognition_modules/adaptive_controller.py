@@ -0,0 +1,115 @@
+# face_recognition_modules/adaptive_controller.py
+
+"""
+Adaptive frame-rate / resolution controller
+Measures per-stage recognition latency and adjusts the frame stride
+(process_every_nth_frame) and detection scale (resize_factor) to hold a
+target FPS and a latency budget, within hard bounds
+"""
+
+try:
+    from config import PERFORMANCE_CONFIG, FACE_RECOGNITION_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+    FACE_RECOGNITION_CONFIG = {}
+
+
+class AdaptiveController:
+    """
+    target_fps: camera frames per second the recognition cost must sustain;
+        the cost of a processed frame is spread over `stride` frames
+    latency_budget_ms: maximum latency of a single processed frame
+    max_stride, min_scale, max_scale: hard bounds of the two knobs
+    min_face_size: smallest face (pixels, original frame) that must stay
+        detectable; with detector_min_face_px, the smallest face the detector
+        resolves, it puts a floor under the detection scale
+    adjust_every: processed frames between two adjustments
+    """
+
+    SCALE_STEP = 0.85
+
+    def __init__(self, enabled=None, target_fps=None, latency_budget_ms=None,
+                 stride=None, scale=None, max_stride=None, min_scale=None,
+                 max_scale=None, min_face_size=None, detector_min_face_px=None,
+                 adjust_every=10):
+        config = PERFORMANCE_CONFIG
+        self.enabled = enabled if enabled is not None else config.get('adaptive_control_enabled', True)
+        self.target_fps = target_fps or config.get('target_fps', 20)
+        self.latency_budget_ms = latency_budget_ms or config.get('latency_budget_ms', 100)
+        self.max_stride = max(1, max_stride or config.get('max_frame_stride', 6))
+        self.max_scale = min(1.0, max_scale or config.get('max_resize_factor', 1.0))
+
+        if min_face_size is None:
+            min_face_size = FACE_RECOGNITION_CONFIG.get('min_face_size', (50, 50))
+        if isinstance(min_face_size, (tuple, list)):
+            min_face_size = min(min_face_size)
+        detector_min_face_px = detector_min_face_px or config.get('detector_min_face_px', 24)
+        quality_floor = detector_min_face_px / float(min_face_size)
+        self.min_scale = min(self.max_scale, max(min_scale or config.get('min_resize_factor', 0.25), quality_floor))
+
+        self.adjust_every = adjust_every
+        self.stride = self._clamp_stride(stride or config.get('process_every_nth_frame', 1))
+        self.scale = self._clamp_scale(scale or config.get('resize_factor', 1.0))
+        self.stage_ms = {}
+        self.latency_ms = 0.0
+        self._samples = 0
+
+    def _clamp_stride(self, stride):
+        return int(min(self.max_stride, max(1, stride)))
+
+    def _clamp_scale(self, scale):
+        return float(min(self.max_scale, max(self.min_scale, scale)))
+
+    @property
+    def frame_budget_ms(self):
+        return 1000.0 / self.target_fps
+
+    @property
+    def amortized_ms(self):
+        """Recognition cost per camera frame"""
+        return self.latency_ms / self.stride
+
+    def should_process(self, frame_number):
+        return frame_number % self.stride == 0
+
+    def record(self, stage_ms):
+        """
+        Report the stage timings (ms) of one processed frame, e.g.
+        {'detect': 4.1, 'encode': 6.3, 'track': 0.8}
+        """
+        for stage, value in stage_ms.items():
+            previous = self.stage_ms.get(stage)
+            self.stage_ms[stage] = value if previous is None else 0.8 * previous + 0.2 * value
+
+        total = sum(stage_ms.values())
+        self.latency_ms = total if self._samples == 0 else 0.8 * self.latency_ms + 0.2 * total
+        self._samples += 1
+
+        if self.enabled and self._samples % self.adjust_every == 0:
+            self._adjust()
+
+    def _adjust(self):
+        over_latency = self.latency_ms > self.latency_budget_ms
+        over_rate = self.amortized_ms > self.frame_budget_ms
+
+        if over_latency or over_rate:
+            # Detection cost shrinks with the scale, and only scaling helps
+            # the latency of a single frame; the stride only helps the rate
+            detect_share = self.stage_ms.get('detect', 0.0) / max(self.latency_ms, 1e-6)
+            if self.scale > self.min_scale and (over_latency or detect_share >= 0.5):
+                self.scale = self._clamp_scale(self.scale * self.SCALE_STEP)
+            elif over_rate:
+                self.stride = self._clamp_stride(self.stride + 1)
+            return
+
+        # Well within both budgets: give quality back, stride first
+        if (self.latency_ms < 0.6 * self.latency_budget_ms
+                and self.amortized_ms < 0.6 * self.frame_budget_ms):
+            if self.stride > 1 and self.latency_ms / (self.stride - 1) < 0.8 * self.frame_budget_ms:
+                self.stride = self._clamp_stride(self.stride - 1)
+            elif self.scale < self.max_scale:
+                self.scale = self._clamp_scale(self.scale / self.SCALE_STEP)
+
+    def summary(self):
+        return (f"stride {self.stride}  scale {self.scale:.2f}  "
+                f"{self.latency_ms:.1f} ms/{self.latency_budget_ms:.0f} ms")
@@ -4,10 +4,40 @@ import numpy as np
 from typing import List, Tuple, Optional
 import logging
 
+from .roi_detection import ROIDetector
+
+try:
+    from utils.helpers import crop_face_region
+except ImportError:
+    crop_face_region = None
+
+try:
+    from config import PERFORMANCE_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+
 class FaceDetector:
-    def __init__(self):
+    """
+    Hai độ phân giải: phát hiện trên bản thu nhỏ (một hệ số scale duy nhất),
+    khung được đổi ngược chính xác về tọa độ ảnh gốc, còn encoding tính trên
+    vùng cắt có padding từ ảnh gốc độ phân giải đầy đủ
+    detection_scale: hệ số thu nhỏ cố định; None = vừa khung 640x480
+    encoding_padding: padding (pixel) của vùng cắt dùng để encode
+    """
+    
+    MAX_DETECTION_SIZE = (640, 480)
+    
+    def __init__(self, roi_detection: Optional[bool] = None, detection_scale: Optional[float] = None,
+                 encoding_padding: int = 20):
+        self.detection_scale = detection_scale
+        self.encoding_padding = encoding_padding
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
         
+        # Camera frames: between full scans only search around the previous faces
+        if roi_detection is None:
+            roi_detection = PERFORMANCE_CONFIG.get('roi_detection_enabled', True)
+        self.roi_detector = ROIDetector() if roi_detection else None
+        
     def detect_faces_opencv(self, frame) -> List[Tuple[int, int, int, int]]:
         """
         Phát hiện khuôn mặt sử dụng OpenCV Cascade
@@ -22,10 +52,24 @@ class FaceDetector:
         )
         return faces.tolist()
     
-    def detect_faces_fr(self, frame) -> List[Tuple[int, int, int, int]]:
+    def detection_scale_for(self, frame) -> float:
+        """Hệ số thu nhỏ dùng để phát hiện khuôn mặt trên frame này"""
+        if self.detection_scale is not None:
+            return min(1.0, self.detection_scale)
+        
+        height, width = frame.shape[:2]
+        max_width, max_height = self.MAX_DETECTION_SIZE
+        return min(1.0, max_width / width, max_height / height)
+    
+    def detect_faces_fr(self, frame, full_scan: bool = False, scale: Optional[float] = None) -> List[Tuple[int, int, int, int]]:
         """
         Phát hiện khuôn mặt sử dụng face_recognition
-        Returns: List of (top, right, bottom, left) tuples - định dạng face_recognition
+        Returns: List of (top, right, bottom, left) tuples - định dạng face_recognition,
+            theo tọa độ của frame gốc
+        Với roi_detection, giữa các lần quét toàn khung chỉ tìm quanh khuôn mặt trước
+        full_scan: bắt buộc quét toàn khung (ảnh không thuộc luồng camera),
+            không làm thay đổi trạng thái ROI của luồng
+        scale: hệ số thu nhỏ khi phát hiện (mặc định detection_scale_for(frame))
         """
         try:
             if frame is None:
@@ -44,13 +88,38 @@ class FaceDetector:
             if height < min_height or width < min_width:
                 logging.error(f"Frame too small for face detection: {frame.shape}")
                 return []
-            if width > 640 or height > 480:
-                scale = min(640 / width, 480 / height)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                small_frame = cv2.resize(frame, (new_width, new_height))
+            
+            if scale is None:
+                scale = self.detection_scale_for(frame)
+            
+            # ROI crops are scanned at the same scale as the full frame
+            def scan(image):
+                return self._locate_faces(image, scale)
+            
+            if self.roi_detector is not None:
+                return self.roi_detector.detect(frame, scan, full_scan)
+            return scan(frame)
+            
+        except Exception as e:
+            logging.error(f"Lỗi phát hiện khuôn mặt: {e}")
+            return []
+    
+    def _locate_faces(self, frame, scale: float = 1.0) -> List[Tuple[int, int, int, int]]:
+        """
+        face_recognition trên ảnh (toàn khung hoặc vùng ROI) thu nhỏ theo scale
+        Returns: (top, right, bottom, left) theo tọa độ của ảnh đầu vào
+        """
+        try:
+            height, width = frame.shape[:2]
+            if scale < 1.0:
+                new_width = max(1, int(round(width * scale)))
+                new_height = max(1, int(round(height * scale)))
+                small_frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
+                # Exact per-axis factors of the resized copy
+                scale_x, scale_y = new_width / width, new_height / height
             else:
-                small_frame = frame.copy()
+                small_frame = frame
+                scale_x = scale_y = 1.0
             rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
             
             if rgb_small_frame.dtype != np.uint8:
@@ -68,8 +137,11 @@ class FaceDetector:
                 logging.error(f"face_recognition error: {e}. Frame info: shape={rgb_small_frame.shape}, dtype={rgb_small_frame.dtype}, min={rgb_small_frame.min()}, max={rgb_small_frame.max()}")
                 return []
             
-            face_locations = [(top*4, right*4, bottom*4, left*4) 
-                            for (top, right, bottom, left) in face_locations]
+            face_locations = [
+                (max(0, int(round(top / scale_y))), min(width, int(round(right / scale_x))),
+                 min(height, int(round(bottom / scale_y))), max(0, int(round(left / scale_x))))
+                for (top, right, bottom, left) in face_locations
+            ]
             
             return face_locations
             
@@ -80,43 +152,78 @@ class FaceDetector:
     def get_face_encodings(self, frame, face_locations: List[Tuple[int, int, int, int]]) -> List[np.ndarray]:
         """
         Trích xuất encodings từ khuôn mặt
+        face_locations: tọa độ frame gốc (như detect_faces_fr trả về); mỗi khuôn
+        mặt được encode từ vùng cắt có padding của frame độ phân giải đầy đủ
+        Returns: encodings theo thứ tự các khung; khuôn mặt không encode được bị
+            bỏ qua, dùng encode_face_locations để biết khung nào còn lại
+        """
+        return self.encode_face_locations(frame, face_locations)[1]
+    
+    def encode_face_locations(self, frame, face_locations: List[Tuple[int, int, int, int]]) -> Tuple[List[Tuple[int, int, int, int]], List[np.ndarray]]:
+        """
+        Như get_face_encodings, nhưng trả về cả các khung đã encode được
+        Một vùng cắt rỗng chỉ làm mất khuôn mặt đó, không phải cả frame
+        Returns: (face_locations, face_encodings), cùng độ dài và thứ tự
         """
         try:
             if frame is None:
                 logging.error("Frame is None")
-                return []
+                return [], []
             
             if frame.dtype != np.uint8:
                 frame = frame.astype(np.uint8)
             
             if len(frame.shape) != 3 or frame.shape[2] != 3:
                 logging.error(f"Invalid frame shape: {frame.shape}")
-                return []
-            
-            small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-            
-            if rgb_small_frame.dtype != np.uint8:
-                rgb_small_frame = rgb_small_frame.astype(np.uint8)
-            
-            small_face_locations = [(int(top/4), int(right/4), int(bottom/4), int(left/4)) 
-                                  for (top, right, bottom, left) in face_locations]
+                return [], []
+            
+            kept_locations = []
+            face_encodings = []
+            for face_location in face_locations:
+                crop, crop_location = self._crop_face(frame, face_location)
+                if crop is None:
+                    logging.error(f"Empty face crop: {face_location}")
+                    continue
+                
+                rgb_crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+                encodings = face_recognition.face_encodings(rgb_crop, [crop_location])
+                if not encodings:
+                    continue
+                kept_locations.append(face_location)
+                face_encodings.append(encodings[0])
             
-            face_encodings = face_recognition.face_encodings(rgb_small_frame, small_face_locations)
-            return face_encodings
+            return kept_locations, face_encodings
             
         except Exception as e:
             logging.error(f"Lỗi trích xuất face encodings: {e}")
-            return []
+            return [], []
+    
+    def _crop_face(self, frame, face_location: Tuple[int, int, int, int]):
+        """
+        Vùng cắt có padding quanh khuôn mặt (crop_face_region) và vị trí
+        khuôn mặt trong vùng cắt đó
+        """
+        top, right, bottom, left = face_location
+        padding = self.encoding_padding
+        crop_top, crop_left = max(0, top - padding), max(0, left - padding)
+        
+        if crop_face_region is not None:
+            crop = crop_face_region(frame, face_location, padding)
+        else:
+            crop = frame[crop_top:bottom + padding, crop_left:right + padding]
+            crop = crop if crop.size else None
+        
+        if crop is None:
+            return None, None
+        return crop, (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
     
-    def detect_and_encode(self, frame) -> Tuple[List[Tuple[int, int, int, int]], List[np.ndarray]]:
+    def detect_and_encode(self, frame, full_scan: bool = False) -> Tuple[List[Tuple[int, int, int, int]], List[np.ndarray]]:
         """
         Phát hiện khuôn mặt và trích xuất encodings trong một lần
-        Returns: (face_locations, face_encodings)
+        full_scan: như detect_faces_fr, True cho ảnh không thuộc luồng camera
+        Returns: (face_locations, face_encodings), cùng độ dài và thứ tự
         """
-        face_locations = self.detect_faces_fr(frame)
-        face_encodings = self.get_face_encodings(frame, face_locations)
-        return face_locations, face_encodings
+        return self.encode_face_locations(frame, self.detect_faces_fr(frame, full_scan))
     
     def draw_face_boxes(self, frame, face_locations: List[Tuple[int, int, int, int]], 
                        names: List[str] = None, colors: List[Tuple[int, int, int]] = None):
@@ -4,6 +4,8 @@ import os
 from typing import Dict, List, Optional, Tuple
 import logging
 from datetime import datetime
+from .gallery import FaceGallery, create_gallery
+from .sharded_gallery import ShardedGallery
 
 class FaceEncoder:
     def __init__(self, encodings_file_path: str = "data/encodings.pkl"):
@@ -11,6 +13,8 @@ class FaceEncoder:
         self.known_encodings = {}  
         self.user_names = {}       
         self.user_student_ids = {} 
+        self._gallery = None
+        self._sharded_gallery = None
 
         os.makedirs(os.path.dirname(encodings_file_path), exist_ok=True)
         
@@ -22,10 +26,20 @@ class FaceEncoder:
         Thêm face encoding mới cho user
         """
         try:
+            is_new_user = user_id not in self.known_encodings
             self.known_encodings[user_id] = encoding
             self.user_names[user_id] = name
             self.user_student_ids[user_id] = student_id
             
+            # Cập nhật gallery (và PCA, các shard) tại chỗ, không build lại
+            for gallery in (self._gallery, self._sharded_gallery):
+                if gallery is None:
+                    continue
+                if is_new_user:
+                    gallery.add(user_id, [encoding])
+                else:
+                    gallery.replace(user_id, [encoding])
+            
             success = self.save_encodings()
             
             if success:
@@ -53,6 +67,9 @@ class FaceEncoder:
                 self.user_student_ids[user_id] = student_id
             if encoding is not None:
                 self.known_encodings[user_id] = encoding
+                for gallery in (self._gallery, self._sharded_gallery):
+                    if gallery is not None:
+                        gallery.replace(user_id, [encoding])
             
             success = self.save_encodings()
             
@@ -74,6 +91,9 @@ class FaceEncoder:
                 del self.known_encodings[user_id]
                 del self.user_names[user_id]
                 del self.user_student_ids[user_id]
+                for gallery in (self._gallery, self._sharded_gallery):
+                    if gallery is not None:
+                        gallery.remove(user_id)
                 
                 success = self.save_encodings()
                 
@@ -105,6 +125,55 @@ class FaceEncoder:
         
         return encodings, user_ids, names
     
+    def get_gallery(self) -> FaceGallery:
+        """
+        Gallery chứa toàn bộ encodings, nhãn là user ID
+        Được build một lần và cập nhật tăng dần khi thêm user mới
+        """
+        if self._gallery is None:
+            gallery = create_gallery(metric='euclidean')
+            gallery.build(self._encodings_by_user())
+            self._gallery = gallery
+        return self._gallery
+    
+    def get_sharded_gallery(self, num_workers: int = None) -> ShardedGallery:
+        """
+        Gallery chia theo user ra nhiều worker process (shared memory)
+        Dùng khi gallery quá lớn để một process quét kịp; số worker mặc định
+        lấy từ PERFORMANCE_CONFIG['face_recognition_workers']
+        """
+        if self._sharded_gallery is None:
+            sharded = ShardedGallery(metric='euclidean', num_workers=num_workers)
+            sharded.build(self._encodings_by_user())
+            self._sharded_gallery = sharded
+        return self._sharded_gallery
+    
+    def close_sharded_gallery(self):
+        """
+        Dừng các worker và giải phóng shared memory
+        (kể cả gallery của get_gallery() khi gallery_index là 'sharded')
+        """
+        if self._sharded_gallery is not None:
+            self._sharded_gallery.close()
+            self._sharded_gallery = None
+        if isinstance(self._gallery, ShardedGallery):
+            self._gallery.close()
+            self._gallery = None
+    
+    def _encodings_by_user(self) -> Dict[int, List[np.ndarray]]:
+        return {user_id: [encoding] for user_id, encoding in self.known_encodings.items()}
+    
+    def _reset_galleries(self):
+        """
+        Gọi sau khi thay toàn bộ encodings: gallery build lại khi cần,
+        sharded gallery (nếu đang chạy) được nạp lại ngay
+        """
+        if not isinstance(self._gallery, ShardedGallery):
+            self._gallery = None
+        for gallery in (self._gallery, self._sharded_gallery):
+            if gallery is not None:
+                gallery.build(self._encodings_by_user())
+    
     def get_user_info(self, user_id: int) -> Optional[Dict]:
         """
         Lấy thông tin user theo ID
@@ -153,7 +222,6 @@ class FaceEncoder:
             with open(self.encodings_file_path, 'rb') as f:
                 data = pickle.load(f)
             
-
             if isinstance(data, dict):
                 self.known_encodings = data.get('encodings', {})
                 self.user_names = data.get('names', {})
@@ -165,6 +233,7 @@ class FaceEncoder:
                 self.user_names = {}
                 self.user_student_ids = {}
             
+            self._reset_galleries()
             logging.info(f"Đã load {len(self.known_encodings)} encodings từ {self.encodings_file_path}")
             return True
             
@@ -174,6 +243,7 @@ class FaceEncoder:
             self.known_encodings = {}
             self.user_names = {}
             self.user_student_ids = {}
+            self._reset_galleries()
             return False
     
     def backup_encodings(self, backup_path: str = None) -> bool:
@@ -221,6 +291,7 @@ class FaceEncoder:
             self.known_encodings = data.get('encodings', {})
             self.user_names = data.get('names', {})
             self.user_student_ids = data.get('student_ids', {})
+            self._reset_galleries()
             
             success = self.save_encodings()
             
@@ -282,6 +353,7 @@ class FaceEncoder:
             self.known_encodings.clear()
             self.user_names.clear()
             self.user_student_ids.clear()
+            self._reset_galleries()
             
             success = self.save_encodings()
             
@@ -0,0 +1,171 @@
+# face_recognition_modules/face_tracker.py
+
+"""
+Lightweight multi-face tracker
+Boxes are matched to detections by IoU on keyframes and propagated with
+sparse optical flow (Lucas-Kanade) between them, so detection and encoding
+do not have to run on every frame
+"""
+
+import cv2
+import numpy as np
+
+try:
+    from utils.helpers import match_face_locations
+except ImportError:
+    match_face_locations = None
+
+
+class Track:
+    """Một khuôn mặt đang được theo dõi"""
+
+    def __init__(self, track_id, location):
+        self.track_id = track_id
+        self.location = tuple(int(v) for v in location)
+        self.result = None
+        self.misses = 0
+        self.lost = False
+        self.encoded_at = None
+
+    @property
+    def confidence(self):
+        return self.result.get('confidence', 0.0) if self.result else 0.0
+
+    @property
+    def is_known(self):
+        return bool(self.result) and self.result.get('user_id') is not None
+
+    @property
+    def visible(self):
+        """Matched at the last keyframe and not lost since"""
+        return not self.lost and self.misses == 0
+
+
+class FaceTracker:
+    """
+    IoU + optical flow tracker
+    iou_threshold: minimum IoU to continue a track with a new detection
+    max_misses: keyframes a track may go undetected before it is dropped;
+        until then it is neither propagated nor returned, it only keeps its
+        last box so a later detection can resume it
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=2, max_corners=20,
+                 min_flow_points=3):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.max_corners = max_corners
+        self.min_flow_points = min_flow_points
+        self.tracks = []
+        self._next_id = 1
+        self._prev_gray = None
+        self._lk_params = dict(
+            winSize=(15, 15),
+            maxLevel=2,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
+        )
+
+    def reset(self):
+        """Xóa toàn bộ track"""
+        self.tracks = []
+        self._prev_gray = None
+
+    @property
+    def has_lost_tracks(self):
+        # Tracks a keyframe already failed to re-detect do not force another one
+        return any(track.lost and track.misses == 0 for track in self.tracks)
+
+    def update(self, detections, gray):
+        """
+        Keyframe: match fresh detections to existing tracks
+        Returns: (tracks in the order of detections, list of new tracks)
+        """
+        detections = [tuple(int(v) for v in location) for location in detections]
+        previous = [track.location for track in self.tracks]
+
+        if match_face_locations is not None:
+            pairs = match_face_locations(previous, detections, self.iou_threshold)
+        else:
+            pairs = []
+
+        matched = [None] * len(detections)
+        for track_index, detection_index in pairs:
+            track = self.tracks[track_index]
+            track.location = detections[detection_index]
+            track.misses = 0
+            track.lost = False
+            matched[detection_index] = track
+
+        matched_tracks = set(id(track) for track in matched if track is not None)
+        survivors = []
+        for track in self.tracks:
+            if id(track) in matched_tracks:
+                survivors.append(track)
+                continue
+            track.misses += 1
+            if track.misses <= self.max_misses:
+                survivors.append(track)
+
+        new_tracks = []
+        for index, location in enumerate(detections):
+            if matched[index] is None:
+                track = Track(self._next_id, location)
+                self._next_id += 1
+                matched[index] = track
+                survivors.append(track)
+                new_tracks.append(track)
+
+        self.tracks = survivors
+        self._prev_gray = gray
+        return matched, new_tracks
+
+    def propagate(self, gray):
+        """
+        Non-keyframe: shift every visible track by the median optical flow of
+        the corners inside its box. Tracks whose flow fails are marked lost
+        """
+        if self._prev_gray is None or self._prev_gray.shape != gray.shape:
+            for track in self.tracks:
+                track.lost = True
+            self._prev_gray = gray
+            return self.tracks
+
+        height, width = gray.shape[:2]
+
+        for track in self.tracks:
+            if not track.visible:
+                continue
+
+            top, right, bottom, left = track.location
+            mask = np.zeros_like(gray)
+            mask[max(top, 0):max(bottom, 0), max(left, 0):max(right, 0)] = 255
+
+            points = cv2.goodFeaturesToTrack(
+                self._prev_gray, maxCorners=self.max_corners, qualityLevel=0.01,
+                minDistance=5, mask=mask
+            )
+            if points is None or len(points) < self.min_flow_points:
+                track.lost = True
+                continue
+
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(
+                self._prev_gray, gray, points, None, **self._lk_params
+            )
+            good = status.reshape(-1) == 1
+            if good.sum() < self.min_flow_points:
+                track.lost = True
+                continue
+
+            dx, dy = np.median((moved - points).reshape(-1, 2)[good], axis=0)
+            dx, dy = int(round(dx)), int(round(dy))
+
+            new_location = (top + dy, right + dx, bottom + dy, left + dx)
+            if (new_location[2] <= 0 or new_location[0] >= height or
+                    new_location[1] <= 0 or new_location[3] >= width):
+                track.lost = True
+                continue
+
+            track.location = new_location
+
+        self._prev_gray = gray
+        return self.tracks
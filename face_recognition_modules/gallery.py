@@ -0,0 +1,982 @@
+# face_recognition_modules/gallery.py
+
+"""
+Contiguous in-memory face gallery
+Keeps every known exemplar in one float32 matrix so a probe is matched
+with a single NumPy operation instead of a Python loop per encoding.
+Exemplars can be added, replaced and removed in place, without rebuilding.
+
+All implementations share the same interface
+(build / add / replace / remove / search / search_top_k / match):
+    FaceGallery        - exact brute-force scan
+    CompactFaceGallery - exact scan over float16 / int8 quantized rows
+    IVFGallery         - approximate inverted-file index with exact re-ranking
+    PCAGallery         - PCA-projected coarse shortlist with exact re-ranking
+    ShardedGallery     - exact scan split across worker processes (sharded_gallery.py)
+Use create_gallery() to get the one selected in PERFORMANCE_CONFIG.
+"""
+
+import sys
+import numpy as np
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+try:
+    from config import PERFORMANCE_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize every row of a matrix; all-zero rows stay zero
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def pairwise_distances(probes: np.ndarray, rows: np.ndarray, metric: str,
+                       row_sq_norms: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Distance matrix between probes (P x dim) and rows (N x dim)
+    Cosine assumes ``rows`` are already L2-normalized
+    Returns: array of shape (P, N)
+    """
+    probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+
+    if metric == 'cosine':
+        # Clip float32 rounding so identical vectors never get a negative distance
+        return np.clip(1.0 - normalize_rows(probes) @ rows.T, 0.0, 2.0)
+
+    if row_sq_norms is None:
+        row_sq_norms = np.einsum('ij,ij->i', rows, rows)
+
+    # ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b, one GEMM for the whole batch
+    probe_sq_norms = np.einsum('ij,ij->i', probes, probes)
+    sq_dist = probe_sq_norms[:, None] + row_sq_norms[None, :] - 2.0 * (probes @ rows.T)
+    np.maximum(sq_dist, 0.0, out=sq_dist)
+    return np.sqrt(sq_dist)
+
+
+def top_k_columns(distances: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k smallest entries of every row, in ascending order
+    np.argpartition selects them in O(n); only those k are then sorted
+    Returns: (column indices, distances), each of shape (P, k);
+    column -1 and distance inf where a row has fewer than k finite entries
+    """
+    distances = np.atleast_2d(distances)
+    num_rows, num_columns = distances.shape
+    columns = np.full((num_rows, k), -1, dtype=np.int64)
+    values = np.full((num_rows, k), np.inf, dtype=np.float32)
+
+    kk = min(k, num_columns)
+    if kk == 0:
+        return columns, values
+
+    nearest = np.argpartition(distances, kk - 1, axis=1)[:, :kk]
+    nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+    order = np.argsort(nearest_distances, axis=1)
+    nearest = np.take_along_axis(nearest, order, axis=1)
+    nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+
+    columns[:, :kk] = np.where(np.isfinite(nearest_distances), nearest, -1)
+    values[:, :kk] = nearest_distances
+    return columns, values
+
+
+class FaceGallery:
+    """
+    Gallery of face encodings grouped by label (usually a user ID)
+
+    Exemplars live in one preallocated float32 matrix that grows by doubling.
+    Every row carries the slot of its label in ``row_labels``. Removing a
+    label turns its rows into tombstones (row label -1) whose indices go on a
+    free list and are reused by later adds, so add / replace / remove only
+    touch the affected rows. Once tombstones exceed ``compact_ratio`` of the
+    matrix it is repacked by compact().
+
+    Per-label minimum distances use ``np.minimum.reduceat`` over rows grouped
+    by label. build() stores rows already grouped; after mutations the
+    grouping permutation is recomputed lazily on the next query.
+
+    metric:
+        'euclidean' - same distance as face_recognition.face_distance
+        'cosine'    - 1 - cosine similarity, used for MediaPipe encodings
+    """
+
+    def __init__(self, metric: str = 'euclidean', dim: int = 128, compact_ratio: float = 0.25):
+        if metric not in ('euclidean', 'cosine'):
+            raise ValueError(f"Unsupported gallery metric: {metric}")
+
+        self.metric = metric
+        self.dim = dim
+        self.compact_ratio = compact_ratio
+        self._reset()
+
+    def _reset(self):
+        """Drop every exemplar and release the storage"""
+        self.labels: List[Optional[Hashable]] = []   # slot -> label, None once removed
+        self._slots: Dict[Hashable, int] = {}        # label -> slot
+        self._label_rows: Dict[int, List[int]] = {}  # slot -> row indices
+        self._free_slots: List[int] = []
+        self._free_rows: List[int] = []
+        self._size = 0
+        self._storage = self._empty_storage(0)
+        self._row_sq_norms = np.zeros(0, dtype=np.float32)
+        self.row_labels = np.full(0, -1, dtype=np.int64)
+        self._grouping = None
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, label: Hashable) -> bool:
+        return label in self._slots
+
+    @property
+    def num_rows(self) -> int:
+        """Rows in use, tombstones included (the height of ``matrix``)"""
+        return self._size
+
+    @property
+    def num_active_rows(self) -> int:
+        return self._size - len(self._free_rows)
+
+    @property
+    def capacity(self) -> int:
+        return self._storage.shape[0]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Float32 rows in use; tombstoned rows hold stale data"""
+        return self._decode(self._storage[:self._size])
+
+    @property
+    def active_mask(self) -> np.ndarray:
+        return self.row_labels[:self._size] >= 0
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the gallery arrays"""
+        return self._storage.nbytes + self.row_labels.nbytes + self._row_sq_norms.nbytes
+
+    def _empty_storage(self, capacity: int) -> np.ndarray:
+        return np.zeros((capacity, self.dim), dtype=np.float32)
+
+    def _decode(self, stored: np.ndarray) -> np.ndarray:
+        """Stored rows as float32"""
+        return stored
+
+    def _prepare_rows(self, encodings: Sequence[np.ndarray]) -> np.ndarray:
+        rows = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if self.metric == 'cosine':
+            rows = normalize_rows(rows)
+        return rows
+
+    def _fit_storage(self, rows: np.ndarray):
+        """Hook to fit storage parameters on a full build (e.g. quantization scale)"""
+
+    def _resize(self, capacity: int):
+        storage = self._empty_storage(capacity)
+        storage[:self._size] = self._storage[:self._size]
+        row_sq_norms = np.zeros(capacity, dtype=np.float32)
+        row_sq_norms[:self._size] = self._row_sq_norms[:self._size]
+        row_labels = np.full(capacity, -1, dtype=np.int64)
+        row_labels[:self._size] = self.row_labels[:self._size]
+
+        self._storage = storage
+        self._row_sq_norms = row_sq_norms
+        self.row_labels = row_labels
+
+    def _write_rows(self, indices: np.ndarray, rows: np.ndarray):
+        """Store prepared rows at the given row indices"""
+        self._storage[indices] = rows
+        self._row_sq_norms[indices] = np.einsum('ij,ij->i', rows, rows)
+
+    def _release_rows(self, indices: np.ndarray):
+        """Turn rows into tombstones and put them on the free list"""
+        self.row_labels[indices] = -1
+        self._free_rows.extend(indices.tolist())
+
+    def _allocate_rows(self, count: int) -> np.ndarray:
+        """Row indices for new exemplars: free-list rows first, then fresh rows"""
+        reused = [self._free_rows.pop() for _ in range(min(count, len(self._free_rows)))]
+        fresh = count - len(reused)
+
+        if fresh:
+            if self._size + fresh > self.capacity:
+                # Doubling keeps appends amortized O(1)
+                self._resize(max(self._size + fresh, 2 * self.capacity, 64))
+            reused.extend(range(self._size, self._size + fresh))
+            self._size += fresh
+
+        return np.asarray(reused, dtype=np.int64)
+
+    def _label_slot(self, label: Hashable) -> int:
+        slot = self._slots.get(label)
+        if slot is None:
+            if self._free_slots:
+                slot = self._free_slots.pop()
+                self.labels[slot] = label
+            else:
+                slot = len(self.labels)
+                self.labels.append(label)
+            self._slots[label] = slot
+            self._label_rows[slot] = []
+        return slot
+
+    def build(self, encodings_by_label: Dict[Hashable, Sequence[np.ndarray]]):
+        """
+        Rebuild the gallery from a mapping label -> list of encodings
+        """
+        self._reset()
+
+        labels = []
+        blocks = []
+        counts = []
+
+        for label, encodings in encodings_by_label.items():
+            if encodings is None or len(encodings) == 0:
+                continue
+            labels.append(label)
+            blocks.append(np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim))
+            counts.append(blocks[-1].shape[0])
+
+        if not blocks:
+            return
+
+        rows = self._prepare_rows(np.vstack(blocks))
+        num_rows = rows.shape[0]
+        self._resize(num_rows)
+        self._size = num_rows
+
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        self.labels = labels
+        self._slots = {label: slot for slot, label in enumerate(labels)}
+        self._label_rows = {
+            slot: list(range(start, start + count))
+            for slot, (start, count) in enumerate(zip(starts, counts))
+        }
+        self.row_labels[:num_rows] = np.repeat(np.arange(len(labels), dtype=np.int64), counts)
+
+        self._fit_storage(rows)
+        self._write_rows(np.arange(num_rows), rows)
+
+    def add(self, label: Hashable, encodings: Sequence[np.ndarray]):
+        """
+        Add exemplars for a new or existing label
+        Only the new rows are written; amortized O(len(encodings))
+        """
+        rows = self._prepare_rows(encodings)
+        if rows.shape[0] == 0:
+            return
+
+        slot = self._label_slot(label)
+        indices = self._allocate_rows(rows.shape[0])
+        self.row_labels[indices] = slot
+        self._label_rows[slot].extend(indices.tolist())
+        self._write_rows(indices, rows)
+        self._grouping = None
+
+    def replace(self, label: Hashable, encodings: Sequence[np.ndarray]):
+        """
+        Swap all exemplars of a label for new ones
+        """
+        slot = self._slots.get(label)
+        if slot is not None:
+            old_rows = self._label_rows[slot]
+            self._label_rows[slot] = []
+            self._release_rows(np.asarray(old_rows, dtype=np.int64))
+
+        self.add(label, encodings)
+        self._maybe_compact()
+
+    def remove(self, label: Hashable) -> bool:
+        """
+        Remove a label and tombstone its rows
+        Returns: False when the label is not in the gallery
+        """
+        slot = self._slots.pop(label, None)
+        if slot is None:
+            return False
+
+        self._release_rows(np.asarray(self._label_rows.pop(slot), dtype=np.int64))
+        self.labels[slot] = None
+        self._free_slots.append(slot)
+        self._grouping = None
+        self._maybe_compact()
+        return True
+
+    def _maybe_compact(self):
+        if self._size >= 64 and len(self._free_rows) > self.compact_ratio * self._size:
+            self.compact()
+
+    def compact(self):
+        """Repack live rows contiguously, grouped by label, dropping tombstones"""
+        self.build(self._label_blocks())
+
+    def _label_blocks(self, labels: Optional[Sequence[Hashable]] = None) -> Dict[Hashable, np.ndarray]:
+        """Current exemplars as a mapping label -> (rows x dim) block"""
+        if labels is None:
+            labels = list(self._slots)
+
+        blocks = {}
+        for label in labels:
+            slot = self._slots.get(label)
+            if slot is not None:
+                blocks[label] = self._decode(self._storage[self._label_rows[slot]])
+        return blocks
+
+    def _new_empty(self) -> 'FaceGallery':
+        """Empty gallery of the same type and settings"""
+        return FaceGallery(metric=self.metric, dim=self.dim, compact_ratio=self.compact_ratio)
+
+    def subset(self, labels: Sequence[Hashable]) -> 'FaceGallery':
+        """
+        Precomputed sub-gallery holding only the exemplars of ``labels``
+        Labels that are not in the gallery are ignored
+        """
+        sub = self._new_empty()
+        sub.build(self._label_blocks(labels))
+        return sub
+
+    def distances(self, probes: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Distance matrix between probes (P x dim) and gallery rows
+        rows: optional row indices to restrict the computation to
+        Returns: array of shape (P, num_rows) or (P, len(rows))
+        """
+        if rows is None:
+            return pairwise_distances(probes, self._storage[:self._size], self.metric,
+                                      self._row_sq_norms[:self._size])
+        return pairwise_distances(probes, self._storage[rows], self.metric, self._row_sq_norms[rows])
+
+    def _get_grouping(self) -> Tuple[Optional[np.ndarray], np.ndarray, np.ndarray]:
+        """
+        Live rows ordered by label slot
+        Returns: (rows or None when already in order, group starts, slot of each group)
+        """
+        if self._grouping is None:
+            live_rows = np.flatnonzero(self.active_mask)
+            order = np.argsort(self.row_labels[live_rows], kind='stable')
+            rows = live_rows[order]
+            sorted_slots = self.row_labels[rows]
+            starts = np.flatnonzero(np.r_[True, sorted_slots[1:] != sorted_slots[:-1]])
+            in_order = rows.size == self._size and bool(np.all(order[1:] > order[:-1]))
+            self._grouping = (None if in_order else rows, starts, sorted_slots[starts])
+        return self._grouping
+
+    def label_distances(self, probes: np.ndarray) -> np.ndarray:
+        """
+        Minimum distance from each probe to each label's exemplars
+        Returns: array of shape (P, len(labels)); removed label slots are inf
+        """
+        probes = np.atleast_2d(probes)
+        per_label = np.full((probes.shape[0], len(self.labels)), np.inf, dtype=np.float32)
+        if self.num_active_rows == 0:
+            return per_label
+
+        rows, starts, slots = self._get_grouping()
+        distances = self.distances(probes, rows=rows)
+        per_label[:, slots] = np.minimum.reduceat(distances, starts, axis=1)
+        return per_label
+
+    def search(self, probes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Nearest label for every probe
+        The closest live row decides, which equals the per-label minimum
+        Returns: (label_indices, distances), each of shape (P,);
+        label index is -1 and distance inf when the gallery is empty
+        """
+        probes = np.atleast_2d(probes)
+        if self.num_active_rows == 0:
+            return (np.full(probes.shape[0], -1, dtype=np.int64),
+                    np.full(probes.shape[0], np.inf, dtype=np.float32))
+
+        distances = self.distances(probes)
+        if self._free_rows:
+            distances[:, ~self.active_mask] = np.inf
+
+        nearest = np.argmin(distances, axis=1)
+        return self.row_labels[nearest], distances[np.arange(distances.shape[0]), nearest]
+
+    def search_top_k(self, probes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k nearest labels for every probe (one entry per label, its closest exemplar)
+        Returns: (label_indices, distances), each of shape (P, k) sorted by
+        distance; label index -1 and distance inf past the last label
+        """
+        probes = np.atleast_2d(probes)
+        return top_k_columns(self.label_distances(probes), max(1, int(k)))
+
+    def _rank_shortlists(self, probes: np.ndarray, shortlists: Sequence[np.ndarray],
+                         k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact re-rank of per-probe candidate rows into the k nearest labels
+        Used by the approximate galleries after their coarse stage
+        """
+        best = np.full((probes.shape[0], k), -1, dtype=np.int64)
+        best_distances = np.full((probes.shape[0], k), np.inf, dtype=np.float32)
+
+        for i, candidates in enumerate(shortlists):
+            if candidates.size == 0:
+                continue
+            distances = self.distances(probes[i], rows=candidates)[0]
+            slots, inverse = np.unique(self.row_labels[candidates], return_inverse=True)
+            per_label = np.full(slots.shape[0], np.inf, dtype=np.float32)
+            np.minimum.at(per_label, inverse, distances)
+
+            columns, values = top_k_columns(per_label, k)
+            best[i] = np.where(columns[0] >= 0, slots[columns[0]], -1)
+            best_distances[i] = values[0]
+
+        return best, best_distances
+
+    def match(self, probes: np.ndarray, tolerance: float) -> List[Tuple[Optional[Hashable], float]]:
+        """
+        Best label for every probe
+        Returns: list of (label or None, distance) - None when no label is within tolerance
+        """
+        best, best_distances = self.search(probes)
+
+        results = []
+        for label_index, distance in zip(best, best_distances):
+            distance = float(distance)
+            if label_index >= 0 and distance < tolerance:
+                results.append((self.labels[label_index], distance))
+            else:
+                results.append((None, distance))
+        return results
+
+
+class CompactFaceGallery(FaceGallery):
+    """
+    Exact gallery stored in a compact form for low-RAM devices
+
+    storage:
+        'float16' - half precision rows (2 bytes per dimension)
+        'int8'    - symmetric scalar quantization with a per-dimension scale
+                    (1 byte per dimension)
+
+    Distances are computed on the compact rows directly: the int8 scale is
+    folded into the probe (p . (q * s) == (p * s) . q) and rows are only
+    widened to float32 one block at a time inside the matrix product.
+    The int8 scale is fitted exactly on build(). A gallery filled through
+    add() starts without a range; when new rows fall outside it, the range
+    is widened (with SCALE_HEADROOM) and the stored rows are re-quantized,
+    so rows are never clipped.
+    """
+
+    SCALE_HEADROOM = 1.25
+
+    def __init__(self, metric: str = 'euclidean', dim: int = 128, storage: str = 'int8',
+                 block_size: int = 8192, compact_ratio: float = 0.25):
+        if storage not in ('float16', 'int8'):
+            raise ValueError(f"Unsupported compact storage: {storage}")
+
+        self.storage = storage
+        self.block_size = block_size
+        super().__init__(metric=metric, dim=dim, compact_ratio=compact_ratio)
+
+    def _reset(self):
+        super()._reset()
+        # int8 step per dimension; 0 until the first rows are written
+        self._scale = np.zeros(self.dim, dtype=np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return super().nbytes + self._scale.nbytes
+
+    def _new_empty(self) -> 'CompactFaceGallery':
+        return CompactFaceGallery(metric=self.metric, dim=self.dim, storage=self.storage,
+                                  block_size=self.block_size, compact_ratio=self.compact_ratio)
+
+    def _empty_storage(self, capacity: int) -> np.ndarray:
+        return np.zeros((capacity, self.dim), dtype=np.int8 if self.storage == 'int8' else np.float16)
+
+    def _decode(self, stored: np.ndarray) -> np.ndarray:
+        rows = stored.astype(np.float32)
+        if self.storage == 'int8':
+            rows *= self._scale
+        return rows
+
+    @staticmethod
+    def _required_scale(rows: np.ndarray) -> np.ndarray:
+        return (np.abs(rows).max(axis=0) / 127.0).astype(np.float32)
+
+    def _fit_storage(self, rows: np.ndarray):
+        if self.storage == 'int8':
+            self._scale = self._required_scale(rows)
+
+    def _quantize(self, rows: np.ndarray) -> np.ndarray:
+        steps = np.divide(rows, self._scale, out=np.zeros_like(rows), where=self._scale > 0)
+        return np.clip(np.rint(steps), -127, 127).astype(np.int8)
+
+    def _widen_scale(self, rows: np.ndarray):
+        """Grow the int8 range to cover new rows, re-quantizing the stored ones"""
+        required = self._required_scale(rows)
+        if np.all(required <= self._scale):
+            return
+
+        # Headroom, so slightly larger rows later do not re-quantize everything again
+        stored = self._decode(self._storage[:self._size])
+        self._scale = np.maximum(self._scale, required * self.SCALE_HEADROOM)
+        self._storage[:self._size] = self._quantize(stored)
+        decoded = self._decode(self._storage[:self._size])
+        self._row_sq_norms[:self._size] = np.einsum('ij,ij->i', decoded, decoded)
+
+    def _write_rows(self, indices: np.ndarray, rows: np.ndarray):
+        if self.storage == 'int8':
+            self._widen_scale(rows)
+            codes = self._quantize(rows)
+        else:
+            codes = rows.astype(np.float16)
+
+        self._storage[indices] = codes
+        # Norms of the rows as stored, so distances stay self-consistent
+        decoded = self._decode(codes)
+        self._row_sq_norms[indices] = np.einsum('ij,ij->i', decoded, decoded)
+
+    def _dot(self, probes: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """probes @ dequantized(codes).T without materializing the float32 gallery"""
+        weighted = probes * self._scale if self.storage == 'int8' else probes
+        out = np.empty((probes.shape[0], codes.shape[0]), dtype=np.float32)
+        for start in range(0, codes.shape[0], self.block_size):
+            block = codes[start:start + self.block_size].astype(np.float32)
+            out[:, start:start + self.block_size] = weighted @ block.T
+        return out
+
+    def distances(self, probes: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        if rows is None:
+            rows = slice(0, self._size)
+        codes = self._storage[rows]
+        row_sq_norms = self._row_sq_norms[rows]
+
+        if self.metric == 'cosine':
+            row_norms = np.sqrt(row_sq_norms)
+            dots = self._dot(normalize_rows(probes), codes)
+            similarity = np.divide(dots, row_norms, out=np.zeros_like(dots), where=row_norms > 0)
+            return np.clip(1.0 - similarity, 0.0, 2.0)
+
+        probe_sq_norms = np.einsum('ij,ij->i', probes, probes)
+        sq_dist = probe_sq_norms[:, None] + row_sq_norms[None, :] - 2.0 * self._dot(probes, codes)
+        np.maximum(sq_dist, 0.0, out=sq_dist)
+        return np.sqrt(sq_dist)
+
+
+class IVFGallery(FaceGallery):
+    """
+    Approximate gallery based on an inverted-file (IVF) index
+
+    Rows are clustered with k-means into ``nlist`` cells. A probe only visits
+    the ``nprobe`` closest cells and the candidates found there are re-ranked
+    with the exact metric. ``nprobe`` is the recall/latency knob: nprobe=nlist
+    is an exact search. Galleries smaller than ``min_size`` are scanned
+    exhaustively, since the index would not pay for itself.
+
+    Added rows are appended to the list of their nearest centroid without
+    retraining; tombstoned rows are skipped at query time and dropped from
+    the lists by compact().
+    """
+
+    def __init__(self, metric: str = 'euclidean', dim: int = 128, nlist: int = 0,
+                 nprobe: int = 8, min_size: int = 2000, train_iterations: int = 10,
+                 seed: int = 0, compact_ratio: float = 0.25):
+        super().__init__(metric=metric, dim=dim, compact_ratio=compact_ratio)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_size = min_size
+        self.train_iterations = train_iterations
+        self.seed = seed
+
+    def _reset(self):
+        super()._reset()
+        self.centroids = None
+        self._centroid_sq_norms = None
+        self._lists: List[np.ndarray] = []
+
+    @property
+    def is_indexed(self) -> bool:
+        return self.centroids is not None
+
+    def _new_empty(self) -> 'IVFGallery':
+        return IVFGallery(metric=self.metric, dim=self.dim, nlist=self.nlist, nprobe=self.nprobe,
+                          min_size=self.min_size, train_iterations=self.train_iterations, seed=self.seed,
+                          compact_ratio=self.compact_ratio)
+
+    def set_nprobe(self, nprobe: int):
+        """Trade recall for latency: more visited cells = higher recall"""
+        self.nprobe = max(1, int(nprobe))
+
+    def build(self, encodings_by_label: Dict[Hashable, Sequence[np.ndarray]]):
+        super().build(encodings_by_label)
+        self._train()
+
+    def add(self, label: Hashable, encodings: Sequence[np.ndarray]):
+        super().add(label, encodings)
+        if not self.is_indexed and self.num_active_rows >= self.min_size:
+            self._train()
+
+    def compact(self):
+        # Repack without retraining: keep the centroids, refill the lists
+        centroids, centroid_sq_norms = self.centroids, self._centroid_sq_norms
+        FaceGallery.build(self, self._label_blocks())
+        if centroids is not None:
+            self.centroids, self._centroid_sq_norms = centroids, centroid_sq_norms
+            self._assign_lists()
+
+    def _write_rows(self, indices: np.ndarray, rows: np.ndarray):
+        super()._write_rows(indices, rows)
+        if self.is_indexed:
+            assignments = self._nearest_centroid(rows, self.centroids)
+            for cell in np.unique(assignments):
+                self._lists[cell] = np.append(self._lists[cell], indices[assignments == cell])
+
+    def _train(self):
+        """Cluster the live rows and fill the inverted lists"""
+        self.centroids = None
+        self._centroid_sq_norms = None
+        self._lists = []
+
+        live_rows = np.flatnonzero(self.active_mask)
+        num_rows = live_rows.size
+        if num_rows == 0 or num_rows < self.min_size:
+            return
+
+        nlist = self.nlist if self.nlist > 0 else int(round(np.sqrt(num_rows)))
+        nlist = max(1, min(nlist, num_rows))
+
+        rng = np.random.default_rng(self.seed)
+        # k-means converges on a sample; the full gallery is only needed for assignment
+        sample_size = min(num_rows, nlist * 64)
+        sample = self._decode(self._storage[rng.choice(live_rows, sample_size, replace=False)])
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            assignments = self._nearest_centroid(sample, centroids)
+            order = np.argsort(assignments, kind='stable')
+            cells, starts, counts = np.unique(assignments[order], return_index=True, return_counts=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[cells] = sums / counts[:, None]
+            if self.metric == 'cosine':
+                centroids = normalize_rows(centroids)
+
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self._assign_lists()
+
+    def _assign_lists(self):
+        """Put every live row in the list of its nearest centroid"""
+        live_rows = np.flatnonzero(self.active_mask)
+        nlist = self.centroids.shape[0]
+        assignments = self._nearest_centroid(self._decode(self._storage[live_rows]), self.centroids)
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        self._lists = [live_rows[order[bounds[i]:bounds[i + 1]]] for i in range(nlist)]
+
+    def _nearest_centroid(self, rows: np.ndarray, centroids: np.ndarray, chunk_size: int = 16384) -> np.ndarray:
+        """Index of the closest centroid for each row, computed in chunks to bound memory"""
+        centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+        assignments = np.empty(rows.shape[0], dtype=np.int64)
+        for start in range(0, rows.shape[0], chunk_size):
+            chunk = rows[start:start + chunk_size]
+            distances = pairwise_distances(chunk, centroids, self.metric, centroid_sq_norms)
+            assignments[start:start + chunk_size] = np.argmin(distances, axis=1)
+        return assignments
+
+    def _candidates(self, cells: np.ndarray) -> np.ndarray:
+        """Live rows in the given cells"""
+        candidates = np.unique(np.concatenate([self._lists[cell] for cell in cells]))
+        return candidates[self.row_labels[candidates] >= 0]
+
+    def _shortlists(self, probes: np.ndarray) -> List[np.ndarray]:
+        """Live rows of the nprobe cells closest to each probe"""
+        nprobe = min(self.nprobe, len(self._lists))
+        coarse = pairwise_distances(probes, self.centroids, self.metric, self._centroid_sq_norms)
+        visited = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+        return [self._candidates(cells) for cells in visited]
+
+    def search(self, probes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.is_indexed:
+            return super().search(probes)
+
+        best, best_distances = self.search_top_k(probes, 1)
+        return best[:, 0], best_distances[:, 0]
+
+    def search_top_k(self, probes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.is_indexed:
+            return super().search_top_k(probes, k)
+
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        return self._rank_shortlists(probes, self._shortlists(probes), max(1, int(k)))
+
+
+class IncrementalPCA:
+    """
+    PCA that can be refitted incrementally
+
+    Keeps the running sample count, sum and scatter matrix, so rows are
+    folded in with partial_fit() (or taken out with partial_unfit()) without
+    revisiting the others. refit() recomputes the principal axes from those
+    statistics with one small dim x dim eigh.
+    """
+
+    def __init__(self, n_components: int = 32, dim: int = 128):
+        self.n_components = n_components
+        self.dim = dim
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._sum = np.zeros(self.dim, dtype=np.float64)
+        self._scatter = np.zeros((self.dim, self.dim), dtype=np.float64)
+        self.mean = np.zeros(self.dim, dtype=np.float32)
+        self._components = None
+
+    def partial_fit(self, rows: np.ndarray, sign: int = 1):
+        """Fold rows into the statistics; the axes change only on refit()"""
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.dim)
+        if rows.shape[0] == 0:
+            return
+        self.count += sign * rows.shape[0]
+        self._sum += sign * rows.sum(axis=0)
+        self._scatter += sign * (rows.T @ rows)
+
+    def partial_unfit(self, rows: np.ndarray):
+        """Take previously fitted rows back out of the statistics"""
+        self.partial_fit(rows, sign=-1)
+
+    def refit(self):
+        """Recompute the principal axes from the current statistics"""
+        mean = self._sum / max(self.count, 1)
+        covariance = self._scatter / max(self.count, 1) - np.outer(mean, mean)
+        _, eigenvectors = np.linalg.eigh(covariance)
+        # eigh sorts ascending; keep the largest-variance axes
+        top = eigenvectors[:, ::-1][:, :self.n_components]
+        self.mean = mean.astype(np.float32)
+        self._components = np.ascontiguousarray(top.T, dtype=np.float32)
+
+    @property
+    def components(self) -> np.ndarray:
+        """Principal axes, shape (n_components, dim)"""
+        if self._components is None:
+            self.refit()
+        return self._components
+
+    def transform(self, rows: np.ndarray) -> np.ndarray:
+        components = self.components
+        rows = np.atleast_2d(np.asarray(rows, dtype=np.float32))
+        return (rows - self.mean) @ components.T
+
+
+class PCAGallery(FaceGallery):
+    """
+    Two-stage gallery: PCA coarse prefilter, then exact refinement
+
+    Gallery rows and probes are projected into ``n_components`` PCA
+    dimensions. The ``shortlist`` closest rows in that space are re-ranked
+    with the exact metric. Galleries smaller than ``min_size`` are scanned
+    exhaustively.
+
+    The PCA statistics follow every add and remove. New rows are projected
+    with the current axes; the axes themselves are refitted, and all rows
+    re-projected, once the gallery has grown by ``refit_growth`` since the
+    last fit.
+    """
+
+    def __init__(self, metric: str = 'euclidean', dim: int = 128, n_components: int = 32,
+                 shortlist: int = 64, min_size: int = 500, refit_growth: float = 0.1,
+                 compact_ratio: float = 0.25):
+        self.n_components = min(n_components, dim)
+        self.pca = IncrementalPCA(n_components=self.n_components, dim=dim)
+        super().__init__(metric=metric, dim=dim, compact_ratio=compact_ratio)
+        self.shortlist = shortlist
+        self.min_size = min_size
+        self.refit_growth = refit_growth
+
+    def _reset(self):
+        super()._reset()
+        self.pca.reset()
+        self._fitted_count = 0
+        self._projected = np.zeros((0, self.n_components), dtype=np.float32)
+        self._projected_sq_norms = np.zeros(0, dtype=np.float32)
+
+    def _new_empty(self) -> 'PCAGallery':
+        return PCAGallery(metric=self.metric, dim=self.dim, n_components=self.n_components,
+                          shortlist=self.shortlist, min_size=self.min_size,
+                          refit_growth=self.refit_growth, compact_ratio=self.compact_ratio)
+
+    def _resize(self, capacity: int):
+        size = self._size
+        super()._resize(capacity)
+        projected = np.zeros((capacity, self.n_components), dtype=np.float32)
+        projected[:size] = self._projected[:size]
+        projected_sq_norms = np.zeros(capacity, dtype=np.float32)
+        projected_sq_norms[:size] = self._projected_sq_norms[:size]
+        self._projected = projected
+        self._projected_sq_norms = projected_sq_norms
+
+    def _write_rows(self, indices: np.ndarray, rows: np.ndarray):
+        super()._write_rows(indices, rows)
+        self.pca.partial_fit(rows)
+
+        if self.pca.count > (1.0 + self.refit_growth) * self._fitted_count:
+            self.pca.refit()
+            self._fitted_count = self.pca.count
+            self._project(np.arange(self._size))
+        else:
+            self._project(indices)
+
+    def _release_rows(self, indices: np.ndarray):
+        self.pca.partial_unfit(self._decode(self._storage[indices]))
+        super()._release_rows(indices)
+
+    def _project(self, indices: np.ndarray):
+        """Project the given gallery rows with the current PCA axes"""
+        projected = self.pca.transform(self._decode(self._storage[indices]))
+        self._projected[indices] = projected
+        self._projected_sq_norms[indices] = np.einsum('ij,ij->i', projected, projected)
+
+    def _use_exact(self, shortlist: int) -> bool:
+        return self.num_active_rows < max(self.min_size, 1) or self.num_active_rows <= shortlist
+
+    def _shortlists(self, probes: np.ndarray, shortlist: int) -> np.ndarray:
+        """The ``shortlist`` rows closest to each probe in PCA space"""
+        if self.metric == 'cosine':
+            # Rows are unit vectors, so euclidean order in PCA space follows cosine order
+            probes = normalize_rows(probes)
+
+        coarse = pairwise_distances(self.pca.transform(probes), self._projected[:self._size],
+                                    'euclidean', self._projected_sq_norms[:self._size])
+        if self._free_rows:
+            coarse[:, ~self.active_mask] = np.inf
+        return np.argpartition(coarse, shortlist - 1, axis=1)[:, :shortlist]
+
+    def search(self, probes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self._use_exact(self.shortlist):
+            return super().search(probes)
+
+        best, best_distances = self.search_top_k(probes, 1)
+        return best[:, 0], best_distances[:, 0]
+
+    def search_top_k(self, probes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = max(1, int(k))
+        shortlist = max(self.shortlist, k)
+        if self._use_exact(shortlist):
+            return super().search_top_k(probes, k)
+
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        # Exact face distance on the shortlist only
+        return self._rank_shortlists(probes, self._shortlists(probes, shortlist), k)
+
+
+def create_gallery(metric: str = 'euclidean', dim: int = 128) -> FaceGallery:
+    """
+    Create the gallery implementation selected by PERFORMANCE_CONFIG['gallery_index']
+    'exact' (default) - brute-force FaceGallery
+    'ivf'             - approximate IVFGallery
+    'pca'             - PCA prefilter + exact refinement PCAGallery
+    'sharded'         - ShardedGallery over PERFORMANCE_CONFIG['face_recognition_workers']
+                        processes; call close() on it when done
+    The exact gallery can be stored compactly with
+    PERFORMANCE_CONFIG['gallery_storage'] = 'float16' or 'int8'
+    """
+    index_type = PERFORMANCE_CONFIG.get('gallery_index', 'exact')
+    storage = PERFORMANCE_CONFIG.get('gallery_storage', 'float32')
+
+    if index_type == 'pca':
+        return PCAGallery(
+            metric=metric,
+            dim=dim,
+            n_components=PERFORMANCE_CONFIG.get('pca_components', 32),
+            shortlist=PERFORMANCE_CONFIG.get('pca_shortlist', 64),
+            min_size=PERFORMANCE_CONFIG.get('pca_min_gallery_size', 500),
+        )
+
+    if index_type == 'sharded':
+        # Imported here: sharded_gallery builds on this module
+        from .sharded_gallery import ShardedGallery
+        return ShardedGallery(metric=metric, dim=dim)
+
+    if index_type == 'ivf':
+        return IVFGallery(
+            metric=metric,
+            dim=dim,
+            nlist=PERFORMANCE_CONFIG.get('ann_nlist', 0),
+            nprobe=PERFORMANCE_CONFIG.get('ann_nprobe', 8),
+            min_size=PERFORMANCE_CONFIG.get('ann_min_gallery_size', 2000),
+        )
+
+    if storage in ('float16', 'int8'):
+        return CompactFaceGallery(metric=metric, dim=dim, storage=storage)
+
+    return FaceGallery(metric=metric, dim=dim)
+
+
+def storage_report(encodings_by_label: Dict[Hashable, Sequence[np.ndarray]], metric: str = 'euclidean',
+                   tolerance: float = 0.6, max_probes: int = 500, seed: int = 0) -> List[Dict]:
+    """
+    Accuracy versus memory for each gallery storage mode
+
+    Every probe is a stored exemplar matched against all other exemplars
+    (its own row is excluded), so the report reflects how often quantization
+    changes the nearest neighbour or the accept/reject decision.
+    Returns: one dict per mode, the float32 gallery being the reference
+    """
+    reference = FaceGallery(metric=metric)
+    reference.build(encodings_by_label)
+    num_rows = reference.num_rows
+    if num_rows < 2:
+        return []
+
+    rng = np.random.default_rng(seed)
+    probe_rows = np.sort(rng.choice(num_rows, min(max_probes, num_rows), replace=False))
+    probes = reference.matrix[probe_rows]
+    own_row = (np.arange(len(probe_rows)), probe_rows)
+
+    def nearest_other(gallery: FaceGallery) -> Tuple[np.ndarray, np.ndarray]:
+        distances = gallery.distances(probes)
+        distances[own_row] = np.inf
+        nearest = np.argmin(distances, axis=1)
+        return nearest, distances[np.arange(len(probe_rows)), nearest]
+
+    ref_nearest, ref_distances = nearest_other(reference)
+    ref_labels = reference.row_labels[ref_nearest]
+    ref_accept = ref_distances < tolerance
+
+    # What the recognizers held before: one float64 ndarray object per encoding
+    python_list_bytes = sum(
+        sys.getsizeof(np.array(encoding, dtype=np.float64))
+        for encodings in encodings_by_label.values() for encoding in encodings
+    )
+    report = [{
+        'storage': 'list[float64]',
+        'bytes': python_list_bytes,
+        'bytes_per_exemplar': python_list_bytes / num_rows,
+        'top1_agreement': 1.0,
+        'decision_agreement': 1.0,
+        'max_distance_error': 0.0,
+        'mean_distance_error': 0.0,
+    }]
+
+    for storage in ('float32', 'float16', 'int8'):
+        if storage == 'float32':
+            gallery = reference
+        else:
+            gallery = CompactFaceGallery(metric=metric, storage=storage)
+            gallery.build(encodings_by_label)
+
+        nearest, distances = nearest_other(gallery)
+        error = np.abs(distances - ref_distances)
+        report.append({
+            'storage': storage,
+            'bytes': gallery.nbytes,
+            'bytes_per_exemplar': gallery.nbytes / num_rows,
+            'top1_agreement': float(np.mean(gallery.row_labels[nearest] == ref_labels)),
+            'decision_agreement': float(np.mean((distances < tolerance) == ref_accept)),
+            'max_distance_error': float(error.max()),
+            'mean_distance_error': float(error.mean()),
+        })
+
+    return report
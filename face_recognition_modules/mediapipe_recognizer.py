@@ -3,17 +3,72 @@
 import cv2
 import numpy as np
 import mediapipe as mp
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 import os
+import atexit
+import threading
 from PIL import Image
+from .gallery import normalize_rows
+
+try:
+    from config import PERFORMANCE_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+
+try:
+    from utils.helpers import match_face_locations
+except ImportError:
+    match_face_locations = None
+
+# FaceMesh landmarks used for the 128-d encoding, grouped by region
+KEY_POINTS = [
+    # Nose tip, nose bridge
+    1, 2, 5, 4, 6, 19, 20, 94, 125, 141, 235, 236, 3, 51, 48, 115, 131, 134, 102, 49, 220, 305, 307, 375, 321, 308, 324, 318,
+    # Eyes
+    33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161, 246, 362, 398, 384, 385, 386, 387, 388, 466, 263, 249, 390, 373, 374, 380, 381, 382,
+    # Eyebrows
+    70, 63, 105, 66, 107, 55, 65, 52, 53, 46, 285, 295, 282, 283, 276, 300, 293, 334, 296, 336,
+    # Mouth
+    61, 84, 17, 314, 405, 320, 307, 375, 321, 308, 324, 318, 78, 191, 80, 81, 82, 13, 312, 311, 310, 415, 308, 324, 318
+]
+
+# Outline of the face; its extent is the face box
+FACE_OVAL = [
+    10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288, 397, 365, 379, 378, 400, 377,
+    152, 148, 176, 149, 150, 136, 172, 58, 132, 93, 234, 127, 162, 21, 54, 103, 67, 109
+]
+
+# The encoding is the first 128 (x, y, z) values, i.e. the first 43 key points
+# (x, y only for the last one); the duplicates further down never reach it.
+# Only these points and the oval are read from a landmark set, into an
+# (N, 3) array with one row per USED_POINTS entry. The index arrays below
+# are computed once and select rows / flat values from that array.
+ENCODING_POINTS = KEY_POINTS[:43]
+USED_POINTS = np.unique(np.concatenate([FACE_OVAL, ENCODING_POINTS]))
+OVAL_ROWS = np.searchsorted(USED_POINTS, FACE_OVAL)
+ENCODING_INDEX = (3 * np.searchsorted(USED_POINTS, ENCODING_POINTS)[:, None] + np.arange(3)).ravel()[:128]
+
 
 class MediaPipeFaceRecognition:
     """
     MediaPipe-based face recognition class that replaces face_recognition library
     Provides similar interface but uses MediaPipe for face detection and custom encoding
+    
+    static_image_mode=True treats every image independently (enrollment photos).
+    static_image_mode=False is the video mode for one camera stream: FaceMesh
+    reuses the landmarks of the previous frame, so an instance must only
+    ever see frames of a single stream. MediaPipe still runs its detector
+    while it tracks fewer than max_num_faces faces;
+    PERFORMANCE_CONFIG['video_max_num_faces'] (default 10, as image mode)
+    sets that limit. Faces beyond it get no landmarks, only basic encodings.
+    face_locations always scans the whole frame: FaceDetection runs at a
+    fixed input size, so scanning N regions around the previous faces costs
+    N detector calls instead of one (ROIDetector is used by the dlib
+    FaceDetector, whose cost grows with the pixels scanned).
     """
     
-    def __init__(self):
+    def __init__(self, static_image_mode: bool = True):
+        self.static_image_mode = static_image_mode
         self.mp_face_detection = mp.solutions.face_detection
         self.mp_drawing = mp.solutions.drawing_utils
         self.face_detection = self.mp_face_detection.FaceDetection(
@@ -21,14 +76,18 @@ class MediaPipeFaceRecognition:
         )
         
         self.mp_face_mesh = mp.solutions.face_mesh
+        max_num_faces = 10 if static_image_mode else max(1, int(PERFORMANCE_CONFIG.get('video_max_num_faces', 10)))
         self.face_mesh = self.mp_face_mesh.FaceMesh(
-            static_image_mode=True,
-            max_num_faces=10,
+            static_image_mode=static_image_mode,
+            max_num_faces=max_num_faces,
             refine_landmarks=True,
             min_detection_confidence=0.5
         )
         
-        print(" MediaPipe Face Recognition initialized")
+        # Pre-normalized gallery rows, see set_known_encodings()
+        self.known_matrix = np.zeros((0, 128), dtype=np.float32)
+        
+        print(f" MediaPipe Face Recognition initialized ({'image' if static_image_mode else 'video'} mode)")
     
     def load_image_file(self, image_path: str) -> np.ndarray:
         """
@@ -60,21 +119,32 @@ class MediaPipeFaceRecognition:
             except Exception as cv_error:
                 raise ValueError(f"Failed to load image with both PIL and OpenCV: {cv_error}")
     
-    def face_locations(self, image: np.ndarray, model: str = "hog") -> List[Tuple[int, int, int, int]]:
+    def face_locations(self, image: np.ndarray, model: str = "hog", scale: float = 1.0) -> List[Tuple[int, int, int, int]]:
         """
         Find face locations in image
+        scale: run the detector on a copy resized by this factor; boxes are
+            still returned in the coordinates of image
         Returns list of tuples (top, right, bottom, left) - compatible with face_recognition
         """
+        return self._detect_locations(image, scale)
+    
+    def _detect_locations(self, image: np.ndarray, scale: float = 1.0) -> List[Tuple[int, int, int, int]]:
+        """FaceDetection over the whole image, boxes in image coordinates"""
         try:
-            if len(image.shape) == 3 and image.shape[2] == 3:
-                mp_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            else:
-                mp_image = image
+            small_image = image
+            if scale < 1.0:
+                small_size = (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale)))
+                small_image = cv2.resize(image, small_size, interpolation=cv2.INTER_AREA)
+            
+            # MediaPipe solutions take RGB, which is what this class is given
+            if len(small_image.shape) == 2:
+                small_image = cv2.cvtColor(small_image, cv2.COLOR_GRAY2RGB)
             
-            results = self.face_detection.process(mp_image)
+            results = self.face_detection.process(small_image)
             
             locations = []
             if results.detections:
+                # Relative boxes, so scaling by the full-size shape maps them back
                 height, width = image.shape[:2]
                 
                 for detection in results.detections:
@@ -100,84 +170,145 @@ class MediaPipeFaceRecognition:
             print(f"❌ Face location detection error: {e}")
             return []
     
+    def face_locations_and_encodings(self, image: np.ndarray) -> Tuple[List[Tuple[int, int, int, int]], List[np.ndarray]]:
+        """
+        Face boxes and their encodings
+        FaceDetection boxes are the source of truth, so every detected face is
+        returned even when FaceMesh finds fewer (max_num_faces); one FaceMesh
+        run over the image then encodes them, each landmark set matched to its
+        box by overlap (see face_encodings)
+        Returns: (locations, encodings), aligned
+        """
+        try:
+            locations = self.face_locations(image)
+            if not locations:
+                return [], []
+            return locations, self.face_encodings(image, locations)
+            
+        except Exception as e:
+            print(f"❌ Face detection/encoding error: {e}")
+            return [], []
+    
     def face_encodings(self, image: np.ndarray, known_face_locations: Optional[List] = None, num_jitters: int = 1, model: str = "small") -> List[np.ndarray]:
         """
         Generate face encodings for faces in image
+        Without known_face_locations the faces are detected first
+        (see face_locations_and_encodings)
         Returns list of 128-dimensional face encodings
         """
         try:
             if known_face_locations is None:
-                known_face_locations = self.face_locations(image)
+                return self.face_locations_and_encodings(image)[1]
             
             if not known_face_locations:
                 return []
             
-            encodings = []
+            points = self._landmark_arrays(self._process_mesh(image))
+            height, width = image.shape[:2]
             
-            if len(image.shape) == 3 and image.shape[2] == 3:
-                mp_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            else:
-                mp_image = image
+            # One encoding per box, in box order: each box takes the mesh that overlaps it
+            mesh_indices = self._associate_landmarks(known_face_locations, points, width, height)
+            mesh_encodings = self._extract_face_encodings(points, width, height)
             
-            mesh_results = self.face_mesh.process(mp_image)
+            # Boxes without a mesh get basic encodings, computed as one batch
+            missing = [i for i, mesh_index in enumerate(mesh_indices) if mesh_index is None]
+            basic_encodings = self._create_basic_encodings([self._crop(image, known_face_locations[i]) for i in missing])
+            encodings = dict(zip(missing, basic_encodings))
             
-            if mesh_results.multi_face_landmarks:
-                height, width = image.shape[:2]
-                
-                for i, face_landmarks in enumerate(mesh_results.multi_face_landmarks):
-                    if i < len(known_face_locations):
-                        encoding = self._extract_face_encoding(face_landmarks, width, height)
-                        encodings.append(encoding)
-            else:
-                for location in known_face_locations:
-                    top, right, bottom, left = location
-                    face_region = image[top:bottom, left:right]
-                    encoding = self._create_basic_encoding(face_region)
-                    encodings.append(encoding)
+            for i, mesh_index in enumerate(mesh_indices):
+                if mesh_index is not None:
+                    encodings[i] = mesh_encodings[mesh_index]
             
-            return encodings
+            return [encodings[i] for i in range(len(known_face_locations))]
             
         except Exception as e:
             print(f"❌ Face encoding error: {e}")
             return []
     
+    def _process_mesh(self, image: np.ndarray) -> List:
+        """Run FaceMesh once over the image; returns the landmark sets (possibly empty)"""
+        if len(image.shape) == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        
+        mesh_results = self.face_mesh.process(image)
+        return mesh_results.multi_face_landmarks or []
+    
+    def _crop(self, image: np.ndarray, location: Tuple[int, int, int, int]) -> np.ndarray:
+        top, right, bottom, left = location
+        return image[top:bottom, left:right]
+    
+    def _landmark_array(self, landmarks) -> np.ndarray:
+        """
+        The USED_POINTS landmarks of one face as an (N, 3) array of normalized x, y and z
+        Points missing from a short landmark list are left at zero
+        """
+        points = landmarks.landmark
+        count = len(points)
+        return np.array([
+            (points[i].x, points[i].y, points[i].z) if i < count else (0.0, 0.0, 0.0)
+            for i in USED_POINTS
+        ], dtype=np.float64)
+    
+    def _landmark_arrays(self, multi_face_landmarks) -> np.ndarray:
+        """All faces of a frame as an (F, N, 3) array, converted once per frame"""
+        if not multi_face_landmarks:
+            return np.zeros((0, 0, 3), dtype=np.float64)
+        return np.stack([self._landmark_array(landmarks) for landmarks in multi_face_landmarks])
+    
+    def _landmark_location(self, points: np.ndarray, width: int, height: int) -> Tuple[int, int, int, int]:
+        """Bounding box (top, right, bottom, left) of a face's oval landmarks, in pixels"""
+        oval = points[OVAL_ROWS, :2]
+        (min_x, min_y), (max_x, max_y) = oval.min(axis=0), oval.max(axis=0)
+        return (int(min_y * height), int(max_x * width), int(max_y * height), int(min_x * width))
+    
+    def _associate_landmarks(self, face_locations: List[Tuple[int, int, int, int]], points: np.ndarray,
+                             width: int, height: int) -> List[Optional[int]]:
+        """
+        Landmark set of each face box, matched by box overlap rather than list order
+        FaceDetection and FaceMesh (especially when tracking) do not return
+        faces in the same order or number
+        Returns: list aligned with face_locations of indices into points,
+        None where no mesh overlaps the box
+        """
+        associated = [None] * len(face_locations)
+        if len(points) == 0:
+            return associated
+        
+        if match_face_locations is None:
+            for i in range(min(len(points), len(face_locations))):
+                associated[i] = i
+            return associated
+        
+        mesh_locations = [self._landmark_location(face_points, width, height) for face_points in points]
+        for box_index, mesh_index in match_face_locations(face_locations, mesh_locations):
+            associated[box_index] = mesh_index
+        return associated
+    
+    def _extract_face_encodings(self, points: np.ndarray, width: int, height: int) -> np.ndarray:
+        """
+        128-d encodings of all faces of a frame from their (F, N, 3) landmark arrays
+        Features are gathered with ENCODING_INDEX in one indexing operation
+        Returns: array (F, 128), rows L2-normalized
+        """
+        points = np.asarray(points, dtype=np.float64)
+        num_faces = points.shape[0]
+        if num_faces == 0:
+            return np.zeros((0, 128), dtype=np.float64)
+        
+        scaled = points * np.array([width, height, 1.0])
+        features = scaled.reshape(num_faces, -1)[:, ENCODING_INDEX]
+        
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        return np.divide(features, norms, out=np.zeros_like(features), where=norms > 0)
+    
     def _extract_face_encoding(self, landmarks, width: int, height: int) -> np.ndarray:
         """
         Extract face encoding from MediaPipe face landmarks
         Creates a 128-dimensional feature vector
         """
         try:
-
-            key_points = [
-                # Nose tip, nose bridge
-                1, 2, 5, 4, 6, 19, 20, 94, 125, 141, 235, 236, 3, 51, 48, 115, 131, 134, 102, 49, 220, 305, 307, 375, 321, 308, 324, 318,
-                # Eyes
-                33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161, 246, 362, 398, 384, 385, 386, 387, 388, 466, 263, 249, 390, 373, 374, 380, 381, 382,
-                # Eyebrows  
-                70, 63, 105, 66, 107, 55, 65, 52, 53, 46, 285, 295, 282, 283, 276, 300, 293, 334, 296, 336,
-                # Mouth
-                61, 84, 17, 314, 405, 320, 307, 375, 321, 308, 324, 318, 78, 191, 80, 81, 82, 13, 312, 311, 310, 415, 308, 324, 318
-            ]
-            
-            features = []
-            for point_idx in key_points:
-                if point_idx < len(landmarks.landmark):
-                    landmark = landmarks.landmark[point_idx]
-                    x = landmark.x * width
-                    y = landmark.y * height
-                    z = landmark.z if hasattr(landmark, 'z') else 0
-                    features.extend([x, y, z])
-            
-            if len(features) > 128:
-                features = features[:128]
-            elif len(features) < 128:
-                features.extend([0.0] * (128 - len(features)))
-            
-            features = np.array(features, dtype=np.float64)
-            if np.linalg.norm(features) > 0:
-                features = features / np.linalg.norm(features)
-            
-            return features
+            points = landmarks if isinstance(landmarks, np.ndarray) else self._landmark_array(landmarks)
+            return self._extract_face_encodings(points[np.newaxis], width, height)[0]
             
         except Exception as e:
             print(f"❌ Error extracting face encoding: {e}")
@@ -187,78 +318,136 @@ class MediaPipeFaceRecognition:
         """
         Create basic face encoding from face region when landmarks are not available
         """
+        return self._create_basic_encodings([face_region])[0]
+    
+    def _create_basic_encodings(self, face_regions: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        Basic encodings for a batch of face regions; the LBP step runs once for all of them
+        """
+        encodings = [np.zeros(128, dtype=np.float64) for _ in face_regions]
+        
         try:
-            if face_region.size == 0:
-                return np.zeros(128, dtype=np.float64)
-            
-            face_resized = cv2.resize(face_region, (64, 64))
-            
-            if len(face_resized.shape) == 3:
-                face_gray = cv2.cvtColor(face_resized, cv2.COLOR_RGB2GRAY)
-            else:
-                face_gray = face_resized
-            
-            # 1. Histogram features
-            hist = cv2.calcHist([face_gray], [0], None, [32], [0, 256])
-            hist_features = hist.flatten()
-            
-            # 2. LBP-like features 
-            lbp_features = self._simple_lbp(face_gray)
-            
-            # 3. Edge features
-            edges = cv2.Canny(face_gray, 100, 200)
-            edge_features = np.sum(edges, axis=0)[:32] 
-            
-
-            all_features = np.concatenate([hist_features, lbp_features, edge_features])
-            
-            if len(all_features) > 128:
-                all_features = all_features[:128]
-            elif len(all_features) < 128:
-                padding = np.zeros(128 - len(all_features))
-                all_features = np.concatenate([all_features, padding])
-            
-            features = all_features.astype(np.float64)
-            if np.linalg.norm(features) > 0:
-                features = features / np.linalg.norm(features)
+            valid = [i for i, face_region in enumerate(face_regions) if face_region is not None and face_region.size > 0]
+            if not valid:
+                return encodings
+            
+            faces_gray = []
+            for i in valid:
+                face_resized = cv2.resize(face_regions[i], (64, 64))
+                if len(face_resized.shape) == 3:
+                    face_resized = cv2.cvtColor(face_resized, cv2.COLOR_RGB2GRAY)
+                faces_gray.append(face_resized)
+            
+            # 2. LBP-like features, whole batch at once
+            lbp_features = self._simple_lbp_batch(np.stack(faces_gray))
+            
+            for face_gray, lbp_hist, i in zip(faces_gray, lbp_features, valid):
+                # 1. Histogram features
+                hist = cv2.calcHist([face_gray], [0], None, [32], [0, 256])
+                hist_features = hist.flatten()
+                
+                # 3. Edge features
+                edges = cv2.Canny(face_gray, 100, 200)
+                edge_features = np.sum(edges, axis=0)[:32]
+                
+                all_features = np.concatenate([hist_features, lbp_hist, edge_features])
+                
+                if len(all_features) > 128:
+                    all_features = all_features[:128]
+                elif len(all_features) < 128:
+                    padding = np.zeros(128 - len(all_features))
+                    all_features = np.concatenate([all_features, padding])
+                
+                features = all_features.astype(np.float64)
+                if np.linalg.norm(features) > 0:
+                    features = features / np.linalg.norm(features)
+                
+                encodings[i] = features
             
-            return features
+            return encodings
             
         except Exception as e:
             print(f"❌ Error creating basic encoding: {e}")
-            return np.zeros(128, dtype=np.float64)
+            return encodings
+    
+    # Neighbour offsets (row, col) in bit order: clockwise from the top-left
+    _LBP_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
     
     def _simple_lbp(self, image: np.ndarray, radius: int = 1, n_points: int = 8) -> np.ndarray:
         """
         Simplified Local Binary Pattern feature extraction
         """
+        return self._simple_lbp_batch(image[np.newaxis], radius, n_points)[0]
+    
+    def _simple_lbp_batch(self, images: np.ndarray, radius: int = 1, n_points: int = 8) -> np.ndarray:
+        """
+        LBP histograms for a batch of grayscale images (B x H x W) in one call
+        Each neighbour bit is one shifted-array comparison over the whole batch;
+        pixels within ``radius`` of the border keep code 0
+        Returns: array (B, 32) of histogram counts
+        """
         try:
-            height, width = image.shape
-            lbp = np.zeros((height, width), dtype=np.uint8)
-            
-            for i in range(radius, height - radius):
-                for j in range(radius, width - radius):
-                    center = image[i, j]
-                    code = 0
-                    
-                    neighbors = [
-                        image[i-1, j-1], image[i-1, j], image[i-1, j+1],
-                        image[i, j+1], image[i+1, j+1], image[i+1, j],
-                        image[i+1, j-1], image[i, j-1]
-                    ]
-                    
-                    for k, neighbor in enumerate(neighbors):
-                        if neighbor >= center:
-                            code |= (1 << k)
-                    
-                    lbp[i, j] = code
+            images = np.asarray(images)
+            batch, height, width = images.shape
+            lbp = np.zeros((batch, height, width), dtype=np.uint8)
+            
+            if height > 2 * radius and width > 2 * radius:
+                rows = slice(radius, height - radius)
+                cols = slice(radius, width - radius)
+                center = images[:, rows, cols]
+                codes = lbp[:, rows, cols]
+                
+                for bit, (di, dj) in enumerate(self._LBP_OFFSETS[:n_points]):
+                    neighbor = images[:, radius + di:height - radius + di, radius + dj:width - radius + dj]
+                    codes |= (neighbor >= center).astype(np.uint8) << bit
             
-            hist, _ = np.histogram(lbp.ravel(), bins=32, range=[0, 256])
-            return hist.astype(np.float64)
+            # 32 equal bins over [0, 256): bin = code // 8, counted per image
+            bins = (lbp.reshape(batch, -1) >> 3).astype(np.int64) + 32 * np.arange(batch)[:, None]
+            return np.bincount(bins.ravel(), minlength=32 * batch).reshape(batch, 32).astype(np.float64)
             
         except Exception as e:
             print(f"❌ LBP error: {e}")
-            return np.zeros(32, dtype=np.float64)
+            return np.zeros((len(images), 32), dtype=np.float64)
+    
+    def set_known_encodings(self, known_encodings: List[np.ndarray]):
+        """
+        Store the gallery as L2-normalized float32 rows
+        Cosine distance against it is then a single matrix product
+        """
+        if known_encodings is None or len(known_encodings) == 0:
+            self.known_matrix = np.zeros((0, 128), dtype=np.float32)
+        else:
+            self.known_matrix = normalize_rows(np.asarray(known_encodings))
+    
+    def _cosine_distances(self, known_matrix: np.ndarray, face_encodings: np.ndarray) -> np.ndarray:
+        """
+        Cosine distance between probes (P x 128) and pre-normalized rows (N x 128)
+        Zero vectors get distance 1.0
+        Returns: array of shape (P, N)
+        """
+        probes = normalize_rows(np.atleast_2d(face_encodings))
+        return 1.0 - probes @ known_matrix.T
+    
+    def match_faces(self, face_encodings: List[np.ndarray], known_encodings: Optional[List[np.ndarray]] = None,
+                    tolerance: float = 0.6) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Distances and matches for a batch of probe encodings in one call
+        Uses the gallery from set_known_encodings() when known_encodings is None
+        Returns: (distances, matches), both of shape (num_probes, num_known)
+        """
+        try:
+            known_matrix = self.known_matrix if known_encodings is None else normalize_rows(np.asarray(known_encodings))
+            
+            if face_encodings is None or len(face_encodings) == 0 or known_matrix.shape[0] == 0:
+                empty = np.zeros((0 if face_encodings is None else len(face_encodings), known_matrix.shape[0]))
+                return empty.astype(np.float32), empty.astype(bool)
+            
+            distances = self._cosine_distances(known_matrix, np.asarray(face_encodings))
+            return distances, distances <= tolerance
+            
+        except Exception as e:
+            print(f"❌ Face matching error: {e}")
+            return np.zeros((0, 0), dtype=np.float32), np.zeros((0, 0), dtype=bool)
     
     def compare_faces(self, known_encodings: List[np.ndarray], face_encoding: np.ndarray, tolerance: float = 0.6) -> List[bool]:
         """
@@ -269,20 +458,8 @@ class MediaPipeFaceRecognition:
             if not known_encodings or face_encoding is None:
                 return []
             
-            distances = []
-            for known_encoding in known_encodings:
-                dot_product = np.dot(known_encoding, face_encoding)
-                norm_product = np.linalg.norm(known_encoding) * np.linalg.norm(face_encoding)
-                
-                if norm_product == 0:
-                    distance = 1.0
-                else:
-                    similarity = dot_product / norm_product
-                    distance = 1.0 - similarity
-                
-                distances.append(distance)
-            
-            return [distance <= tolerance for distance in distances]
+            distances = self._cosine_distances(normalize_rows(np.asarray(known_encodings)), face_encoding)[0]
+            return (distances <= tolerance).tolist()
             
         except Exception as e:
             print(f"❌ Face comparison error: {e}")
@@ -296,31 +473,91 @@ class MediaPipeFaceRecognition:
             if not known_encodings or face_encoding is None:
                 return []
             
-            distances = []
-            for known_encoding in known_encodings:
-                dot_product = np.dot(known_encoding, face_encoding)
-                norm_product = np.linalg.norm(known_encoding) * np.linalg.norm(face_encoding)
-                
-                if norm_product == 0:
-                    distance = 1.0
-                else:
-                    similarity = dot_product / norm_product
-                    distance = 1.0 - similarity
-                
-                distances.append(distance)
-            
-            return distances
+            return self._cosine_distances(normalize_rows(np.asarray(known_encodings)), face_encoding)[0].tolist()
             
         except Exception as e:
             print(f"❌ Face distance calculation error: {e}")
             return [1.0] * len(known_encodings)
     
-    def __del__(self):
-        """Cleanup MediaPipe resources"""
+    def close(self):
+        """Release the MediaPipe graphs; safe to call more than once"""
         try:
-            if hasattr(self, 'face_detection'):
+            if getattr(self, 'face_detection', None) is not None:
                 self.face_detection.close()
-            if hasattr(self, 'face_mesh'):
+                self.face_detection = None
+            if getattr(self, 'face_mesh', None) is not None:
                 self.face_mesh.close()
+                self.face_mesh = None
+        except Exception as e:
+            print(f"❌ Error closing MediaPipe resources: {e}")
+    
+    def __del__(self):
+        """Cleanup MediaPipe resources"""
+        try:
+            self.close()
         except:
-            pass
\ No newline at end of file
+            pass
+
+
+class MediaPipePool:
+    """
+    Process-wide pool of MediaPipeFaceRecognition instances, one per thread
+    
+    Building the FaceDetection and FaceMesh graphs is far more expensive than
+    running them, so callers borrow the instance of their thread instead of
+    constructing one per call. MediaPipe graphs must not be used from two
+    threads at once, hence one instance per thread rather than one shared.
+    Instances are closed by release_thread() or close_all().
+    """
+    
+    def __init__(self, factory=MediaPipeFaceRecognition):
+        self.factory = factory
+        self._instances: Dict[Tuple[int, Optional[object]], MediaPipeFaceRecognition] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, stream=None) -> MediaPipeFaceRecognition:
+        """
+        Instance owned by the calling thread, created on first use
+        stream: None for independent images (static mode); a camera id or
+            other stream key for a video-mode instance that tracks that stream
+        """
+        key = (threading.get_ident(), stream)
+        with self._lock:
+            instance = self._instances.get(key)
+        
+        if instance is None:
+            instance = self.factory(static_image_mode=stream is None)
+            with self._lock:
+                self._instances[key] = instance
+        return instance
+    
+    def _release(self, matches):
+        with self._lock:
+            keys = [key for key in self._instances if matches(key)]
+            instances = [self._instances.pop(key) for key in keys]
+        for instance in instances:
+            instance.close()
+    
+    def release_thread(self):
+        """Close the calling thread's instances, e.g. when a worker thread stops"""
+        thread_id = threading.get_ident()
+        self._release(lambda key: key[0] == thread_id)
+    
+    def release_stream(self, stream):
+        """Close the video-mode instances of a stream, e.g. when its camera stops"""
+        self._release(lambda key: key[1] == stream and stream is not None)
+    
+    def close_all(self):
+        """Close every instance; later get() calls build fresh ones"""
+        with self._lock:
+            instances = list(self._instances.values())
+            self._instances.clear()
+        for instance in instances:
+            instance.close()
+    
+    def __len__(self) -> int:
+        return len(self._instances)
+
+
+mediapipe_pool = MediaPipePool()
+atexit.register(mediapipe_pool.close_all)
\ No newline at end of file
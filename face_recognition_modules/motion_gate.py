@@ -0,0 +1,80 @@
+# face_recognition_modules/motion_gate.py
+
+"""
+Motion gate for live camera streams
+Compares a small blurred grayscale copy of every frame with the last frame
+that went through recognition; static frames can reuse the previous results
+"""
+
+import cv2
+import numpy as np
+
+try:
+    from config import PERFORMANCE_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+
+
+class MotionGate:
+    """
+    threshold: mean absolute difference (gray levels, 0-255) above which a
+        frame counts as motion
+    width: frames are downsampled to this width before differencing
+    max_static_frames: force a pass after this many static frames in a row
+        (0 = never), so lighting drift or a missed change cannot freeze results
+    """
+
+    def __init__(self, threshold=None, width=None, max_static_frames=None):
+        self.threshold = (threshold if threshold is not None
+                          else PERFORMANCE_CONFIG.get('motion_threshold', 3.0))
+        self.width = width or PERFORMANCE_CONFIG.get('motion_downsample_width', 64)
+        self.max_static_frames = (max_static_frames if max_static_frames is not None
+                                  else PERFORMANCE_CONFIG.get('motion_max_static_frames', 150))
+        self.reset()
+
+    def reset(self):
+        """Re-arm: the next frame always passes"""
+        self._reference = None
+        self._static_run = 0
+        self.last_score = 0.0
+        self.passed = 0
+        self.skipped = 0
+
+    @property
+    def skip_ratio(self):
+        total = self.passed + self.skipped
+        return self.skipped / total if total else 0.0
+
+    def _thumbnail(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        height, width = gray.shape[:2]
+        if width > self.width:
+            size = (self.width, max(1, int(round(height * self.width / width))))
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(gray, (5, 5), 0).astype(np.int16)
+
+    def check(self, frame):
+        """
+        Returns True if the frame must go through recognition, False if the
+        previous results can be reused
+        """
+        thumbnail = self._thumbnail(frame)
+
+        if self._reference is None or self._reference.shape != thumbnail.shape:
+            self.last_score = float('inf')
+        else:
+            self.last_score = float(np.abs(thumbnail - self._reference).mean())
+
+        static = self.last_score < self.threshold
+        if static and self.max_static_frames and self._static_run >= self.max_static_frames:
+            static = False
+
+        if static:
+            self._static_run += 1
+            self.skipped += 1
+            return False
+
+        self._reference = thumbnail
+        self._static_run = 0
+        self.passed += 1
+        return True
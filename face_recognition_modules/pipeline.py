@@ -0,0 +1,147 @@
+# face_recognition_modules/pipeline.py
+
+"""
+Recognition pipeline for live camera streams
+Frames first go through a MotionGate (static frames reuse the last results)
+and the AdaptiveController frame stride, then full detection runs only on
+keyframes (at the controller's detection scale), faces are propagated with
+FaceTracker in between and only tracks that need it are re-encoded
+"""
+
+import time
+
+import cv2
+
+from .adaptive_controller import AdaptiveController
+from .face_tracker import FaceTracker
+from .motion_gate import MotionGate
+
+try:
+    from config import PERFORMANCE_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+
+
+class RecognitionPipeline:
+    """
+    recognizer: object with detect_faces(frame, stream, scale),
+        recognize_locations(frame, locations, top_k, stream) and
+        recognize_faces(frame, top_k, stream) (used when tracking is off)
+    keyframe_interval: frames between two full detections
+    min_confidence: tracks below this confidence (or unknown) are re-encoded
+        on every keyframe
+    refresh_frames: known tracks are re-encoded at least this often
+    tracking / motion_gate: default to tracking_enabled / motion_gate_enabled
+    controller: AdaptiveController choosing frame stride and detection scale
+    """
+
+    def __init__(self, recognizer, keyframe_interval=None, min_confidence=None,
+                 refresh_frames=None, stream=None, top_k=None, tracking=None,
+                 motion_gate=None, controller=None):
+        self.recognizer = recognizer
+        self.keyframe_interval = max(1, keyframe_interval or PERFORMANCE_CONFIG.get('keyframe_interval', 5))
+        self.min_confidence = (min_confidence if min_confidence is not None
+                               else PERFORMANCE_CONFIG.get('track_min_confidence', 0.5))
+        self.refresh_frames = refresh_frames or PERFORMANCE_CONFIG.get('track_refresh_frames', 30)
+        self.stream = stream
+        self.top_k = top_k
+        self.tracking = (tracking if tracking is not None
+                         else PERFORMANCE_CONFIG.get('tracking_enabled', True))
+        if motion_gate is None:
+            motion_gate = PERFORMANCE_CONFIG.get('motion_gate_enabled', True)
+        self.motion_gate = MotionGate() if motion_gate else None
+        self.controller = controller or AdaptiveController()
+        self.tracker = FaceTracker()
+        self.frame_index = 0
+        self._frames_seen = 0
+        self._last_keyframe = None
+        self._last_results = []
+        self.stats = {'keyframes': 0, 'tracked_frames': 0, 'encodings': 0}
+
+    def reset(self):
+        """Bắt đầu lại từ đầu (ví dụ khi đổi camera)"""
+        self.tracker.reset()
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+        self.frame_index = 0
+        self._frames_seen = 0
+        self._last_results = []
+        self._last_keyframe = None
+        self.stats = {'keyframes': 0, 'tracked_frames': 0, 'encodings': 0}
+
+    def _is_keyframe(self):
+        if self._last_keyframe is None or self.tracker.has_lost_tracks:
+            return True
+        return self.frame_index - self._last_keyframe >= self.keyframe_interval
+
+    def _needs_encoding(self, track):
+        if track.result is None or not track.is_known:
+            return True
+        if track.confidence < self.min_confidence:
+            return True
+        return self.frame_index - track.encoded_at >= self.refresh_frames
+
+    def process(self, frame):
+        """
+        Process one frame
+        Returns: recognition result dicts (as SafeFaceRecognizer.recognize_faces)
+            with an extra 'track_id'
+        """
+        if frame is None:
+            return []
+
+        if self.motion_gate is not None and not self.motion_gate.check(frame):
+            return [dict(result) for result in self._last_results]
+
+        frame_number = self._frames_seen
+        self._frames_seen += 1
+        if not self.controller.should_process(frame_number):
+            return [dict(result) for result in self._last_results]
+
+        timings = {}
+        started = time.perf_counter()
+
+        if not self.tracking:
+            self._last_results = self.recognizer.recognize_faces(frame, self.top_k, self.stream)
+            timings['recognize'] = (time.perf_counter() - started) * 1000
+            self.controller.record(timings)
+            self.frame_index += 1
+            return [dict(result) for result in self._last_results]
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+        if self._is_keyframe():
+            detections = self.recognizer.detect_faces(frame, self.stream, self.controller.scale)
+            tracks, _ = self.tracker.update(detections, gray)
+            self._last_keyframe = self.frame_index
+            self.stats['keyframes'] += 1
+            encode_started = time.perf_counter()
+            timings['detect'] = (encode_started - started) * 1000
+
+            # Only new, unknown, low-confidence or due tracks are encoded
+            stale = [track for track in tracks if self._needs_encoding(track)]
+            if stale:
+                results = self.recognizer.recognize_locations(
+                    frame, [track.location for track in stale], self.top_k, self.stream
+                )
+                if len(results) == len(stale):
+                    for track, result in zip(stale, results):
+                        track.result = result
+                        track.encoded_at = self.frame_index
+                    self.stats['encodings'] += len(stale)
+            timings['encode'] = (time.perf_counter() - encode_started) * 1000
+        else:
+            tracks = [track for track in self.tracker.propagate(gray) if track.visible]
+            self.stats['tracked_frames'] += 1
+            timings['track'] = (time.perf_counter() - started) * 1000
+
+        self.controller.record(timings)
+        self.frame_index += 1
+        self._last_results = [self._result(track) for track in tracks if track.result is not None]
+        return [dict(result) for result in self._last_results]
+
+    def _result(self, track):
+        result = dict(track.result)
+        result['location'] = track.location
+        result['track_id'] = track.track_id
+        return result
@@ -0,0 +1,343 @@
+# face_recognition_modules/process_pool.py
+
+"""
+Multi-process face detection / encoding
+dlib and MediaPipe inference are CPU-bound and hold the GIL long enough
+that threads do not use all cores, so frames are spread over worker
+processes. Each worker owns one multiprocessing.shared_memory frame slot:
+the parent copies a frame into the slot of an idle worker and only sends
+its sequence number and shape over the pipe, never the pixels.
+
+At most one frame is in flight per worker and one more per stream waits
+in the parent; a newer frame replaces the waiting one of its stream
+(counted as dropped), so memory and latency stay bounded when the workers
+fall behind. Several cameras share one pool; results are handed back per
+stream, in frame order. Matching stays in the parent, against its
+in-memory gallery.
+
+The number of workers comes from PERFORMANCE_CONFIG['face_recognition_workers'].
+"""
+
+import multiprocessing as mp
+import threading
+import time
+import weakref
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .sharded_gallery import _attach_array
+
+try:
+    from config import PERFORMANCE_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+
+
+def _create_backend(backend: str):
+    """Detect + encode function of a worker: frame -> (locations, encodings)"""
+    if backend == 'mediapipe':
+        from .mediapipe_recognizer import MediaPipeFaceRecognition
+        recognizer = MediaPipeFaceRecognition(static_image_mode=True)
+        return recognizer.face_locations_and_encodings, recognizer.close
+
+    if backend == 'face_recognition':
+        import face_recognition
+
+        def detect_and_encode(frame):
+            locations = face_recognition.face_locations(frame)
+            if not locations:
+                return [], []
+            return locations, face_recognition.face_encodings(frame, locations)
+
+        return detect_and_encode, None
+
+    raise ValueError(f"Unsupported recognition backend: {backend}")
+
+
+def _frame_worker(conn, backend: str):
+    """
+    Worker loop: runs the backend on frames written into its shared slot
+    Messages: ('process', seq, slot_name, shape) | ('close',)
+    Replies:  ('result', seq, locations, encodings) | ('error', seq, message)
+    """
+    slot = None
+    slot_name = None
+    close_backend = None
+
+    try:
+        detect_and_encode, close_backend = _create_backend(backend)
+
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+
+            if message[0] == 'close':
+                break
+
+            _, seq, name, shape = message
+            if name != slot_name:
+                # The parent grew the slot for a larger frame
+                if slot is not None:
+                    slot.close()
+                slot, _ = _attach_array(name, (0,), np.uint8)
+                slot_name = name
+
+            frame = np.ndarray(shape, dtype=np.uint8, buffer=slot.buf)
+            try:
+                # Frames arrive BGR, as the camera delivers them; the backends and
+                # the enrolled gallery use RGB (ensure_valid_image_format on the thread path)
+                if frame.ndim == 2:
+                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+                else:
+                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                locations, encodings = detect_and_encode(rgb_frame)
+                conn.send(('result', seq, [tuple(int(v) for v in location) for location in locations],
+                           [np.asarray(encoding, dtype=np.float32) for encoding in encodings]))
+            except Exception as e:
+                conn.send(('error', seq, str(e)))
+            finally:
+                del frame
+    finally:
+        if close_backend is not None:
+            close_backend()
+        if slot is not None:
+            slot.close()
+        conn.close()
+
+
+class _Worker:
+    """Parent-side handle of one worker: process, pipe and frame slot"""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.slot = None
+        self.busy = None  # (seq, frame_id, info) of the frame in flight
+        self.alive = True
+
+    def write_frame(self, frame: np.ndarray) -> str:
+        if self.slot is None or self.slot.size < frame.nbytes:
+            self.release()
+            self.slot = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+        np.ndarray(frame.shape, dtype=np.uint8, buffer=self.slot.buf)[:] = frame
+        return self.slot.name
+
+    def release(self):
+        if self.slot is not None:
+            self.slot.close()
+            self.slot.unlink()
+            self.slot = None
+
+
+def _shutdown(workers: List[_Worker]):
+    for worker in workers:
+        try:
+            worker.conn.send(('close',))
+        except (BrokenPipeError, OSError):
+            pass
+        worker.process.join(timeout=5)
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.conn.close()
+        worker.release()
+    workers.clear()
+
+
+class ProcessRecognitionPool:
+    """
+    Pool of detection / encoding worker processes, shared by camera streams
+
+    submit(frame, stream=...) never blocks: the frame goes to an idle worker
+    or waits in that stream's pending slot, replacing (dropping) an older
+    waiting frame of the same stream. Streams waiting for a worker are
+    served in turn, so one camera cannot starve the others.
+    poll(stream=...) returns that stream's finished frames strictly in
+    submission order as (frame_id, locations, encodings, info) tuples;
+    dropped frames are skipped. A single user can leave stream as None.
+
+    Call close() (or use it as a context manager) to stop the workers and
+    free the shared memory; it is also done on garbage collection.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, backend: Optional[str] = None):
+        if num_workers is None:
+            num_workers = PERFORMANCE_CONFIG.get('face_recognition_workers', 2)
+        if backend is None:
+            try:
+                import mediapipe  # noqa: F401
+                backend = 'mediapipe'
+            except ImportError:
+                backend = 'face_recognition'
+
+        self.backend = backend
+        self.num_workers = max(1, int(num_workers))
+        self._lock = threading.Lock()
+        self._pending: Dict = {}   # stream -> (frame, frame_id, info) waiting for a worker
+        self._next_seq = 0         # sequence number of the next dispatched frame
+        self._order: Dict = {}     # stream -> deque of its dispatched sequence numbers
+        self._finished: Dict[int, Tuple] = {}
+
+        self.submitted_frames = 0
+        self.dropped_frames = 0
+        self.failed_frames = 0
+
+        # Same as ShardedGallery: start the tracker before the workers. They are
+        # spawned, not forked: the parent already runs MediaPipe graph threads
+        resource_tracker.ensure_running()
+        context = mp.get_context('spawn')
+        self._workers: List[_Worker] = []
+        for _ in range(self.num_workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_frame_worker, args=(child_conn, backend), daemon=True)
+            process.start()
+            child_conn.close()
+            self._workers.append(_Worker(process, parent_conn))
+
+        self._finalizer = weakref.finalize(self, _shutdown, self._workers)
+
+    def __enter__(self) -> 'ProcessRecognitionPool':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def in_flight(self) -> int:
+        return sum(worker.busy is not None for worker in self._workers)
+
+    @property
+    def alive_workers(self) -> int:
+        return sum(worker.alive for worker in self._workers)
+
+    def close(self):
+        """Stop the workers and unlink the frame slots"""
+        with self._lock:
+            self._pending.clear()
+            self._order.clear()
+            self._finished.clear()
+            self._finalizer()
+
+    def release_stream(self, stream):
+        """Forget a stream: drop its waiting frame and results nobody will poll"""
+        with self._lock:
+            self._pending.pop(stream, None)
+            for seq in self._order.pop(stream, ()):
+                self._finished.pop(seq, None)
+
+    def submit(self, frame: np.ndarray, frame_id=None, info: Optional[dict] = None, stream=None) -> bool:
+        """
+        Queue a frame (uint8 BGR image, as read from the camera) for
+        detection and encoding; the worker converts it to RGB
+        stream: camera the frame belongs to, results come back per stream
+        Returns: False if it replaced a waiting frame that was then dropped,
+            or if no worker is left to process it
+        """
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        with self._lock:
+            self.submitted_frames += 1
+            if not any(worker.alive for worker in self._workers):
+                self.failed_frames += 1
+                return False
+            replaced = stream in self._pending
+            if replaced:
+                self.dropped_frames += 1
+            # A replacing frame keeps the stream's place in the queue
+            self._pending[stream] = (frame, frame_id, info or {})
+            self._order.setdefault(stream, deque())
+            self._dispatch()
+            return not replaced
+
+    def _dispatch(self):
+        for worker in self._workers:
+            if not self._pending:
+                return
+            if not worker.alive or worker.busy is not None:
+                continue
+
+            # Oldest waiting stream first
+            stream = next(iter(self._pending))
+            frame, frame_id, info = self._pending.pop(stream)
+            seq = self._next_seq
+            self._next_seq += 1
+            self._order.setdefault(stream, deque()).append(seq)
+            name = worker.write_frame(frame)
+            try:
+                worker.conn.send(('process', seq, name, frame.shape))
+            except (BrokenPipeError, OSError):
+                worker.alive = False
+                self.failed_frames += 1
+                self._finished[seq] = (frame_id, [], [], info)
+                continue
+            worker.busy = (seq, stream, frame_id, info)
+
+    def _ready(self, stream) -> bool:
+        order = self._order.get(stream)
+        return bool(order) and order[0] in self._finished
+
+    def poll(self, timeout: float = 0.0, stream=None) -> List[Tuple]:
+        """
+        Collect finished frames, waiting up to timeout seconds for the first one
+        Replies for other streams are kept until those streams poll
+        Returns: [(frame_id, locations, encodings, info)] of stream in
+            submission order; frames whose worker failed come back with
+            empty results
+        """
+        with self._lock:
+            if self._ready(stream):
+                timeout = 0.0
+            busy = [worker for worker in self._workers if worker.busy is not None]
+            ready = wait([worker.conn for worker in busy], timeout) if busy else []
+
+            for worker in busy:
+                if worker.conn not in ready:
+                    continue
+                seq, owner, frame_id, info = worker.busy
+                worker.busy = None
+                try:
+                    reply = worker.conn.recv()
+                except (EOFError, OSError):
+                    # The process died; its frame fails and it gets no new ones
+                    worker.alive = False
+                    reply = ('error', seq, 'worker process exited')
+
+                if reply[0] != 'result':
+                    self.failed_frames += 1
+                    print(f"❌ Recognition worker error: {reply[2]}")
+                if owner not in self._order:
+                    # The stream was released while its frame was in flight
+                    continue
+                if reply[0] == 'result':
+                    self._finished[seq] = (frame_id, reply[2], reply[3], info)
+                else:
+                    self._finished[seq] = (frame_id, [], [], info)
+
+            self._dispatch()
+
+            ordered = []
+            order = self._order.get(stream)
+            while order and order[0] in self._finished:
+                ordered.append(self._finished.pop(order.popleft()))
+            return ordered
+
+    def drain(self, timeout: float = 10.0, stream=None) -> List[Tuple]:
+        """Wait for every submitted frame of stream (pending included) and return the rest in order"""
+        results = []
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                waiting = stream in self._pending and self.alive_workers
+                outstanding = bool(self._order.get(stream))
+            if not (waiting or outstanding):
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            results.extend(self.poll(remaining, stream))
+        return results
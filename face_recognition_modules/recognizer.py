@@ -7,6 +7,8 @@ import os
 from typing import List, Dict, Optional, Tuple
 import logging
 from .face_detector import FaceDetector
+from .gallery import FaceGallery, create_gallery
+from .sharded_gallery import ShardedGallery
 
 class FaceRecognizer:
     def __init__(self):
@@ -16,6 +18,7 @@ class FaceRecognizer:
         self.known_face_student_ids = []
         self.face_detector = FaceDetector()
         self.tolerance = 0.6
+        self._gallery = None
         self.load_known_faces()
     
     def set_tolerance(self, tolerance: float):
@@ -28,6 +31,7 @@ class FaceRecognizer:
         try:
             self._load_from_json()
             self._load_from_images()
+            self._invalidate_gallery()
             
             print(f"Loaded {len(self.known_face_encodings)} known faces")
             
@@ -73,6 +77,8 @@ class FaceRecognizer:
             
             if user_index is not None:
                 self.known_face_encodings[user_index] = new_encoding
+                if self._gallery is not None:
+                    self._gallery.replace(user_id, self._user_encodings(user_id))
                 self._save_to_json()
                 return True
             else:
@@ -100,6 +106,8 @@ class FaceRecognizer:
                 del self.known_face_student_ids[i]
             
             if indices_to_remove:
+                if self._gallery is not None:
+                    self._gallery.remove(user_id)
                 self._save_to_json()
                 print(f"Removed {len(indices_to_remove)} face encodings for user ID {user_id}")
                 return True
@@ -129,6 +137,7 @@ class FaceRecognizer:
             self.known_face_names.clear()
             self.known_face_ids.clear()
             self.known_face_student_ids.clear()
+            self._invalidate_gallery()
             
             
             self.load_known_faces()
@@ -147,7 +156,7 @@ class FaceRecognizer:
         Returns: (is_valid, message)
         """
         try:
-            face_locations = self.face_detector.detect_faces_fr(frame)
+            face_locations = self.face_detector.detect_faces_fr(frame, full_scan=True)
             
             if len(face_locations) == 0:
                 return False, "Không tìm thấy khuôn mặt"
@@ -298,6 +307,9 @@ class FaceRecognizer:
             self.known_face_names.append(name)
             self.known_face_ids.append(user_id)
             self.known_face_student_ids.append(student_id)
+            if self._gallery is not None:
+                # Fold the new entry into the cached gallery (and its PCA projection)
+                self._gallery.add(user_id, [encoding])
             
             
             self._save_to_json()
@@ -326,46 +338,123 @@ class FaceRecognizer:
         with open(json_file, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
     
-    def recognize_faces(self, frame) -> List[Dict]:
+    def _invalidate_gallery(self):
+        """Drop the cached gallery array after known faces change"""
+        if isinstance(self._gallery, ShardedGallery):
+            # Keep the worker processes, only reload their shards
+            self._gallery.build(self._gallery_entries())
+        else:
+            self._gallery = None
+    
+    def _gallery_entries(self) -> Dict[int, List[np.ndarray]]:
+        entries = {}
+        for user_id, encoding in zip(self.known_face_ids, self.known_face_encodings):
+            entries.setdefault(user_id, []).append(encoding)
+        return entries
+    
+    def _user_encodings(self, user_id: int) -> List[np.ndarray]:
+        return [encoding for uid, encoding in zip(self.known_face_ids, self.known_face_encodings) if uid == user_id]
+    
+    def _get_gallery(self) -> FaceGallery:
+        """
+        Gallery array built once from known_face_encodings, one row per entry
+        Labelled by user ID like SafeFaceRecognizer, so adding or removing a
+        user updates it in place; list positions shift on delete
+        """
+        if self._gallery is None:
+            gallery = create_gallery(metric='euclidean')
+            gallery.build(self._gallery_entries())
+            self._gallery = gallery
+        return self._gallery
+    
+    def close(self):
+        """Stop the gallery worker processes (gallery_index 'sharded')"""
+        if isinstance(self._gallery, ShardedGallery):
+            self._gallery.close()
+            self._gallery = None
+    
+    def match_encodings(self, face_encodings: List[np.ndarray]) -> List[Tuple[Optional[int], float]]:
+        """
+        Match a batch of probe encodings against the known faces
+        The gallery searches all probes in one batch (exact or ANN, see
+        PERFORMANCE_CONFIG['gallery_index']) and the match is derived from
+        the best distance
+        Returns: list of (best_match_index or None, distance)
+        """
+        if len(face_encodings) == 0:
+            return []
+        
+        gallery = self._get_gallery()
+        best_slots, best_distances = gallery.search(np.asarray(face_encodings))
+        matches = (best_slots >= 0) & (best_distances <= self.tolerance)
+        
+        return [
+            (self.known_face_ids.index(gallery.labels[slot]) if is_match else None, float(distance))
+            for slot, distance, is_match in zip(best_slots, best_distances, matches)
+        ]
+    
+    def match_top_k(self, face_encodings: List[np.ndarray], top_k: int) -> List[List[Tuple[int, float]]]:
+        """
+        The top_k nearest known identities for each probe encoding
+        Entries of the same user share one gallery label, so they are
+        already collapsed into one candidate
+        Returns: per probe, a list of (known_face index, distance) sorted by distance
+        """
+        if len(face_encodings) == 0:
+            return []
+        
+        gallery = self._get_gallery()
+        slots, distances = gallery.search_top_k(np.asarray(face_encodings), top_k)
+        
+        return [
+            [(self.known_face_ids.index(gallery.labels[slot]), float(distance))
+             for slot, distance in zip(row_slots, row_distances) if slot >= 0]
+            for row_slots, row_distances in zip(slots, distances)
+        ]
+    
+    def recognize_faces(self, frame, top_k: Optional[int] = None, stream=None) -> List[Dict]:
         """
         Recognize faces in a frame
+        top_k: also return the top_k nearest identities of every face under
+            'candidates', e.g. for operator review or margin rules
+        stream: camera id when frame is part of a live stream; only then may
+            the detector search around the previous frame's faces (ROI).
+            None (still images, benchmark_recognition) scans the whole frame
         Returns: List of dictionaries with recognition results
         """
         results = []
         
         try:
             
-            face_locations, face_encodings = self.face_detector.detect_and_encode(frame)
+            face_locations, face_encodings = self.face_detector.detect_and_encode(frame, full_scan=stream is None)
             
             if not face_locations:
                 return results
             
             
-            for face_encoding, face_location in zip(face_encodings, face_locations):
-                matches = face_recognition.compare_faces(
-                    self.known_face_encodings, 
-                    face_encoding, 
-                    tolerance=self.tolerance
-                )
-                
+            if top_k:
+                candidate_lists = self.match_top_k(face_encodings, top_k)
+                # The best candidate is the match; no separate nearest-neighbour search
+                matches = [
+                    (row[0][0] if row and row[0][1] <= self.tolerance else None,
+                     row[0][1] if row else float('inf'))
+                    for row in candidate_lists
+                ]
+            else:
+                candidate_lists = None
+                matches = self.match_encodings(face_encodings)
+            
+            for i, ((best_match_index, distance), face_location) in enumerate(zip(matches, face_locations)):
                 name = "Unknown"
                 user_id = None
                 student_id = "Unknown"
                 confidence = 0.0
                 
-              
-                if True in matches:
-                    face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-                    best_match_index = np.argmin(face_distances)
-                    
-                    if matches[best_match_index]:
-                        name = self.known_face_names[best_match_index]
-                        user_id = self.known_face_ids[best_match_index]
-                        student_id = self.known_face_student_ids[best_match_index]
-                        
-                       
-                        distance = face_distances[best_match_index]
-                        confidence = max(0.0, 1.0 - distance)
+                if best_match_index is not None:
+                    name = self.known_face_names[best_match_index]
+                    user_id = self.known_face_ids[best_match_index]
+                    student_id = self.known_face_student_ids[best_match_index]
+                    confidence = max(0.0, 1.0 - distance)
                 
                 result = {
                     'name': name,
@@ -374,6 +463,17 @@ class FaceRecognizer:
                     'confidence': confidence,
                     'location': face_location  
                 }
+                if candidate_lists is not None:
+                    result['candidates'] = [
+                        {
+                            'name': self.known_face_names[index],
+                            'user_id': self.known_face_ids[index],
+                            'student_id': self.known_face_student_ids[index],
+                            'distance': candidate_distance,
+                            'confidence': max(0.0, 1.0 - candidate_distance)
+                        }
+                        for index, candidate_distance in candidate_lists[i]
+                    ]
                 results.append(result)
             
             return results
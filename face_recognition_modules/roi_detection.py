@@ -0,0 +1,86 @@
+# face_recognition_modules/roi_detection.py
+
+"""
+ROI-restricted face detection
+Between full-frame scans faces seldom move far, so the detector only needs
+to search expanded regions around the previous boxes
+"""
+
+try:
+    from config import PERFORMANCE_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+
+from utils.helpers import expand_face_location, face_location_iou
+
+
+class ROIDetector:
+    """
+    Wraps a detection function scan(image) -> [(top, right, bottom, left)]
+    full_scan_interval: calls between two scheduled full-frame scans
+    margin: each previous box is grown by this fraction of its size per side
+    A full scan also runs when there is no previous box or when the regions
+    return fewer faces than the previous scan found
+    """
+
+    def __init__(self, full_scan_interval=None, margin=None, duplicate_iou=0.5):
+        self.full_scan_interval = max(1, full_scan_interval or PERFORMANCE_CONFIG.get('roi_full_scan_interval', 10))
+        self.margin = margin if margin is not None else PERFORMANCE_CONFIG.get('roi_margin', 0.5)
+        self.duplicate_iou = duplicate_iou
+        self.stats = {'full_scans': 0, 'roi_scans': 0}
+        self.reset()
+
+    def reset(self):
+        """Quên các khung trước, lần gọi tiếp theo quét toàn khung hình"""
+        self.previous_locations = []
+        self._since_full_scan = 0
+
+    def detect(self, image, scan, full_scan=False):
+        """
+        full_scan: scan the whole image without touching the stream state,
+            for an image that is not a frame of the stream (e.g. enrollment)
+        Returns: face locations in image coordinates
+        """
+        if full_scan:
+            return [tuple(int(v) for v in location) for location in scan(image)]
+
+        if (self.previous_locations
+                and self._since_full_scan < self.full_scan_interval):
+            locations = self._scan_regions(image, scan)
+            if len(locations) >= len(self.previous_locations):
+                self.previous_locations = locations
+                self._since_full_scan += 1
+                self.stats['roi_scans'] += 1
+                return locations
+
+        locations = [tuple(int(v) for v in location) for location in scan(image)]
+        self.previous_locations = locations
+        self._since_full_scan = 0
+        self.stats['full_scans'] += 1
+        return locations
+
+    def _scan_regions(self, image, scan):
+        height, width = image.shape[:2]
+        locations = []
+
+        for previous in self.previous_locations:
+            top, right, bottom, left = expand_face_location(previous, self.margin, width, height)
+            if bottom - top < 2 or right - left < 2:
+                continue
+
+            for (t, r, b, l) in scan(image[top:bottom, left:right]):
+                locations.append((int(t) + top, int(r) + left, int(b) + top, int(l) + left))
+
+        return self._drop_duplicates(locations)
+
+    def _drop_duplicates(self, locations):
+        """Overlapping regions can see the same face twice; keep the first"""
+        if len(locations) < 2:
+            return locations
+
+        iou = face_location_iou(locations, locations)
+        keep = []
+        for i in range(len(locations)):
+            if not any(iou[i, j] >= self.duplicate_iou for j in keep):
+                keep.append(i)
+        return [locations[i] for i in keep]
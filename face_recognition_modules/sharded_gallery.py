@@ -0,0 +1,484 @@
+# face_recognition_modules/sharded_gallery.py
+
+"""
+Sharded face gallery served by worker processes
+For galleries too large for one process to scan per frame, the exemplars
+are split by label across N worker processes. Every shard lives in
+multiprocessing.shared_memory, so workers read it without copying or
+pickling the matrix. A probe batch is fanned out to all workers, each one
+returns its top-k labels, and the parent merges them into a global top-k.
+
+The number of workers comes from PERFORMANCE_CONFIG['face_recognition_workers'].
+"""
+
+import threading
+import weakref
+import multiprocessing as mp
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+from .gallery import FaceGallery, normalize_rows, pairwise_distances, top_k_columns
+
+try:
+    from config import PERFORMANCE_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+
+
+def _attach_array(name: str, shape: Tuple[int, ...], dtype) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers the block; the tracker is shared with
+        # the parent (see ShardedGallery.__init__), so this is a no-op there
+        shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _group_rows(row_labels: np.ndarray) -> Tuple[Optional[np.ndarray], np.ndarray, np.ndarray]:
+    """
+    Live rows ordered by label id, as FaceGallery._get_grouping
+    Returns: (row order or None when already grouped, group starts, label id of each group)
+    """
+    live = np.flatnonzero(row_labels >= 0)
+    if live.size == 0:
+        return None, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(row_labels[live], kind='stable')
+    rows = live[order]
+    sorted_ids = row_labels[rows]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    in_order = rows.size == row_labels.size and bool(np.all(order[1:] > order[:-1]))
+    return (None if in_order else rows), starts, sorted_ids[starts]
+
+
+def _shard_worker(conn, metric: str, dim: int):
+    """
+    Worker loop: holds one shard attached from shared memory and answers searches
+    Messages: ('attach', block_names, capacity, size) | ('update', size) |
+              ('search', probes, top_k) | ('close',)
+    Only the first `size` rows are used; rows labelled -1 are tombstones
+    """
+    handles = []
+    matrix = row_labels = row_sq_norms = None
+    size = 0
+    grouping = None
+
+    def detach():
+        nonlocal matrix, row_labels, row_sq_norms
+        # Views must go before the buffers can be closed
+        matrix = row_labels = row_sq_norms = None
+        for shm in handles:
+            shm.close()
+        handles.clear()
+
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+
+            command = message[0]
+            if command == 'attach':
+                _, names, capacity, size = message
+                detach()
+                if names is not None:
+                    matrix_shm, matrix = _attach_array(names[0], (capacity, dim), np.float32)
+                    labels_shm, row_labels = _attach_array(names[1], (capacity,), np.int64)
+                    norms_shm, row_sq_norms = _attach_array(names[2], (capacity,), np.float32)
+                    handles.extend([matrix_shm, labels_shm, norms_shm])
+                grouping = None
+                conn.send(True)
+
+            elif command == 'update':
+                # The parent wrote rows in place; regroup lazily on the next search
+                size = message[1]
+                grouping = None
+
+            elif command == 'search':
+                _, probes, top_k = message
+                if matrix is not None and grouping is None:
+                    grouping = _group_rows(row_labels[:size])
+                if matrix is None or grouping[1].size == 0:
+                    empty = np.zeros((probes.shape[0], 0))
+                    conn.send((empty.astype(np.int64), empty.astype(np.float32)))
+                    continue
+
+                rows, starts, label_ids = grouping
+                distances = pairwise_distances(probes, matrix[:size], metric, row_sq_norms[:size])
+                if rows is not None:
+                    distances = distances[:, rows]
+                per_label = np.minimum.reduceat(distances, starts, axis=1)
+
+                k = min(top_k, per_label.shape[1])
+                nearest = np.argpartition(per_label, k - 1, axis=1)[:, :k]
+                conn.send((label_ids[nearest], np.take_along_axis(per_label, nearest, axis=1)))
+
+            elif command == 'close':
+                break
+    finally:
+        detach()
+        conn.close()
+
+
+class _Shard:
+    """
+    Parent-side handle of one shard: its worker and its shared memory
+    Rows live in preallocated blocks (matrix, row labels, squared norms)
+    that grow by doubling; new rows are written in place and removed rows
+    become tombstones (label -1) reused by later writes, like FaceGallery
+    """
+
+    def __init__(self, process, conn, dim: int, compact_ratio: float = 0.25):
+        self.process = process
+        self.conn = conn
+        self.dim = dim
+        self.compact_ratio = compact_ratio
+        self.blocks: List[shared_memory.SharedMemory] = []
+        self._clear()
+
+    def _clear(self):
+        self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+        self.row_labels = np.zeros(0, dtype=np.int64)
+        self.row_sq_norms = np.zeros(0, dtype=np.float32)
+        self.size = 0
+        self.free_rows: List[int] = []
+        self.label_rows: Dict[int, List[int]] = {}
+
+    @property
+    def capacity(self) -> int:
+        return self.row_labels.shape[0]
+
+    @property
+    def num_rows(self) -> int:
+        """Live rows, tombstones excluded"""
+        return self.size - len(self.free_rows)
+
+    def _publish(self, capacity: int):
+        """Move the rows in use into new shared memory blocks of the given capacity"""
+        old = self.blocks
+        self.blocks = []
+        matrix, row_labels, row_sq_norms = self.matrix, self.row_labels, self.row_sq_norms
+
+        if capacity:
+            self.blocks = [
+                shared_memory.SharedMemory(create=True, size=capacity * self.dim * 4),
+                shared_memory.SharedMemory(create=True, size=capacity * 8),
+                shared_memory.SharedMemory(create=True, size=capacity * 4),
+            ]
+            self.matrix = np.ndarray((capacity, self.dim), dtype=np.float32, buffer=self.blocks[0].buf)
+            self.row_labels = np.ndarray((capacity,), dtype=np.int64, buffer=self.blocks[1].buf)
+            self.row_sq_norms = np.ndarray((capacity,), dtype=np.float32, buffer=self.blocks[2].buf)
+            self.matrix[:self.size] = matrix[:self.size]
+            self.row_labels[:self.size] = row_labels[:self.size]
+            self.row_labels[self.size:] = -1
+            self.row_sq_norms[:self.size] = row_sq_norms[:self.size]
+            names = tuple(block.name for block in self.blocks)
+        else:
+            self._clear()
+            names = None
+        del matrix, row_labels, row_sq_norms
+
+        self.conn.send(('attach', names, capacity, self.size))
+        # Wait until the worker let go of the old blocks before unlinking them
+        self.conn.recv()
+        for shm in old:
+            shm.close()
+            shm.unlink()
+
+    def load(self, rows: np.ndarray, row_labels: np.ndarray):
+        """Replace the whole shard (build)"""
+        self.size = 0
+        self.free_rows = []
+        self.label_rows = {}
+        self._publish(row_labels.shape[0])
+        if row_labels.shape[0]:
+            self.write_rows(np.arange(row_labels.shape[0]), rows, row_labels)
+            self.sync()
+
+    def _allocate(self, count: int) -> np.ndarray:
+        """Row indices for new rows: tombstones first, then fresh rows"""
+        reused = [self.free_rows.pop() for _ in range(min(count, len(self.free_rows)))]
+        fresh = count - len(reused)
+
+        if fresh:
+            if self.size + fresh > self.capacity:
+                # Doubling keeps appends amortized O(1); only growth republishes
+                self._publish(max(self.size + fresh, 2 * self.capacity, 64))
+            reused.extend(range(self.size, self.size + fresh))
+            self.size += fresh
+
+        return np.asarray(reused, dtype=np.int64)
+
+    def write_rows(self, indices: np.ndarray, rows: np.ndarray, row_labels: np.ndarray):
+        self.size = max(self.size, int(indices.max()) + 1)
+        self.matrix[indices] = rows
+        self.row_labels[indices] = row_labels
+        self.row_sq_norms[indices] = np.einsum('ij,ij->i', rows, rows)
+        for label_id, index in zip(row_labels.tolist(), indices.tolist()):
+            self.label_rows.setdefault(label_id, []).append(index)
+
+    def add(self, label_id: int, rows: np.ndarray):
+        indices = self._allocate(rows.shape[0])
+        self.write_rows(indices, rows, np.full(rows.shape[0], label_id, dtype=np.int64))
+
+    def drop(self, label_id: int):
+        """Tombstone the rows of a label"""
+        indices = self.label_rows.pop(label_id, [])
+        self.row_labels[indices] = -1
+        self.free_rows.extend(indices)
+
+    def sync(self):
+        """Let the worker see in-place changes; repack first when tombstones pile up"""
+        if self.size >= 64 and len(self.free_rows) > self.compact_ratio * self.size:
+            self._compact()
+        self.conn.send(('update', self.size))
+
+    def _compact(self):
+        """Repack live rows to the front, grouped by label, in the same blocks"""
+        rows, _, _ = _group_rows(self.row_labels[:self.size])
+        if rows is None:
+            rows = np.flatnonzero(self.row_labels[:self.size] >= 0)
+        count = rows.shape[0]
+
+        # Fancy indexing copies, so overlapping source and target rows are safe
+        self.matrix[:count] = self.matrix[rows]
+        self.row_sq_norms[:count] = self.row_sq_norms[rows]
+        labels = self.row_labels[rows]
+        self.row_labels[:count] = labels
+        self.row_labels[count:self.size] = -1
+
+        self.size = count
+        self.free_rows = []
+        self.label_rows = {}
+        for index, label_id in enumerate(labels.tolist()):
+            self.label_rows.setdefault(label_id, []).append(index)
+
+    def release(self):
+        self._clear()
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+
+def _shutdown(shards: List[_Shard]):
+    for shard in shards:
+        try:
+            shard.conn.send(('close',))
+        except (BrokenPipeError, OSError):
+            pass
+        shard.process.join(timeout=5)
+        if shard.process.is_alive():
+            shard.process.terminate()
+        shard.conn.close()
+        shard.release()
+    shards.clear()
+
+
+class ShardedGallery:
+    """
+    Gallery split by label across worker processes
+
+    All exemplars of a label live in the same shard, so the per-label minimum
+    computed by a worker is exact and the merged top-k equals the top-k of
+    a single FaceGallery. New labels go to the shard with the fewest rows.
+    add / replace / remove only write the affected rows of the shard that
+    owns the label, in place in its shared memory; a shard is republished
+    only when it outgrows its capacity.
+
+    Call close() (or use it as a context manager) to stop the workers and
+    free the shared memory; it is also done on garbage collection.
+    """
+
+    def __init__(self, metric: str = 'euclidean', dim: int = 128, num_workers: Optional[int] = None):
+        if metric not in ('euclidean', 'cosine'):
+            raise ValueError(f"Unsupported gallery metric: {metric}")
+        if num_workers is None:
+            num_workers = PERFORMANCE_CONFIG.get('face_recognition_workers', 2)
+
+        self.metric = metric
+        self.dim = dim
+        self.num_workers = max(1, int(num_workers))
+
+        self.labels: List[Optional[Hashable]] = []  # label id -> label, None once removed
+        self._slots: Dict[Hashable, int] = {}       # label -> label id
+        self._label_shard: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+        # Start the tracker before the workers so they share it with the parent
+        # instead of each one unlinking the parent's blocks on exit
+        resource_tracker.ensure_running()
+        # Spawned, not forked, as in ProcessRecognitionPool: the parent may
+        # already run MediaPipe graph or camera threads
+        context = mp.get_context('spawn')
+        self._shards: List[_Shard] = []
+        for _ in range(self.num_workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_shard_worker, args=(child_conn, metric, dim), daemon=True)
+            process.start()
+            child_conn.close()
+            self._shards.append(_Shard(process, parent_conn, dim))
+
+        self._finalizer = weakref.finalize(self, _shutdown, self._shards)
+
+    @classmethod
+    def from_gallery(cls, gallery: FaceGallery, num_workers: Optional[int] = None) -> 'ShardedGallery':
+        """Sharded copy of an in-process gallery (e.g. FaceEncoder.get_gallery())"""
+        sharded = cls(metric=gallery.metric, dim=gallery.dim, num_workers=num_workers)
+        sharded.build(gallery._label_blocks())
+        return sharded
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, label: Hashable) -> bool:
+        return label in self._slots
+
+    def __enter__(self) -> 'ShardedGallery':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def num_rows(self) -> int:
+        return sum(shard.num_rows for shard in self._shards)
+
+    def close(self):
+        """Stop the workers and unlink the shared memory"""
+        with self._lock:
+            self._finalizer()
+
+    def _prepare_rows(self, encodings: Sequence[np.ndarray]) -> np.ndarray:
+        rows = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if self.metric == 'cosine':
+            rows = normalize_rows(rows)
+        return rows
+
+    def build(self, encodings_by_label: Dict[Hashable, Sequence[np.ndarray]]):
+        """
+        Split a mapping label -> list of encodings across the shards
+        """
+        with self._lock:
+            self.labels = []
+            self._slots = {}
+            self._label_shard = {}
+
+            loads = np.zeros(self.num_workers, dtype=np.int64)
+            blocks = [[] for _ in range(self.num_workers)]
+            ids = [[] for _ in range(self.num_workers)]
+
+            for label, encodings in encodings_by_label.items():
+                if encodings is None or len(encodings) == 0:
+                    continue
+                rows = self._prepare_rows(encodings)
+                shard_index = int(np.argmin(loads))
+                loads[shard_index] += rows.shape[0]
+
+                label_id = len(self.labels)
+                self.labels.append(label)
+                self._slots[label] = label_id
+                self._label_shard[label] = shard_index
+                blocks[shard_index].append(rows)
+                ids[shard_index].append(np.full(rows.shape[0], label_id, dtype=np.int64))
+
+            for shard, shard_blocks, shard_ids in zip(self._shards, blocks, ids):
+                if shard_blocks:
+                    shard.load(np.vstack(shard_blocks), np.concatenate(shard_ids))
+                else:
+                    shard.load(np.zeros((0, self.dim), dtype=np.float32), np.zeros(0, dtype=np.int64))
+
+    def add(self, label: Hashable, encodings: Sequence[np.ndarray]):
+        """Add exemplars for a new or existing label; amortized O(len(encodings))"""
+        rows = self._prepare_rows(encodings)
+        if rows.shape[0] == 0:
+            return
+
+        with self._lock:
+            if label not in self._slots:
+                self._slots[label] = len(self.labels)
+                self.labels.append(label)
+                self._label_shard[label] = int(np.argmin([shard.num_rows for shard in self._shards]))
+
+            shard = self._shards[self._label_shard[label]]
+            shard.add(self._slots[label], rows)
+            shard.sync()
+
+    def replace(self, label: Hashable, encodings: Sequence[np.ndarray]):
+        """Swap all exemplars of a label for new ones"""
+        if label not in self._slots:
+            self.add(label, encodings)
+            return
+
+        rows = self._prepare_rows(encodings)
+        with self._lock:
+            label_id = self._slots[label]
+            shard = self._shards[self._label_shard[label]]
+            shard.drop(label_id)
+            if rows.shape[0]:
+                shard.add(label_id, rows)
+            shard.sync()
+
+    def remove(self, label: Hashable) -> bool:
+        """Remove a label; returns False when it is not in the gallery"""
+        with self._lock:
+            label_id = self._slots.pop(label, None)
+            if label_id is None:
+                return False
+
+            self.labels[label_id] = None
+            shard = self._shards[self._label_shard.pop(label)]
+            shard.drop(label_id)
+            shard.sync()
+            return True
+
+    def search(self, probes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Nearest label for every probe, as FaceGallery.search
+        Returns: (label_indices, distances), each of shape (P,);
+        label index -1 and distance inf when the gallery is empty
+        """
+        best, best_distances = self.search_top_k(probes, 1)
+        return best[:, 0], best_distances[:, 0]
+
+    def search_top_k(self, probes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k nearest labels for every probe, merged across all shards
+        Returns: (label_indices, distances), each of shape (P, k) sorted by
+        distance; missing entries are label index -1 and distance inf
+        """
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        top_k = max(1, int(k))
+
+        with self._lock:
+            for shard in self._shards:
+                shard.conn.send(('search', probes, top_k))
+            results = [shard.conn.recv() for shard in self._shards]
+
+        label_ids = np.concatenate([result[0] for result in results], axis=1)
+        distances = np.concatenate([result[1] for result in results], axis=1).astype(np.float32)
+
+        columns, best_distances = top_k_columns(distances, top_k)
+        if label_ids.shape[1] == 0:
+            return columns, best_distances
+        best = np.where(columns >= 0, np.take_along_axis(label_ids, np.maximum(columns, 0), axis=1), -1)
+        return best, best_distances
+
+    def match(self, probes: np.ndarray, tolerance: float) -> List[Tuple[Optional[Hashable], float]]:
+        """
+        Best label for every probe
+        Returns: list of (label or None, distance) - None when no label is within tolerance
+        """
+        best, best_distances = self.search(probes)
+
+        results = []
+        for label_index, distance in zip(best, best_distances):
+            distance = float(distance)
+            if label_index >= 0 and distance < tolerance:
+                results.append((self.labels[label_index], distance))
+            else:
+                results.append((None, distance))
+        return results
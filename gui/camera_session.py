@@ -0,0 +1,144 @@
+# gui/camera_session.py
+
+"""
+Camera session
+Trạng thái của một camera đang chạy: reader, worker nhận dạng, ô preview và
+thống kê FPS / độ trễ riêng. Nhiều phiên chạy song song, dùng chung một
+gallery (SafeFaceRecognizer), một process pool nhận dạng và một nơi ghi
+điểm danh (cửa sổ chính)
+"""
+
+import time
+
+try:
+    from face_recognition_modules.mediapipe_recognizer import mediapipe_pool
+except ImportError:
+    mediapipe_pool = None
+
+from face_recognition_modules.pipeline import RecognitionPipeline
+from gui.recognition_worker import RecognitionWorker, PoolRecognitionWorker
+from utils.camera import acquire_camera_reader
+
+try:
+    from config import CAMERA_CONFIG
+except ImportError:
+    CAMERA_CONFIG = {}
+
+
+class CameraSession:
+    """
+    One camera pipeline: capture -> detect -> match, plus its preview tile
+    camera_id: camera index or video source; also the MediaPipe stream id,
+        so every camera keeps its own tracking state
+    label: QLabel tile the window renders this camera into
+    recognizer: SafeFaceRecognizer shared by all sessions (one gallery)
+    pool: ProcessRecognitionPool shared by all sessions, used with the
+        'process' backend; owned by the window, the session only submits
+        frames under its camera_id
+    Each session has its own worker thread
+    """
+
+    def __init__(self, camera_id, label, recognizer=None, pool=None):
+        self.camera_id = camera_id
+        self.label = label
+        self.recognizer = recognizer
+        self.reader = None
+        self.pipeline = None
+        self.pool = pool
+        self.worker = None
+
+        self.latest_results = []
+        self.last_frame_id = 0
+        self.last_capture_time = None
+        self._last_frame_time = None
+        self.fps = 0.0
+        self.processing_ms = 0.0
+        self.marks = 0  # attendance records credited to this camera
+
+    @property
+    def name(self) -> str:
+        return f"Camera {self.camera_id}"
+
+    def start(self, parent=None, on_results=None, on_error=None) -> bool:
+        """Mở camera và worker nhận dạng; False nếu không mở được camera"""
+        # Frames are grabbed on the reader's thread, so a slow recognition
+        # pass skips to the newest frame instead of queueing old ones
+        self.reader = acquire_camera_reader(
+            self.camera_id,
+            width=CAMERA_CONFIG.get('frame_width', 640),
+            height=CAMERA_CONFIG.get('frame_height', 480),
+            fps=CAMERA_CONFIG.get('fps', 30),
+        )
+        if self.reader is None:
+            return False
+
+        if self.recognizer and self.pool is not None:
+            # Detection / encoding on the shared worker processes, matching on the worker thread
+            self.worker = PoolRecognitionWorker(
+                self.reader, self.pool, self.recognizer.recognize_encodings, parent, self.camera_id
+            )
+        elif self.recognizer:
+            self.pipeline = RecognitionPipeline(self.recognizer, stream=self.camera_id)
+            self.worker = RecognitionWorker(self.reader, self.pipeline.process, parent, self.camera_id)
+
+        if self.worker is not None:
+            if on_results is not None:
+                self.worker.results_ready.connect(on_results)
+            if on_error is not None:
+                self.worker.error.connect(on_error)
+            self.worker.start()
+        return True
+
+    def stop(self):
+        """Dừng worker, pool và trả camera"""
+        # The worker reads from the camera, stop it before releasing the reader
+        if self.worker is not None:
+            if not self.worker.stop():
+                print(f"❌ Recognition worker of {self.name} did not stop in time")
+            self.worker = None
+        if self.pool is not None:
+            self.pool.release_stream(self.camera_id)
+        self.latest_results = []
+
+        if self.reader is not None:
+            self.reader.release()
+            self.reader = None
+
+        # Tracking state of the stopped stream is stale now
+        if mediapipe_pool is not None:
+            mediapipe_pool.release_stream(self.camera_id)
+        self.pipeline = None
+
+    def read(self):
+        """Frame mới nhất chưa hiển thị, hoặc None"""
+        if self.reader is None:
+            return None
+
+        frame, captured_at, frame_id = self.reader.read(self.last_frame_id)
+        if frame is None:
+            return None
+        self.last_frame_id = frame_id
+        self.last_capture_time = captured_at
+
+        now = time.perf_counter()
+        if self._last_frame_time is not None:
+            interval = now - self._last_frame_time
+            if interval > 0:
+                self.fps = 0.9 * self.fps + 0.1 / interval if self.fps else 1.0 / interval
+        self._last_frame_time = now
+        return frame
+
+    def update_results(self, results, info):
+        """Kết quả mới của worker (chạy trên UI thread)"""
+        self.latest_results = results
+        self.processing_ms = 0.9 * self.processing_ms + 0.1 * info.get('processing_ms', 0.0)
+
+    @property
+    def lag_ms(self):
+        if self.last_capture_time is None:
+            return None
+        return (time.time() - self.last_capture_time) * 1000
+
+    def summary(self) -> str:
+        """Short stats for the status bar"""
+        return f"Cam {self.camera_id}: {self.fps:.0f} fps / {self.processing_ms:.0f} ms"
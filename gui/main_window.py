@@ -10,6 +10,8 @@ import numpy as np
 from datetime import datetime, date
 import json
 import sqlite3
+import threading
+import time
 import traceback
 
 
@@ -24,10 +26,11 @@ except ImportError:
 
 try:
 
-    from face_recognition_modules.mediapipe_recognizer import MediaPipeFaceRecognition
+    from face_recognition_modules.mediapipe_recognizer import MediaPipeFaceRecognition, mediapipe_pool
     FACE_RECOGNIZER_TYPE = "MediaPipe"
     print("Successfully ! Using MediaPipe-based face recognition")
 except ImportError:
+    mediapipe_pool = None
     try:
 
         from face_recognition_modules.recognizer import FaceRecognizer
@@ -39,6 +42,20 @@ except ImportError:
         FACE_RECOGNIZER_TYPE = None
         print("❌ No face recognition modules found")
 
+from face_recognition_modules.gallery import FaceGallery, create_gallery
+from face_recognition_modules.sharded_gallery import ShardedGallery
+from utils.camera import acquire_camera_reader
+from gui.camera_session import CameraSession
+from face_recognition_modules.process_pool import ProcessRecognitionPool
+
+try:
+    from config import PERFORMANCE_CONFIG, UI_CONFIG, DEBUG_CONFIG, CAMERA_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+    CAMERA_CONFIG = {}
+    UI_CONFIG = {}
+    DEBUG_CONFIG = {}
+
 try:
     from utils.logger import app_logger, log_user_action, log_system_event
 except ImportError:
@@ -141,9 +158,11 @@ def ensure_valid_image_format(image):
     print(f"Successfully ! Image format validated: shape={image.shape}, dtype={image.dtype}")
     return image
 
-def safe_face_locations(image):
+def safe_face_locations(image, stream=None, scale=1.0):
     """
     Safely detect face locations with proper image format handling
+    stream: camera id for live frames (MediaPipe video mode), None for still images
+    scale: detect on a copy resized by this factor; boxes stay in image coordinates
     """
     try:
         
@@ -151,8 +170,13 @@ def safe_face_locations(image):
         
         if FACE_RECOGNIZER_TYPE == "MediaPipe":
             
-            mp_recognizer = MediaPipeFaceRecognition()
-            locations = mp_recognizer.face_locations(processed_image)
+            mp_recognizer = mediapipe_pool.get(stream)
+            locations = mp_recognizer.face_locations(processed_image, scale=scale)
+        elif scale < 1.0:
+            import face_recognition
+            small_image = cv2.resize(processed_image, (0, 0), fx=scale, fy=scale)
+            locations = [tuple(int(v / scale) for v in location)
+                         for location in face_recognition.face_locations(small_image)]
         else:
             import face_recognition
             locations = face_recognition.face_locations(processed_image)
@@ -163,9 +187,10 @@ def safe_face_locations(image):
         print(f"❌ Face detection error: {e}")
         return []
 
-def safe_face_encodings(image, face_locations=None):
+def safe_face_encodings(image, face_locations=None, stream=None):
     """
     Safely generate face encodings with proper image format handling
+    stream: camera id for live frames (MediaPipe video mode), None for still images
     """
     try:
      
@@ -174,7 +199,7 @@ def safe_face_encodings(image, face_locations=None):
 
         if FACE_RECOGNIZER_TYPE == "MediaPipe":
    
-            mp_recognizer = MediaPipeFaceRecognition()
+            mp_recognizer = mediapipe_pool.get(stream)
             encodings = mp_recognizer.face_encodings(processed_image, face_locations)
         else:
             
@@ -187,6 +212,32 @@ def safe_face_encodings(image, face_locations=None):
         print(f"❌ Face encoding error: {e}")
         return []
 
+def safe_face_locations_and_encodings(image, stream=None):
+    """
+    Safely detect and encode faces in one pass
+    With MediaPipe a single FaceMesh run yields both, each box built from
+    its own landmarks; face_recognition detects then encodes those boxes
+    Returns: (locations, encodings), aligned
+    """
+    try:
+        
+        processed_image = ensure_valid_image_format(image)
+        
+        if FACE_RECOGNIZER_TYPE == "MediaPipe":
+            
+            mp_recognizer = mediapipe_pool.get(stream)
+            return mp_recognizer.face_locations_and_encodings(processed_image)
+        
+        import face_recognition
+        locations = face_recognition.face_locations(processed_image)
+        if not locations:
+            return [], []
+        return locations, face_recognition.face_encodings(processed_image, locations)
+        
+    except Exception as e:
+        print(f"❌ Face detection/encoding error: {e}")
+        return [], []
+
 
 class SafeFaceRecognizer:
     """
@@ -196,13 +247,23 @@ class SafeFaceRecognizer:
         self.recognizer_type = FACE_RECOGNIZER_TYPE
         self.tolerance = 0.6
         self.known_faces = {}
+        self.gallery = create_gallery(metric='cosine' if self.recognizer_type == "MediaPipe" else 'euclidean')
+        self.active_class_id = None
+        self._class_galleries = {}
+        # Matching runs on the recognition worker thread, user edits on the UI thread
+        self._lock = threading.RLock()
         
         if self.recognizer_type == "MediaPipe":
-            self.mp_recognizer = MediaPipeFaceRecognition()
+            mediapipe_pool.get()
             print("Successfully ! MediaPipe face recognizer initialized")
         else:
             print("Warning  Using fallback face recognition")
     
+    @property
+    def mp_recognizer(self):
+        """MediaPipe instance of the calling thread, borrowed from the shared pool"""
+        return mediapipe_pool.get()
+    
     def load_known_faces(self):
         """Load known faces from user data"""
         try:
@@ -213,89 +274,219 @@ class SafeFaceRecognizer:
             with open(users_file, 'r', encoding='utf-8') as f:
                 users = json.load(f)
             
+            # Encode without the lock, publish known faces and gallery together
+            loaded = {}
             for user in users:
-                user_id = user['id']
-                user_name = user['name']
-                student_id = user.get('student_id', '')
-                
-
-                user_images_dir = f"data/images/user_{user_id}"
-                if os.path.exists(user_images_dir):
-                    encodings = []
-                    for img_file in os.listdir(user_images_dir):
-                        if img_file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                            img_path = os.path.join(user_images_dir, img_file)
-                            try:
-                             
-                                if self.recognizer_type == "MediaPipe":
-                                    image = self.mp_recognizer.load_image_file(img_path)
-                                else:
-                                    image = cv2.imread(img_path)
-                                    image = ensure_valid_image_format(image)
-                                
-                              
-                                face_encodings = safe_face_encodings(image)
-                                if face_encodings:
-                                    encodings.extend(face_encodings)
-                                    
-                            except Exception as e:
-                                print(f"❌ Error loading image {img_path}: {e}")
-                                continue
-                    
-                    if encodings:
-                        self.known_faces[user_id] = {
-                            'name': user_name,
-                            'student_id': student_id,
-                            'encodings': encodings
-                        }
-                        print(f"Successfully ! Loaded {len(encodings)} encodings for {user_name}")
+                entry = self._encode_user(user)
+                if entry is not None:
+                    loaded[user['id']] = entry
             
+            with self._lock:
+                self.known_faces.update(loaded)
+                self._rebuild_gallery()
             print(f"Successfully ! Loaded faces for {len(self.known_faces)} users")
             
         except Exception as e:
             print(f"❌ Error loading known faces: {e}")
     
-    def recognize_faces(self, frame):
+    def _encode_user(self, user):
         """
-        Recognize faces in frame with enhanced error handling
+        Encode one user's images; touches no shared state, so it can run
+        while the recognition worker matches
+        Returns: known_faces entry, or None when no face could be encoded
+        """
+        user_id = user['id']
+        user_name = user['name']
+        student_id = user.get('student_id', '')
+        
+        user_images_dir = f"data/images/user_{user_id}"
+        if not os.path.exists(user_images_dir):
+            return None
+        
+        encodings = []
+        for img_file in os.listdir(user_images_dir):
+            if img_file.lower().endswith(('.jpg', '.jpeg', '.png')):
+                img_path = os.path.join(user_images_dir, img_file)
+                try:
+                    # safe_face_encodings takes BGR like a camera frame, so
+                    # enrollment and live frames reach the model as the same RGB
+                    if self.recognizer_type == "MediaPipe":
+                        image = cv2.cvtColor(self.mp_recognizer.load_image_file(img_path), cv2.COLOR_RGB2BGR)
+                    else:
+                        image = cv2.imread(img_path)
+                    
+                    face_encodings = safe_face_encodings(image)
+                    if face_encodings:
+                        encodings.extend(face_encodings)
+                        
+                except Exception as e:
+                    print(f"❌ Error loading image {img_path}: {e}")
+                    continue
+        
+        if not encodings:
+            return None
+        
+        print(f"Successfully ! Loaded {len(encodings)} encodings for {user_name}")
+        return {
+            'name': user_name,
+            'student_id': student_id,
+            'encodings': encodings
+        }
+    
+    def add_user(self, user) -> bool:
+        """
+        Add or refresh a single user without reloading everyone
+        Only this user's images are encoded; the gallery is updated in place
         """
-        results = []
-        
         try:
-          
-            if frame is None:
-                return results
-            
-          
-            processed_frame = ensure_valid_image_format(frame)
-          
-            face_locations = safe_face_locations(processed_frame)
-            
-            if not face_locations:
-                return results
+            entry = self._encode_user(user)
+            if entry is None:
+                return False
+            
+            # known_faces is read while matching: update it and the gallery together
+            user_id = user['id']
+            with self._lock:
+                self.known_faces[user_id] = entry
+                self.gallery.replace(user_id, entry['encodings'])
+                self._class_galleries.clear()
+            return True
             
+        except Exception as e:
+            print(f"❌ Error adding user {user.get('id')}: {e}")
+            return False
+    
+    def remove_user(self, user_id) -> bool:
+        """Drop a user from known faces and the gallery"""
+        with self._lock:
+            if self.known_faces.pop(user_id, None) is None:
+                return False
+            
+            self.gallery.remove(user_id)
+            self._class_galleries.clear()
+            return True
+    
+    def close(self):
+        """Stop the gallery worker processes (gallery_index 'sharded')"""
+        if isinstance(self.gallery, ShardedGallery):
+            self.gallery.close()
+    
+    def _rebuild_gallery(self):
+        """Pack all known encodings into the contiguous gallery matrix"""
+        with self._lock:
+            self.gallery.build({
+                user_id: user_data['encodings']
+                for user_id, user_data in self.known_faces.items()
+            })
+            self._class_galleries.clear()
+    
+    def set_active_class(self, class_id):
+        """
+        Restrict matching to the students enrolled in a class
+        Faces are matched against the class sub-gallery first and only fall
+        back to the full gallery on a miss. Pass None to search everyone.
+        """
+        self.active_class_id = class_id
+    
+    def _get_class_gallery(self, class_id):
+        """
+        Cached sub-gallery of the students enrolled in a class
+        Rebuilt when the class enrollments or the full gallery change
+        """
+        if class_id is None or not db_manager:
+            return None
+        
+        version = db_manager.get_enrollment_version(class_id)
+        cached = self._class_galleries.get(class_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        
+        enrolled = {student.get('student_id') for student in db_manager.get_students_in_class(class_id)}
+        class_user_ids = [
+            user_id for user_id, user_data in self.known_faces.items()
+            if user_data['student_id'] in enrolled
+        ]
+        if not class_user_ids:
+            class_gallery = None
+        elif isinstance(self.gallery, ShardedGallery):
+            # The shards hold their rows in the worker processes; a class is
+            # small enough to scan in-process
+            class_gallery = FaceGallery(metric=self.gallery.metric)
+            class_gallery.build({user_id: self.known_faces[user_id]['encodings'] for user_id in class_user_ids})
+        else:
+            class_gallery = self.gallery.subset(class_user_ids)
+        
+        self._class_galleries[class_id] = (version, class_gallery)
+        return class_gallery
+    
+    def _match_encodings(self, face_encodings):
+        """
+        Match probe encodings, class sub-gallery first when a class is active
+        Returns: list of (user_id or None, distance)
+        """
+        probes = np.asarray(face_encodings)
+        class_gallery = self._get_class_gallery(self.active_class_id)
+        
+        if class_gallery is None or len(class_gallery) == 0:
+            return self.gallery.match(probes, self.tolerance)
+        
+        matches = class_gallery.match(probes, self.tolerance)
+        misses = [i for i, (user_id, _) in enumerate(matches) if user_id is None]
+        
+        if misses:
+            for i, fallback in zip(misses, self.gallery.match(probes[misses], self.tolerance)):
+                matches[i] = fallback
+        
+        return matches
+    
+    def _match_candidates(self, face_encodings, top_k):
+        """
+        The top_k nearest users of every probe, class sub-gallery first
+        Probes whose best class candidate is out of tolerance are searched
+        again in the full gallery, as in _match_encodings
+        Returns: per probe, a list of (user_id, distance) sorted by distance
+        """
+        probes = np.asarray(face_encodings)
+        class_gallery = self._get_class_gallery(self.active_class_id)
+        
+        def candidates(gallery, batch):
+            user_indices, distances = gallery.search_top_k(batch, top_k)
+            return [
+                [(gallery.labels[index], float(distance))
+                 for index, distance in zip(row_indices, row_distances) if index >= 0]
+                for row_indices, row_distances in zip(user_indices, distances)
+            ]
+        
+        if class_gallery is None or len(class_gallery) == 0:
+            return candidates(self.gallery, probes)
+        
+        results = candidates(class_gallery, probes)
+        misses = [i for i, row in enumerate(results) if not row or row[0][1] >= self.tolerance]
+        
+        if misses:
+            for i, fallback in zip(misses, candidates(self.gallery, probes[misses])):
+                results[i] = fallback
+        
+        return results
+    
+    def _build_results(self, face_locations, face_encodings, top_k=None):
+        """Match encodings and build one result dict per face location"""
+        results = []
+        
+        with self._lock:
+            if top_k:
+                candidate_lists = self._match_candidates(face_encodings, top_k)
+                matches = [
+                    (row[0][0] if row and row[0][1] < self.tolerance else None,
+                     row[0][1] if row else float('inf'))
+                    for row in candidate_lists
+                ]
+            else:
+                candidate_lists = None
+                matches = self._match_encodings(face_encodings)
             
-            face_encodings = safe_face_encodings(processed_frame, face_locations)
-            
-          
-            for i, (face_encoding, location) in enumerate(zip(face_encodings, face_locations)):
-                best_match = None
-                best_distance = float('inf')
-                
-                for user_id, user_data in self.known_faces.items():
-                    for known_encoding in user_data['encodings']:
-                        
-                        if self.recognizer_type == "MediaPipe":
-                            distance = 1 - np.dot(known_encoding, face_encoding)
-                        else:
-                            import face_recognition
-                            distance = face_recognition.face_distance([known_encoding], face_encoding)[0]
-                        
-                        if distance < best_distance:
-                            best_distance = distance
-                            best_match = user_data
-                
-                if best_match and best_distance < self.tolerance:
+            for i, ((user_id, best_distance), location) in enumerate(zip(matches, face_locations)):
+                if user_id is not None:
+                    best_match = self.known_faces[user_id]
                     results.append({
                         'user_id': user_id,
                         'name': best_match['name'],
@@ -311,6 +502,98 @@ class SafeFaceRecognizer:
                         'confidence': 0.0,
                         'location': location
                     })
+                
+                if candidate_lists is not None:
+                    results[-1]['candidates'] = [
+                        {
+                            'user_id': candidate_id,
+                            'name': self.known_faces[candidate_id]['name'],
+                            'student_id': self.known_faces[candidate_id]['student_id'],
+                            'distance': distance,
+                            'confidence': max(0.0, 1.0 - distance)
+                        }
+                        for candidate_id, distance in candidate_lists[i]
+                    ]
+        
+        return results
+    
+    def recognize_encodings(self, face_locations, face_encodings, top_k=None):
+        """
+        Identify faces detected and encoded elsewhere (e.g. the process pool)
+        Returns: one result dict per location, in the same order
+        """
+        try:
+            if not face_locations or len(face_encodings) != len(face_locations):
+                return []
+            return self._build_results(face_locations, face_encodings, top_k)
+            
+        except Exception as e:
+            print(f"❌ Face recognition error: {e}")
+            return []
+    
+    def detect_faces(self, frame, stream=None, scale=1.0):
+        """
+        Face locations only, without encoding (used by the tracking pipeline)
+        scale: detection scale, boxes are returned in frame coordinates
+        """
+        try:
+            if frame is None:
+                return []
+            
+            # safe_face_locations converts the BGR frame to RGB, exactly once
+            return safe_face_locations(frame, stream, scale)
+            
+        except Exception as e:
+            print(f"❌ Face detection error: {e}")
+            return []
+    
+    def recognize_locations(self, frame, face_locations, top_k=None, stream=None):
+        """
+        Encode and identify faces at known locations (e.g. tracked boxes)
+        Returns: one result dict per location, in the same order
+        """
+        try:
+            if frame is None or not face_locations:
+                return []
+            
+            face_encodings = safe_face_encodings(frame, face_locations, stream)
+            
+            if len(face_encodings) != len(face_locations):
+                return []
+            
+            return self._build_results(face_locations, face_encodings, top_k)
+            
+        except Exception as e:
+            print(f"❌ Face recognition error: {e}")
+            return []
+    
+    def recognize_faces(self, frame, top_k=None, stream=None):
+        """
+        Recognize faces in frame with enhanced error handling
+        top_k: also return the top_k nearest users of every face under
+            'candidates' (user_id, name, student_id, distance, confidence)
+        stream: camera id when frame comes from a live stream, so MediaPipe
+            can track landmarks between frames
+        """
+        results = []
+        
+        try:
+          
+            if frame is None:
+                return results
+            
+          
+            # Camera frames are BGR; the safe_* helpers convert them to RGB once
+            face_locations, face_encodings = safe_face_locations_and_encodings(frame, stream)
+            
+            if not face_locations:
+                return results
+            
+          
+            if not face_encodings:
+                return results
+            
+            results = self._build_results(face_locations, face_encodings, top_k)
             
             return results
             
@@ -332,6 +615,7 @@ class UserManagementDialog(QDialog):
         self.setWindowTitle("Quản lý người dùng")
         self.setModal(True)
         self.resize(800, 600)
+        self.added_users = []
         
         self.init_ui()
         self.load_users()
@@ -401,6 +685,8 @@ class UserManagementDialog(QDialog):
         """Open add user dialog"""
         dialog = AddUserDialog(self)
         if dialog.exec_() == QDialog.Accepted:
+            if dialog.new_user:
+                self.added_users.append(dialog.new_user)
             self.load_users()
 
 class AddUserDialog(QDialog):
@@ -412,10 +698,11 @@ class AddUserDialog(QDialog):
         self.setModal(True)
         self.resize(900, 700)
         
-        self.camera_capture = None
+        self.camera_reader = None
         self.camera_running = False
         self.camera_timer = QTimer()
         self.captured_images = []
+        self.new_user = None
         
         self.init_ui()
         self.camera_timer.timeout.connect(self.update_camera_preview)
@@ -510,8 +797,9 @@ class AddUserDialog(QDialog):
                 QMessageBox.warning(self, "Cảnh báo", "Không tìm thấy camera!")
                 return
             
-            self.camera_capture = cv2.VideoCapture(available_cameras[0])
-            if not self.camera_capture.isOpened():
+            # Shares the reader of the main window when it uses the same camera
+            self.camera_reader = acquire_camera_reader(available_cameras[0])
+            if self.camera_reader is None:
                 QMessageBox.critical(self, "Lỗi", "Không thể mở camera!")
                 return
             
@@ -531,9 +819,9 @@ class AddUserDialog(QDialog):
         self.camera_running = False
         self.camera_timer.stop()
         
-        if self.camera_capture:
-            self.camera_capture.release()
-            self.camera_capture = None
+        if self.camera_reader:
+            self.camera_reader.release()
+            self.camera_reader = None
         
         self.camera_label.setText("Camera đã tắt")
         
@@ -543,12 +831,12 @@ class AddUserDialog(QDialog):
     
     def update_camera_preview(self):
         """Update camera preview"""
-        if not self.camera_running or not self.camera_capture:
+        if not self.camera_running or not self.camera_reader:
             return
         
         try:
-            ret, frame = self.camera_capture.read()
-            if ret:
+            frame, _, _ = self.camera_reader.read()
+            if frame is not None:
                 
                 rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                 h, w, ch = rgb_image.shape
@@ -565,11 +853,11 @@ class AddUserDialog(QDialog):
     
     def capture_face(self):
         """FIXED: Chụp ảnh khuôn mặt với xử lý định dạng hình ảnh"""
-        if not self.camera_running or not self.camera_capture:
+        if not self.camera_running or not self.camera_reader:
             return
         
-        ret, frame = self.camera_capture.read()
-        if ret:
+        frame, _, _ = self.camera_reader.read()
+        if frame is not None:
             try:
                
                 processed_frame = ensure_valid_image_format(frame)
@@ -646,6 +934,7 @@ class AddUserDialog(QDialog):
             }
             
             users.append(new_user)
+            self.new_user = new_user
             
            
             with open(users_file, 'w', encoding='utf-8') as f:
@@ -665,15 +954,22 @@ class AddUserDialog(QDialog):
 
 
 class AttendanceMainWindow(QMainWindow):
+    # Classes fetched off the UI thread by load_classes
+    classes_loaded = pyqtSignal(list)
+    
     def __init__(self):
         super().__init__()
         
      
         self.current_user = None
         self.current_class = None
-        self.camera_running = False
         self.camera_timer = QTimer()
-        self.camera_capture = None
+        # camera_id -> CameraSession; all share face_recognizer and the attendance table
+        self.camera_sessions = {}
+        # student_id -> camera that marked them, suppresses duplicates across cameras
+        self.attendance_marks = {}
+        # Detection / encoding processes shared by every camera ('process' backend)
+        self.recognition_pool = None
         
         
         try:
@@ -725,16 +1021,19 @@ class AttendanceMainWindow(QMainWindow):
         camera_group = QGroupBox("Camera")
         camera_layout = QVBoxLayout()
         
-        # Camera display
+        # Camera display: one tile per running camera, placeholder when none
         self.camera_label = QLabel("Camera chưa được bật")
         self.camera_label.setMinimumSize(640, 480)
         self.camera_label.setStyleSheet("border: 2px solid #ccc; background-color: #f0f0f0;")
         self.camera_label.setAlignment(Qt.AlignCenter)
-        camera_layout.addWidget(self.camera_label)
+        self.camera_grid = QGridLayout()
+        self.camera_grid.addWidget(self.camera_label, 0, 0)
+        camera_layout.addLayout(self.camera_grid)
         
         # Camera controls
         camera_controls = QHBoxLayout()
         self.start_camera_btn = QPushButton("Bật Camera")
+        self.start_all_cameras_btn = QPushButton("Bật tất cả")
         self.stop_camera_btn = QPushButton("Tắt Camera")
         self.camera_combo = QComboBox()
         
@@ -742,6 +1041,7 @@ class AttendanceMainWindow(QMainWindow):
         camera_controls.addWidget(self.camera_combo)
         camera_controls.addStretch()
         camera_controls.addWidget(self.start_camera_btn)
+        camera_controls.addWidget(self.start_all_cameras_btn)
         camera_controls.addWidget(self.stop_camera_btn)
         
         camera_layout.addLayout(camera_controls)
@@ -780,7 +1080,8 @@ class AttendanceMainWindow(QMainWindow):
         class_layout = QFormLayout()
         
         self.class_combo = QComboBox()
-        self.class_combo.addItems(["Lớp AI", "Lớp CSDL", "Lớp Toán Rời Rạc"])
+        self.classes_loaded.connect(self._populate_classes)
+        self.load_classes()
         
         self.date_edit = QDateEdit()
         self.date_edit.setDate(QDate.currentDate())
@@ -844,11 +1145,14 @@ class AttendanceMainWindow(QMainWindow):
         
         # Connect signals
         self.start_camera_btn.clicked.connect(self.start_camera)
+        self.start_all_cameras_btn.clicked.connect(self.start_all_cameras)
         self.stop_camera_btn.clicked.connect(self.stop_camera)
         self.tolerance_slider.valueChanged.connect(self.update_tolerance)
+        self.class_combo.currentIndexChanged.connect(self.update_active_class)
         
         # Load available cameras
         self.load_available_cameras()
+        self.update_active_class()
         
         # Initial state
         self.stop_camera_btn.setEnabled(False)
@@ -961,6 +1265,44 @@ class AttendanceMainWindow(QMainWindow):
         except Exception as e:
             print(f"Database connection error: {e}")
     
+    def load_classes(self):
+        """Load classes from database in the background, fall back to default class names"""
+        self.class_combo.clear()
+        if not db_manager:
+            self._populate_classes([])
+            return
+        
+        # A slow or unreachable server must not freeze the window at startup
+        self.class_combo.addItem("Đang tải danh sách lớp...")
+        threading.Thread(target=self._fetch_classes, name="load-classes", daemon=True).start()
+    
+    def _fetch_classes(self):
+        """Runs on the loader thread; the result reaches the UI through classes_loaded"""
+        classes = []
+        try:
+            classes = db_manager.get_all_classes()
+        except Exception as e:
+            print(f"Error loading classes: {e}")
+        
+        try:
+            self.classes_loaded.emit(classes)
+        except RuntimeError:
+            pass  # window already closed
+    
+    def _populate_classes(self, classes):
+        """Fill the class combo box (UI thread)"""
+        self.class_combo.clear()
+        if classes:
+            for class_info in classes:
+                self.class_combo.addItem(class_info['class_name'], class_info['id'])
+        else:
+            self.class_combo.addItems(["Lớp AI", "Lớp CSDL", "Lớp Toán Rời Rạc"])
+    
+    def update_active_class(self):
+        """Scope face matching to the selected class"""
+        if self.face_recognizer:
+            self.face_recognizer.set_active_class(self.class_combo.currentData())
+    
     def load_available_cameras(self):
         """Load available cameras to combo box"""
         try:
@@ -978,63 +1320,146 @@ class AttendanceMainWindow(QMainWindow):
         except Exception as e:
             print(f"Error loading cameras: {e}")
     
+    @property
+    def camera_running(self):
+        return bool(self.camera_sessions)
+    
     def start_camera(self):
-        """Start camera capture"""
+        """Start the camera selected in the combo box, next to any running ones"""
+        camera_id = self.camera_combo.currentData()
+        if camera_id is None:
+            camera_id = CAMERA_CONFIG.get('default_camera_index', 0)
+        self.start_camera_session(camera_id)
+    
+    def start_all_cameras(self):
+        """Start every available camera, up to max_cameras"""
+        for index in range(self.camera_combo.count()):
+            if len(self.camera_sessions) >= CAMERA_CONFIG.get('max_cameras', 3):
+                break
+            camera_id = self.camera_combo.itemData(index)
+            if camera_id not in self.camera_sessions:
+                self.start_camera_session(camera_id, quiet=True)
+    
+    def start_camera_session(self, camera_id, quiet=False):
+        """
+        Start one camera pipeline (capture, detect, match) with its own tile
+        quiet: do not show message boxes (used by start_all_cameras)
+        Returns: True if the camera is running
+        """
         try:
-            if self.camera_running:
-                return
+            if camera_id in self.camera_sessions:
+                return True
+            
+            max_cameras = CAMERA_CONFIG.get('max_cameras', 3)
+            if len(self.camera_sessions) >= max_cameras:
+                if not quiet:
+                    QMessageBox.warning(self, "Cảnh báo", f"Chỉ chạy được tối đa {max_cameras} camera cùng lúc!")
+                return False
+            
+            label = QLabel(f"Camera {camera_id}")
+            label.setStyleSheet("border: 2px solid #ccc; background-color: #f0f0f0;")
+            label.setAlignment(Qt.AlignCenter)
+            
+            session = CameraSession(camera_id, label, self.face_recognizer, self._get_recognition_pool())
+            if not session.start(self, self.on_recognition_results, self.on_recognition_error):
+                label.deleteLater()
+                if not quiet:
+                    QMessageBox.critical(self, "Lỗi", f"Không thể mở camera {camera_id}!")
+                return False
+            
+            self.camera_sessions[camera_id] = session
+            self._layout_camera_tiles()
+            if not self.camera_timer.isActive():
+                self.camera_timer.start(33)
             
-           
-            camera_id = self.camera_combo.currentData()
-            if camera_id is None:
-                camera_id = 0
-            
-            self.camera_capture = cv2.VideoCapture(camera_id)
-            
-            if not self.camera_capture.isOpened():
-                QMessageBox.critical(self, "Lỗi", f"Không thể mở camera {camera_id}!")
-                return
-            
-            
-            self.camera_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-            self.camera_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-            self.camera_capture.set(cv2.CAP_PROP_FPS, 30)
-            
-            self.camera_running = True
-            self.camera_timer.start(33)  
-            
-            self.start_camera_btn.setEnabled(False)
             self.stop_camera_btn.setEnabled(True)
-            self.camera_status_label.setText("Camera: Bật")
+            self._update_camera_status()
             
             log_user_action("START_CAMERA", f"Camera {camera_id}")
+            return True
             
         except Exception as e:
             print(f"Error starting camera: {e}")
-            QMessageBox.critical(self, "Lỗi", f"Lỗi khởi động camera: {str(e)}")
+            if not quiet:
+                QMessageBox.critical(self, "Lỗi", f"Lỗi khởi động camera: {str(e)}")
+            return False
+    
+    def _get_recognition_pool(self):
+        """
+        The one ProcessRecognitionPool of all cameras, started on first use
+        and kept until the window closes; None with the 'thread' backend
+        """
+        if self.face_recognizer is None or PERFORMANCE_CONFIG.get('recognition_backend', 'thread') != 'process':
+            return None
+        if self.recognition_pool is None:
+            self.recognition_pool = ProcessRecognitionPool()
+        return self.recognition_pool
     
     def stop_camera(self):
-        """Stop camera capture"""
+        """Stop all cameras"""
         try:
-            self.camera_running = False
             self.camera_timer.stop()
             
-            if self.camera_capture:
-                self.camera_capture.release()
-                self.camera_capture = None
+            for camera_id in list(self.camera_sessions):
+                self.stop_camera_session(camera_id)
             
             self.camera_label.setText("Camera đã tắt")
             self.camera_label.setPixmap(QPixmap())
             
-            self.start_camera_btn.setEnabled(True)
-            self.stop_camera_btn.setEnabled(False)
-            self.camera_status_label.setText("Camera: Tắt")
-            
             log_user_action("STOP_CAMERA", "Camera stopped")
             
         except Exception as e:
             print(f"Error stopping camera: {e}")
     
+    def stop_camera_session(self, camera_id):
+        """Stop one camera and remove its tile"""
+        session = self.camera_sessions.pop(camera_id, None)
+        if session is None:
+            return
+        
+        try:
+            session.stop()
+        except Exception as e:
+            print(f"Error stopping camera {camera_id}: {e}")
+        
+        self.camera_grid.removeWidget(session.label)
+        session.label.deleteLater()
+        self._layout_camera_tiles()
+        
+        if not self.camera_sessions:
+            self.camera_timer.stop()
+            self.stop_camera_btn.setEnabled(False)
+        self._update_camera_status()
+    
+    def _layout_camera_tiles(self):
+        """Tile the camera previews, two per row when more than one is running"""
+        for session in self.camera_sessions.values():
+            self.camera_grid.removeWidget(session.label)
+        self.camera_grid.removeWidget(self.camera_label)
+        
+        if not self.camera_sessions:
+            self.camera_grid.addWidget(self.camera_label, 0, 0)
+            self.camera_label.show()
+            return
+        
+        self.camera_label.hide()
+        columns = 1 if len(self.camera_sessions) == 1 else 2
+        tile_size = (640, 480) if columns == 1 else (320, 240)
+        for i, session in enumerate(self.camera_sessions.values()):
+            session.label.setMinimumSize(*tile_size)
+            self.camera_grid.addWidget(session.label, i // columns, i % columns)
+    
+    def _update_camera_status(self):
+        """Per-camera FPS / latency in the status bar"""
+        if not self.camera_sessions:
+            self.camera_status_label.setText("Camera: Tắt")
+            return
+        
+        self.camera_status_label.setText(
+            f"Camera: Bật ({len(self.camera_sessions)})  "
+            + "  |  ".join(session.summary() for session in self.camera_sessions.values())
+        )
+    
     def update_tolerance(self, value):
         """Update face recognition tolerance"""
         tolerance = value / 100.0
@@ -1047,24 +1472,30 @@ class AttendanceMainWindow(QMainWindow):
         """Update current time display"""
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         self.time_label.setText(current_time)
+        
+        if self.camera_sessions:
+            self._update_camera_status()
     
     def update_camera_frame(self):
+        """Render the newest frame of every running camera into its tile"""
+        for session in list(self.camera_sessions.values()):
+            self._update_session_frame(session)
+    
+    def _update_session_frame(self, session):
         """FIXED: Cập nhật frame camera với xử lý lỗi đã được sửa"""
-        if not self.camera_running or not self.camera_capture:
-            return
-        
         try:
-            ret, frame = self.camera_capture.read()
-            if not ret or frame is None:
+            # Only the newest frame, and only once
+            frame = session.read()
+            if frame is None:
                 return
-            
-            print(f"[DEBUG] Camera frame: shape={frame.shape}, dtype={frame.dtype}")
-            
-            
+
+            print(f"[DEBUG] {session.name} frame: shape={frame.shape}, dtype={frame.dtype}")
+
+
             if frame.shape[0] < 150 or frame.shape[1] < 150:
                 print(f"❌ Frame too small: {frame.shape}")
-                self.stop_camera()
-                QMessageBox.critical(self, "Lỗi", f"Camera cung cấp độ phân giải quá thấp ({frame.shape}).")
+                self.stop_camera_session(session.camera_id)
+                QMessageBox.critical(self, "Lỗi", f"{session.name} cung cấp độ phân giải quá thấp ({frame.shape}).")
                 return
             
          
@@ -1074,10 +1505,8 @@ class AttendanceMainWindow(QMainWindow):
             if self.face_recognizer:
                 try:
                     
-                    recognition_results = self.face_recognizer.recognize_faces(frame)
-                    
-                    
-                    for result in recognition_results:
+                    # Latest results of the recognition worker, drawn on the newest frame
+                    for result in session.latest_results:
                         location = result.get('location', [])
                         name = result.get('name', 'Unknown')
                         confidence = result.get('confidence', 0.0)
@@ -1095,8 +1524,6 @@ class AttendanceMainWindow(QMainWindow):
                             cv2.rectangle(display_frame, (left, bottom - 35), (right, bottom), color, cv2.FILLED)
                             cv2.putText(display_frame, text, (left + 6, bottom - 6), 
                                     cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
-                   
-                    self.process_attendance(recognition_results)
                     
                 except Exception as e:
                     print(f"❌ Face recognition error: {e}")
@@ -1105,6 +1532,7 @@ class AttendanceMainWindow(QMainWindow):
                 
                 self._use_simple_face_detection(display_frame)
             
+            self._draw_hud(display_frame, session)
             
             try:
                 rgb_image = cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB)
@@ -1114,16 +1542,55 @@ class AttendanceMainWindow(QMainWindow):
                 
                 
                 pixmap = QPixmap.fromImage(qt_image)
-                scaled_pixmap = pixmap.scaled(self.camera_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.camera_label.setPixmap(scaled_pixmap)
+                scaled_pixmap = pixmap.scaled(session.label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                session.label.setPixmap(scaled_pixmap)
                 
             except Exception as display_error:
                 print(f"❌ Display error: {display_error}")
-                self.camera_label.setText(f"Display error: {str(display_error)[:50]}...")
+                session.label.setText(f"Display error: {str(display_error)[:50]}...")
                 
         except Exception as camera_error:
             print(f"❌ Camera error: {camera_error}")
-            self.camera_label.setText(f"Camera error: {str(camera_error)[:50]}...")
+            session.label.setText(f"Camera error: {str(camera_error)[:50]}...")
+    
+    def on_recognition_results(self, results, info):
+        """Results of a camera's recognition worker (runs on the UI thread)"""
+        session = self.camera_sessions.get(info.get('camera_id'))
+        if session is None:
+            return
+        
+        session.update_results(results, info)
+        self.process_attendance(results, session)
+    
+    def on_recognition_error(self, message):
+        """Error raised inside a recognition worker"""
+        print(f"❌ Face recognition error: {message}")
+    
+    def _draw_hud(self, display_frame, session):
+        """Draw camera name / FPS / processing time / motion gate stats on the frame"""
+        lines = []
+        if UI_CONFIG.get('show_fps_counter', True):
+            fps_line = f"FPS: {session.fps:.1f}"
+            if session.reader is not None:
+                fps_line += f"  dropped {session.reader.dropped_frames}"
+            if session.lag_ms is not None:
+                fps_line += f"  lag {session.lag_ms:.0f} ms"
+            lines.append(fps_line)
+        if DEBUG_CONFIG.get('show_processing_time', True):
+            lines.append(f"Processing: {session.processing_ms:.1f} ms")
+            
+            pipeline = session.pipeline
+            gate = pipeline.motion_gate if pipeline else None
+            if gate is not None:
+                score = "-" if gate.last_score == float('inf') else f"{gate.last_score:.1f}"
+                lines.append(f"Motion: {score}/{gate.threshold:.1f}  skipped {gate.skip_ratio:.0%}")
+            if pipeline is not None:
+                lines.append(f"Adaptive: {pipeline.controller.summary()}")
+        lines.append(f"{session.name}  marked {session.marks}")
+        
+        for i, line in enumerate(lines):
+            cv2.putText(display_frame, line, (10, display_frame.shape[0] - 12 - 22 * i),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.55, (255, 255, 0), 1)
     
     def _use_simple_face_detection(self, display_frame):
         """FIXED: Enhanced fallback face detection"""
@@ -1145,13 +1612,19 @@ class AttendanceMainWindow(QMainWindow):
             cv2.putText(display_frame, f"Detection error", (10, 30), 
                     cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 255), 1)
     
-    def process_attendance(self, recognition_results):
-        """Process attendance from recognition results"""
+    def process_attendance(self, recognition_results, session=None):
+        """
+        Process attendance from recognition results
+        session: CameraSession the results come from; every camera feeds this
+        one sink on the UI thread, so a student seen by two entrances is
+        marked once, by whichever camera reported first
+        """
         if not self.auto_attendance_cb.isChecked():
             return
         
         try:
             current_time = datetime.now()
+            camera_name = session.name if session is not None else "Camera"
             
             for result in recognition_results:
                 user_id = result.get('user_id')
@@ -1163,13 +1636,19 @@ class AttendanceMainWindow(QMainWindow):
                    
                     if not self.is_already_present(student_id):
                         self.add_attendance_record(student_id, name, current_time, confidence)
-                        log_user_action("AUTO_ATTENDANCE", f"{name} ({student_id}) - {confidence:.2f}")
+                        self.attendance_marks[student_id] = session.camera_id if session is not None else None
+                        if session is not None:
+                            session.marks += 1
+                        log_user_action("AUTO_ATTENDANCE", f"{name} ({student_id}) - {confidence:.2f} [{camera_name}]")
                         
         except Exception as e:
             print(f"Error processing attendance: {e}")
     
     def is_already_present(self, student_id):
         """Check if student is already marked present today"""
+        if student_id in self.attendance_marks:
+            return True
+        
         try:
             for row in range(self.attendance_table.rowCount()):
                 table_student_id = self.attendance_table.item(row, 0)
@@ -1221,6 +1700,9 @@ class AttendanceMainWindow(QMainWindow):
         
         if reply == QMessageBox.Yes:
             self.attendance_table.setRowCount(0)
+            self.attendance_marks.clear()
+            for session in self.camera_sessions.values():
+                session.marks = 0
             self.update_statistics()
             log_user_action("NEW_SESSION", "Started new attendance session")
     
@@ -1230,9 +1712,10 @@ class AttendanceMainWindow(QMainWindow):
             dialog = UserManagementDialog(self)
             dialog.exec_()
             
-            
+            # Only the users added in the dialog need encoding
             if self.face_recognizer:
-                self.face_recognizer.load_known_faces()
+                for user in dialog.added_users:
+                    self.face_recognizer.add_user(user)
                 
         except Exception as e:
             print(f"Error opening user management: {e}")
@@ -1244,8 +1727,8 @@ class AttendanceMainWindow(QMainWindow):
             dialog = AddUserDialog(self)
             if dialog.exec_() == QDialog.Accepted:
                
-                if self.face_recognizer:
-                    self.face_recognizer.load_known_faces()
+                if self.face_recognizer and dialog.new_user:
+                    self.face_recognizer.add_user(dialog.new_user)
                     
         except Exception as e:
             print(f"Error opening add user dialog: {e}")
@@ -1304,9 +1787,19 @@ class AttendanceMainWindow(QMainWindow):
         """Handle application close"""
         try:
             
-            if self.camera_running:
+            if self.camera_sessions:
                 self.stop_camera()
             
+            if self.recognition_pool is not None:
+                self.recognition_pool.close()
+                self.recognition_pool = None
+            
+            if self.face_recognizer is not None:
+                self.face_recognizer.close()
+            
+            if mediapipe_pool is not None:
+                mediapipe_pool.close_all()
+            
             log_system_event("SHUTDOWN", "Ứng dụng đã tắt")
             event.accept()
             
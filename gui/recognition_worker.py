@@ -0,0 +1,129 @@
+# gui/recognition_worker.py
+
+"""
+Background recognition worker
+Detection, encoding and matching run on a QThread that pulls the newest
+frame from the camera reader; results reach the UI through Qt signals, so
+the window keeps rendering at camera rate however slow the recognizer is
+"""
+
+import time
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+try:
+    from face_recognition_modules.mediapipe_recognizer import mediapipe_pool
+except ImportError:
+    mediapipe_pool = None
+
+
+class RecognitionWorker(QThread):
+    """
+    reader: utils.camera.CameraReader supplying frames
+    recognize: callable(frame) -> list of result dicts, e.g.
+        RecognitionPipeline.process; only ever called on the worker thread
+    camera_id: echoed in every info dict, so one slot can serve several cameras
+    results_ready(results, info): info has camera_id, frame_id, captured_at
+        and processing_ms of the frame the results belong to
+    """
+
+    results_ready = pyqtSignal(list, dict)
+    error = pyqtSignal(str)
+
+    def __init__(self, reader, recognize, parent=None, camera_id=None):
+        super().__init__(parent)
+        self.reader = reader
+        self.recognize = recognize
+        self.camera_id = camera_id
+        self._running = False
+
+    def start(self, *args, **kwargs):
+        self._running = True
+        super().start(*args, **kwargs)
+
+    def run(self):
+        last_frame_id = 0
+
+        try:
+            while self._running:
+                frame, captured_at, frame_id = self.reader.read(last_frame_id, timeout=0.1)
+                if frame is None:
+                    continue
+                last_frame_id = frame_id
+
+                started = time.perf_counter()
+                try:
+                    results = self.recognize(frame)
+                except Exception as e:
+                    self.error.emit(str(e))
+                    continue
+
+                if not self._running:
+                    break
+
+                self.results_ready.emit(results, {
+                    'camera_id': self.camera_id,
+                    'frame_id': frame_id,
+                    'captured_at': captured_at,
+                    'processing_ms': (time.perf_counter() - started) * 1000,
+                })
+        finally:
+            # MediaPipe graphs built by this thread must not outlive it
+            if mediapipe_pool is not None:
+                mediapipe_pool.release_thread()
+
+    def stop(self, timeout_ms: int = 5000) -> bool:
+        """Yêu cầu dừng và chờ thread kết thúc; False nếu hết thời gian chờ"""
+        self._running = False
+        if self.isRunning():
+            return self.wait(timeout_ms)
+        return True
+
+
+class PoolRecognitionWorker(RecognitionWorker):
+    """
+    Feeds frames to a ProcessRecognitionPool instead of recognizing them here
+    pool: ProcessRecognitionPool doing detection and encoding, possibly shared
+        with other cameras; frames and results are keyed by camera_id
+    match: callable(locations, encodings) -> list of result dicts, e.g.
+        SafeFaceRecognizer.recognize_encodings
+    Results are emitted in frame order; frames the pool dropped emit nothing
+    """
+
+    def __init__(self, reader, pool, match, parent=None, camera_id=None):
+        super().__init__(reader, None, parent, camera_id)
+        self.pool = pool
+        self.match = match
+
+    def run(self):
+        last_frame_id = 0
+
+        try:
+            while self._running:
+                frame, captured_at, frame_id = self.reader.read(last_frame_id, timeout=0.005)
+                if frame is not None:
+                    last_frame_id = frame_id
+                    self.pool.submit(frame, frame_id, {
+                        'captured_at': captured_at,
+                        'submitted_at': time.perf_counter(),
+                    }, stream=self.camera_id)
+
+                for frame_id, locations, encodings, info in self.pool.poll(timeout=0.005, stream=self.camera_id):
+                    try:
+                        results = self.match(locations, encodings)
+                    except Exception as e:
+                        self.error.emit(str(e))
+                        continue
+
+                    if not self._running:
+                        break
+
+                    self.results_ready.emit(results, {
+                        'camera_id': self.camera_id,
+                        'frame_id': frame_id,
+                        'captured_at': info.get('captured_at'),
+                        'processing_ms': (time.perf_counter() - info['submitted_at']) * 1000,
+                    })
+        finally:
+            if mediapipe_pool is not None:
+                mediapipe_pool.release_thread()
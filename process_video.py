@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Offline attendance from a recorded session (headless, no window)
+
+Usage:
+    python process_video.py lecture.mp4 --csv attendance.csv [--stride 5] [--workers 2]
+    python process_video.py lecture.mp4 --class-id 3 [--start "2025-07-15 08:00:00"]
+
+Every `stride`-th frame of the video goes through recognition, either on
+`workers` detection / encoding processes (ProcessRecognitionPool, matching
+stays here) or, with --workers 0, in this process through the tracking
+RecognitionPipeline. Each known face is marked present once, at the time
+it first appears: recording start + its offset in the video.
+With --class-id the records go to DatabaseManager.add_attendance (and
+matching is scoped to the class), with --csv to a CSV file; both may be
+given. Run it from the project root, like main.py, so data/ is found.
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import cv2
+
+from face_recognition_modules.adaptive_controller import AdaptiveController
+from face_recognition_modules.pipeline import RecognitionPipeline
+from face_recognition_modules.process_pool import ProcessRecognitionPool
+
+try:
+    from config import PERFORMANCE_CONFIG
+except ImportError:
+    PERFORMANCE_CONFIG = {}
+
+
+def open_video(path: str):
+    """Returns: (capture, fps, frame_count); fps falls back to 30 when unknown"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        capture.release()
+        raise IOError(f"Không thể mở video: {path}")
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    return capture, fps, frame_count
+
+
+def read_frames(capture, stride: int, counter: dict):
+    """
+    Yield (frame_index, frame) for every stride-th frame
+    Skipped frames are only grabbed, never retrieved / converted
+    counter['decoded'] counts all frames read from the file
+    """
+    frame_index = 0
+    while True:
+        if frame_index % stride:
+            if not capture.grab():
+                break
+        else:
+            ret, frame = capture.read()
+            if not ret or frame is None:
+                break
+            yield frame_index, frame
+        frame_index += 1
+        counter['decoded'] = frame_index
+
+
+def recognize_in_process(recognizer, frames, stream):
+    """Tracking pipeline on this process; yields (frame_index, results)"""
+    # Offline there is no latency budget: full quality, stride applied by read_frames
+    pipeline = RecognitionPipeline(recognizer, stream=stream,
+                                   controller=AdaptiveController(enabled=False, stride=1))
+    for frame_index, frame in frames:
+        yield frame_index, pipeline.process(frame)
+
+
+def recognize_with_pool(recognizer, frames, workers: int):
+    """
+    Detection / encoding on worker processes, matching here; yields (frame_index, results)
+    Decoded frames are BGR like camera frames; the pool workers convert them to RGB
+    """
+    with ProcessRecognitionPool(num_workers=workers) as pool:
+        for frame_index, frame in frames:
+            # Submit only when a worker is idle: nothing is dropped, the file waits instead
+            while pool.alive_workers and pool.in_flight >= pool.alive_workers:
+                for result_index, locations, encodings, _ in pool.poll(timeout=1.0):
+                    yield result_index, recognizer.recognize_encodings(locations, encodings)
+            if not pool.submit(frame, frame_index):
+                raise RuntimeError("Không còn worker nhận dạng nào hoạt động")
+
+        for result_index, locations, encodings, _ in pool.drain(timeout=60.0):
+            yield result_index, recognizer.recognize_encodings(locations, encodings)
+
+
+def collect_attendance(results, min_confidence: float = 0.5):
+    """
+    First sighting of every known user, as the live window marks them
+    Returns: {user_id: {'name', 'student_id', 'frame_index', 'confidence'}}
+    """
+    present = {}
+    for frame_index, frame_results in results:
+        for result in frame_results:
+            user_id = result.get('user_id')
+            confidence = result.get('confidence', 0.0)
+            if user_id is None or result.get('name', 'Unknown') == 'Unknown' or confidence <= min_confidence:
+                continue
+
+            record = present.get(user_id)
+            if record is None:
+                present[user_id] = {
+                    'name': result['name'],
+                    'student_id': result.get('student_id', ''),
+                    'frame_index': frame_index,
+                    'confidence': confidence,
+                }
+            elif confidence > record['confidence']:
+                record['confidence'] = confidence
+    return present
+
+
+def write_csv(path: str, present: dict, timestamps: dict):
+    """Same columns as the window's CSV export, plus the date"""
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Mã SV", "Họ tên", "Ngày", "Thời gian", "Trạng thái", "Độ tin cậy"])
+        for user_id, record in sorted(present.items(), key=lambda item: item[1]['frame_index']):
+            seen_at = timestamps[user_id]
+            writer.writerow([record['student_id'], record['name'], seen_at.strftime("%Y-%m-%d"),
+                             seen_at.strftime("%H:%M:%S"), "Có mặt", f"{record['confidence']:.2f}"])
+
+
+def write_database(present: dict, timestamps: dict, class_id: int) -> int:
+    """
+    Returns: number of records added; users already marked that day are skipped
+    present is keyed by the users.json id; the database row is looked up by
+    student_id, since the two id spaces are unrelated
+    """
+    try:
+        from database.db import db_manager
+    except ImportError as e:
+        print(f"❌ Database not available: {e}")
+        return 0
+
+    added = 0
+    for user_id, record in present.items():
+        db_user = db_manager.get_user_by_student_id(record['student_id']) if record['student_id'] else None
+        if not db_user:
+            print(f"❌ {record['name']} ({record['student_id']}) is not in the database, attendance not saved")
+            continue
+
+        seen_at = timestamps[user_id]
+        attendance_date = seen_at.strftime("%Y-%m-%d")
+        if db_manager.check_attendance_exists(db_user['id'], class_id, attendance_date):
+            continue
+        if db_manager.add_attendance(db_user['id'], class_id, attendance_date, seen_at.strftime("%H:%M:%S")):
+            added += 1
+        else:
+            print(f"❌ Could not save attendance of {record['name']} ({record['student_id']})")
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline attendance from a recorded video")
+    parser.add_argument('video', help="video file of the session")
+    parser.add_argument('--stride', type=int, default=PERFORMANCE_CONFIG.get('offline_frame_stride', 5),
+                        help="process every N-th frame (default: PERFORMANCE_CONFIG['offline_frame_stride'])")
+    parser.add_argument('--workers', type=int, default=PERFORMANCE_CONFIG.get('face_recognition_workers', 2),
+                        help="recognition processes; 0 = in this process with tracking")
+    parser.add_argument('--class-id', type=int, default=None,
+                        help="write to the database for this class (DatabaseManager.add_attendance)")
+    parser.add_argument('--csv', default=None, help="write the attendance to this CSV file")
+    parser.add_argument('--start', default=None,
+                        help="recording start 'YYYY-MM-DD HH:MM:SS' (default: file time minus duration)")
+    parser.add_argument('--min-confidence', type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    if args.class_id is None and not args.csv:
+        parser.error("cần --class-id hoặc --csv để ghi kết quả điểm danh")
+    if args.stride < 1 or args.workers < 0:
+        parser.error("--stride phải >= 1 và --workers phải >= 0")
+
+    try:
+        capture, fps, frame_count = open_video(args.video)
+    except IOError as e:
+        print(f"❌ {e}")
+        return 1
+    if args.start:
+        start = datetime.strptime(args.start, "%Y-%m-%d %H:%M:%S")
+    else:
+        # A recording is written until it ends: its file time is the end of the session
+        start = datetime.fromtimestamp(os.path.getmtime(args.video)) - timedelta(seconds=frame_count / fps)
+
+    # Imported here: loading the gallery initialises the recognizer (MediaPipe / dlib)
+    from gui.main_window import SafeFaceRecognizer, mediapipe_pool
+    recognizer = SafeFaceRecognizer()
+    recognizer.load_known_faces()
+    recognizer.set_active_class(args.class_id)
+    if not recognizer.known_faces:
+        print("❌ No known faces loaded, nobody can be marked present")
+
+    counter = {'decoded': 0}
+    processed = [0]
+
+    def counted(frames):
+        for item in frames:
+            processed[0] += 1
+            yield item
+
+    frames = counted(read_frames(capture, args.stride, counter))
+    started = time.perf_counter()
+    try:
+        if args.workers > 0:
+            results = recognize_with_pool(recognizer, frames, args.workers)
+        else:
+            results = recognize_in_process(recognizer, frames, args.video)
+        present = collect_attendance(results, args.min_confidence)
+    finally:
+        capture.release()
+        recognizer.close()
+        if mediapipe_pool is not None:
+            mediapipe_pool.close_all()
+    elapsed = time.perf_counter() - started
+
+    timestamps = {
+        user_id: start + timedelta(seconds=record['frame_index'] / fps)
+        for user_id, record in present.items()
+    }
+    if args.csv:
+        write_csv(args.csv, present, timestamps)
+    added = write_database(present, timestamps, args.class_id) if args.class_id is not None else 0
+
+    video_seconds = counter['decoded'] / fps
+    print(f"Offline attendance: {args.video}")
+    print("=" * 62)
+    mode = f"{args.workers} worker processes" if args.workers > 0 else "in-process, tracking"
+    print(f"{'mode':<28}{mode}, stride {args.stride}")
+    print(f"{'frames decoded / processed':<28}{counter['decoded']} / {processed[0]}")
+    print(f"{'wall time':<28}{elapsed:.1f} s for {video_seconds:.1f} s of video "
+          f"({video_seconds / elapsed if elapsed else 0.0:.1f}x real time)")
+    print(f"{'throughput':<28}{counter['decoded'] / elapsed if elapsed else 0.0:.1f} fps decoded, "
+          f"{processed[0] / elapsed if elapsed else 0.0:.1f} fps recognized")
+    print(f"{'present':<28}{len(present)}")
+    for user_id, record in sorted(present.items(), key=lambda item: item[1]['frame_index']):
+        print(f"  {record['student_id']:<12}{record['name']:<24}"
+              f"{timestamps[user_id].strftime('%H:%M:%S')}  {record['confidence']:.2f}")
+    if args.csv:
+        print(f"CSV: {args.csv}")
+    if args.class_id is not None:
+        print(f"Database: {added} records added to class {args.class_id}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# utils/camera.py
+
+"""
+Threaded camera capture
+Một thread cho mỗi camera liên tục đọc frame vào buffer, người dùng luôn
+nhận frame mới nhất kèm thời điểm chụp thay vì đọc frame cũ đang xếp hàng
+trong driver
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    from config import CAMERA_CONFIG
+except ImportError:
+    CAMERA_CONFIG = {}
+
+
+class CameraReader:
+    """
+    Đọc camera trên thread riêng vào ring buffer nhỏ (mặc định 1 frame)
+    source: chỉ số camera hoặc đường dẫn / URL video
+    Frame bị ghi đè trước khi được đọc lần nào được tính vào dropped_frames
+    """
+
+    def __init__(self, source=0, width: Optional[int] = None, height: Optional[int] = None,
+                 fps: Optional[int] = None, buffer_size: int = 1):
+        self.source = source
+        self.width = width or CAMERA_CONFIG.get('frame_width', 640)
+        self.height = height or CAMERA_CONFIG.get('frame_height', 480)
+        self.fps = fps or CAMERA_CONFIG.get('fps', 30)
+        self._buffer = deque(maxlen=max(1, buffer_size))
+        self._condition = threading.Condition()
+        self._capture = None
+        self._thread = None
+        self._running = False
+        self._refs = 0
+
+        self.frame_id = 0
+        self.captured_frames = 0
+        self.dropped_frames = 0
+        self.failed_reads = 0
+
+    def start(self) -> bool:
+        """Mở camera và bắt đầu thread đọc; False nếu không mở được"""
+        if self._running:
+            return True
+
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            capture.release()
+            return False
+
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        capture.set(cv2.CAP_PROP_FPS, self.fps)
+        # Keep the driver queue short, this thread drains it anyway
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, CAMERA_CONFIG.get('buffer_size', 1))
+
+        self._capture = capture
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"camera-{self.source}", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        while self._running:
+            ret, frame = self._capture.read()
+            timestamp = time.time()
+
+            if not ret or frame is None:
+                self.failed_reads += 1
+                time.sleep(0.01)
+                continue
+
+            with self._condition:
+                self.frame_id += 1
+                self.captured_frames += 1
+                if len(self._buffer) == self._buffer.maxlen and not self._buffer[0][3]:
+                    self.dropped_frames += 1
+                self._buffer.append([frame, timestamp, self.frame_id, False])
+                self._condition.notify_all()
+
+    def read(self, after_id: int = 0, timeout: Optional[float] = None
+             ) -> Tuple[Optional[np.ndarray], Optional[float], int]:
+        """
+        Frame mới nhất
+        after_id: chỉ trả về frame có id lớn hơn (chờ tối đa timeout giây);
+            0 = trả ngay frame mới nhất hiện có
+        Returns: (frame, capture timestamp, frame_id) hoặc (None, None, after_id)
+        """
+        with self._condition:
+            if timeout and not (self._buffer and self._buffer[-1][2] > after_id):
+                self._condition.wait_for(
+                    lambda: not self._running or (self._buffer and self._buffer[-1][2] > after_id),
+                    timeout
+                )
+
+            if not self._buffer or self._buffer[-1][2] <= after_id:
+                return None, None, after_id
+
+            entry = self._buffer[-1]
+            entry[3] = True
+            return entry[0], entry[1], entry[2]
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    @property
+    def drop_ratio(self) -> float:
+        return self.dropped_frames / self.captured_frames if self.captured_frames else 0.0
+
+    def stop(self):
+        """Dừng thread đọc và giải phóng camera"""
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+        self._buffer.clear()
+
+    def release(self):
+        """Trả reader lấy từ acquire_camera_reader(); dừng khi không còn ai dùng"""
+        with _readers_lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            if _readers.get(self.source) is self:
+                del _readers[self.source]
+        self.stop()
+
+
+_readers: Dict[object, CameraReader] = {}
+_readers_lock = threading.Lock()
+
+
+def acquire_camera_reader(source=0, **kwargs) -> Optional[CameraReader]:
+    """
+    Reader dùng chung cho một camera: nhiều cửa sổ cùng đọc một thiết bị
+    thay vì mở nó hai lần. Gọi reader.release() khi không dùng nữa
+    Returns: CameraReader đang chạy, hoặc None nếu không mở được camera
+    """
+    with _readers_lock:
+        reader = _readers.get(source)
+        if reader is None:
+            reader = CameraReader(source, **kwargs)
+            if not reader.start():
+                return None
+            _readers[source] = reader
+        reader._refs += 1
+        return reader
@@ -174,6 +174,57 @@ def filter_large_faces(face_locations: List[Tuple[int, int, int, int]],
     """Lọc các khuôn mặt đủ lớn"""
     return [loc for loc in face_locations if calculate_face_area(loc) >= min_area]
 
+def expand_face_location(face_location: Tuple[int, int, int, int], margin: float,
+                         width: int, height: int) -> Tuple[int, int, int, int]:
+    """
+    Mở rộng khung khuôn mặt thêm margin (tỉ lệ theo kích thước khung) mỗi phía,
+    giới hạn trong ảnh width x height
+    Returns: (top, right, bottom, left)
+    """
+    top, right, bottom, left = face_location
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    return (max(0, top - pad_y), min(width, right + pad_x),
+            min(height, bottom + pad_y), max(0, left - pad_x))
+
+def face_location_iou(locations_a: List[Tuple[int, int, int, int]],
+                      locations_b: List[Tuple[int, int, int, int]]) -> np.ndarray:
+    """
+    Ma trận IoU giữa hai danh sách khuôn mặt (top, right, bottom, left)
+    Returns: mảng (len(locations_a), len(locations_b))
+    """
+    a = np.asarray(locations_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(locations_b, dtype=np.float32).reshape(-1, 4)
+    
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    right = np.minimum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    left = np.maximum(a[:, None, 3], b[None, :, 3])
+    
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area_a = (a[:, 1] - a[:, 3]) * (a[:, 2] - a[:, 0])
+    area_b = (b[:, 1] - b[:, 3]) * (b[:, 2] - b[:, 0])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+def match_face_locations(locations_a: List[Tuple[int, int, int, int]],
+                         locations_b: List[Tuple[int, int, int, int]],
+                         min_iou: float = 0.3) -> List[Tuple[int, int]]:
+    """
+    Ghép cặp khuôn mặt giữa hai danh sách theo IoU lớn nhất (greedy)
+    Returns: danh sách cặp (index trong a, index trong b)
+    """
+    iou = face_location_iou(locations_a, locations_b)
+    pairs = []
+    
+    while iou.size and iou.max() >= min_iou:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        pairs.append((int(i), int(j)))
+        iou[i, :] = -1
+        iou[:, j] = -1
+    
+    return pairs
+
 def get_image_info(filepath: str) -> dict:
     """Lấy thông tin ảnh"""
     info = {